@@ -0,0 +1,232 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from pkg.api.constants import FAH_V2_V3_USB_VID_PID, lunii_generic_key
+from pkg.api.convert_image import image_to_bitmap_rle4, image_to_bitmap_rle4_legacy
+from pkg.api.device_lunii import LuniiDevice
+from pkg.api.device_writer import DeviceWriter
+from pkg.api.pipeline import ARCHIVE_COMPRESSION
+from pkg.api.stories import StudioStory
+from pkg.api.transcode_cache import TRANSCODE_CACHE
+
+
+def timed(func, *args, loops=1):
+    start = time.perf_counter()
+    for _ in range(loops):
+        result = func(*args)
+    return (time.perf_counter() - start) / loops, result
+
+
+def bench_rle4(loops=5):
+    # measuring encoders, not the cache
+    TRANSCODE_CACHE.max_size = 0
+
+    rng = np.random.default_rng(0)
+
+    # noisy frame (worst case, short runs) and drawing like frame (long runs)
+    noisy = rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    drawing = np.zeros((240, 320, 3), dtype=np.uint8)
+    drawing[:, 80:240] = (200, 180, 20)
+    drawing[60:180, :] = (20, 40, 220)
+
+    print("RLE4 encoder (320x240 frame)")
+    print("{:10} | {:>10} | {:>10} | {:>7}".format("Image", "legacy", "numpy", "speedup"))
+    for name, frame in [("noisy", noisy), ("drawing", drawing)]:
+        png = BytesIO()
+        Image.fromarray(frame).save(png, "PNG")
+        png = png.getvalue()
+
+        t_legacy, bmp_legacy = timed(image_to_bitmap_rle4_legacy, png, loops=loops)
+        t_numpy, bmp_numpy = timed(image_to_bitmap_rle4, png, loops=loops)
+        assert bmp_legacy == bmp_numpy, "encoders are not byte identical"
+
+        print(f"{name:10} | {t_legacy*1000:8.1f}ms | {t_numpy*1000:8.1f}ms | {t_legacy/t_numpy:6.1f}x")
+
+
+# STUdio story.json with nodes_count stage nodes, each one leading to an action node of 3 options
+def synthetic_studio_story(nodes_count):
+    snodes_uuid = [str(uuid.UUID(int=index + 1)) for index in range(nodes_count)]
+    controls = {"wheel": 1, "ok": 1, "home": 1, "pause": 0, "autoplay": 0}
+
+    snodes = []
+    anodes = []
+    for index, snode_uuid in enumerate(snodes_uuid):
+        anode_id = f"action-{index}"
+        anodes.append({"id": anode_id,
+                       "options": [snodes_uuid[(index + step) % nodes_count] for step in range(1, 4)]})
+        snodes.append({"uuid": snode_uuid,
+                       "image": f"{index:08X}.png" if index % 2 == 0 else None,
+                       "audio": f"{index:08X}.mp3",
+                       "okTransition": {"actionNode": anode_id, "optionIndex": 0},
+                       "homeTransition": {"actionNode": f"action-{index // 2}", "optionIndex": 1} if index else None,
+                       "controlSettings": controls})
+
+    return {"format": "v1", "version": 1, "title": "Synthetic", "description": "Benchmark story",
+            "stageNodes": snodes, "actionNodes": anodes}
+
+
+def bench_studio(nodes_count=10000, loops=3):
+    story_json = synthetic_studio_story(nodes_count)
+
+    print(f"STUdio story compilation ({nodes_count} stage nodes, {3 * nodes_count} options)")
+    print("{:10} | {:>10}".format("Step", "time"))
+    t_load, story = timed(StudioStory, story_json, loops=loops)
+    print(f"{'load':10} | {t_load*1000:8.1f}ms")
+    for step, func in [("ni", story.get_ni_data), ("li", story.get_li_data),
+                       ("ri", story.get_ri_data), ("si", story.get_si_data)]:
+        t_step, _ = timed(func, loops=loops)
+        print(f"{step:10} | {t_step*1000:8.1f}ms")
+    t_write, _ = timed(story.write_ni, BytesIO(), loops=loops)
+    print(f"{'ni (file)':10} | {t_write*1000:8.1f}ms")
+
+
+# Lunii v2 like device (random device key) holding one story of assets_count images and audio files
+def synthetic_lunii_device(root_path, assets_count):
+    rng = np.random.default_rng(0)
+    story_uuid = uuid.UUID(int=0x1234)
+    short_uuid = story_uuid.hex.upper()[-8:]
+
+    md = bytearray(0x200)
+    md[0:2] = (3).to_bytes(2, 'little')
+    md[6:10] = (2).to_bytes(2, 'little') + (1).to_bytes(2, 'little')
+    md[10:18] = rng.bytes(8)
+    md[18:22] = FAH_V2_V3_USB_VID_PID[0].to_bytes(2, 'little') + FAH_V2_V3_USB_VID_PID[1].to_bytes(2, 'little')
+    md[0x100:0x200] = rng.bytes(0x100)
+    Path(root_path, ".md").write_bytes(md)
+    Path(root_path, ".pi").write_bytes(story_uuid.bytes)
+
+    device = LuniiDevice(root_path)
+    story_path = Path(root_path, LuniiDevice.STORIES_BASEDIR, short_uuid)
+    os.makedirs(story_path.joinpath("rf", "000"))
+    os.makedirs(story_path.joinpath("sf", "000"))
+
+    # index files from a STUdio story, drawing like images, audio as incompressible data
+    story = StudioStory(synthetic_studio_story(assets_count))
+    files = {"ni": story.get_ni_data(), "li": story.get_li_data(), "ri": story.get_ri_data(), "si": story.get_si_data()}
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    for index in range(assets_count):
+        frame[:, (index * 8) % 320:] = rng.integers(0, 256, 3, dtype=np.uint8)
+        png = BytesIO()
+        Image.fromarray(frame).save(png, "PNG")
+        files[f"rf/000/{index:08X}"] = image_to_bitmap_rle4(png.getvalue())
+        files[f"sf/000/{index:08X}"] = rng.bytes(64 * 1024)
+
+    for name, data in files.items():
+        if name != "ni":
+            data = device.cipher(data, lunii_generic_key)
+        story_path.joinpath(name).write_bytes(data)
+    return device, short_uuid
+
+
+def bench_export(assets_count=100):
+    TRANSCODE_CACHE.max_size = 0
+
+    print(f"Story export ({assets_count} images, {assets_count} audio files)")
+    print("{:10} | {:>10} | {:>10} | {:>7}".format("Policy", "time", "size", "ratio"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        device, short_uuid = synthetic_lunii_device(tmp_dir, assets_count)
+        plain_size = sum(f.stat().st_size for f in Path(tmp_dir, LuniiDevice.STORIES_BASEDIR).rglob("*") if f.is_file())
+
+        for policy in ARCHIVE_COMPRESSION:
+            device.export_compression = policy
+            out_path = Path(tmp_dir, policy)
+            out_path.mkdir()
+            t_export, zip_path = timed(device.export_story, short_uuid, out_path)
+            zip_size = zip_path.stat().st_size
+            print(f"{policy:10} | {t_export*1000:8.1f}ms | {zip_size//1024:7} KB | {100*zip_size/plain_size:6.1f}%")
+
+
+# FAT32 image mounted on a loop device, closest to a storyteller over USB (Linux, root and dosfstools)
+@contextmanager
+def loopback_vfat(size_mb=512):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image = os.path.join(tmp_dir, "device.img")
+        mount_point = os.path.join(tmp_dir, "mnt")
+        with open(image, "wb") as fp:
+            fp.truncate(size_mb * 1024 * 1024)
+        os.mkdir(mount_point)
+
+        subprocess.run(["mkfs.vfat", "-F", "32", image], check=True, capture_output=True)
+        subprocess.run(["mount", "-o", "loop", image, mount_point], check=True, capture_output=True)
+        try:
+            yield mount_point
+        finally:
+            subprocess.run(["umount", mount_point], check=True)
+
+
+# story files as produced by a STUdio import : images and audio interleaved, ciphered header + payload
+def synthetic_story_files(assets_count):
+    rng = np.random.default_rng(0)
+    files = [(name, [rng.bytes(0x200), rng.bytes(0x4000)]) for name in ["ri", "si", "li"]]
+    for index in range(assets_count):
+        files.append((f"rf/000/{index:08X}", [rng.bytes(0x200), rng.bytes(20 * 1024)]))
+        files.append((f"sf/000/{index:08X}", [rng.bytes(0x200), rng.bytes(400 * 1024)]))
+    return files
+
+
+def write_files_legacy(story_path, files):
+    for name, chunks in files:
+        target = Path(story_path, name)
+        if not target.parent.exists():
+            target.parent.mkdir(parents=True)
+        with open(target, "wb") as f_dst:
+            f_dst.writelines(chunks)
+    os.sync()
+
+
+def write_files_writer(story_path, files, preallocate=False):
+    writer = DeviceWriter(preallocate=preallocate)
+    for name, chunks in files:
+        writer.write(Path(story_path, name), chunks)
+    writer.flush()
+    writer.sync()
+
+
+# device directory from BENCH_DEVICE (mounted storyteller, USB stick...), else a loopback FAT32 image
+def bench_writer(assets_count=100):
+    files = synthetic_story_files(assets_count)
+    total_size = sum(len(chunk) for _, chunks in files for chunk in chunks)
+    policies = [("legacy", write_files_legacy),
+                ("writer", write_files_writer),
+                ("prealloc", lambda path, data: write_files_writer(path, data, preallocate=True))]
+
+    print(f"Story write ({len(files)} files, {total_size//1024//1024} MB)")
+    with ExitStack() as stack:
+        try:
+            root_path = os.environ.get("BENCH_DEVICE") or stack.enter_context(loopback_vfat())
+        except (FileNotFoundError, subprocess.CalledProcessError) as e:
+            print(f"Loopback FAT32 image not available ({e}), set BENCH_DEVICE to a mounted device directory")
+            return
+
+        print(f"Target : {root_path}")
+        print("{:10} | {:>10} | {:>10}".format("Policy", "time", "rate"))
+        for policy, write_files in policies:
+            story_path = Path(root_path, f"bench-{policy}")
+            shutil.rmtree(story_path, ignore_errors=True)
+            t_write, _ = timed(write_files, story_path, files)
+            shutil.rmtree(story_path)
+            print(f"{policy:10} | {t_write*1000:8.1f}ms | {total_size/1024/1024/t_write:6.1f} MB/s")
+
+
+BENCHMARKS = {
+    "rle4": bench_rle4,
+    "studio": bench_studio,
+    "export": bench_export,
+    "writer": bench_writer,
+}
+
+if __name__ == '__main__':
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for bench in selected:
+        BENCHMARKS[bench]()
@@ -1,12 +1,14 @@
 import os
 import click
 import logging
+import multiprocessing
 
 from lunii_logging import initialize_logger
-from pkg.api.constants import LUNII_V3, V3_KEYS, LUNII_LOGGER
+from pkg.api.constants import LUNII_V3, V3_KEYS, LUNII_LOGGER, TRANSCODING_WORKERS, EXPORT_WORKERS, EXPORT_COMPRESSION
 from pkg.api.device_lunii import LuniiDevice, is_lunii
 from pkg.api.device_flam import FlamDevice, is_flam
 from pkg.api.devices import find_devices
+from pkg.api.pipeline import ARCHIVE_COMPRESSION
 from pkg.api.stories import story_load_db
 
 
@@ -30,7 +32,11 @@ def exit_help():
 @click.option('--pack-export', '-pe', "exp", type=str, default=None, help="Export selected story to an archive (or use ALL)")
 @click.option('--pack-import', '-pi', "imp", type=click.Path(exists=True, file_okay=True, dir_okay=True), default=None, help="Import a story archive in the Lunii")
 @click.option('--pack-remove', '-pr', "rem", type=str, default=None, help="Remove a story from the Lunii")
-def cli_main(verbose, find, dev, refresh, info, slist, key_v3, exp, imp, rem):
+@click.option('--workers', '-w', "workers", type=click.IntRange(min=1), default=TRANSCODING_WORKERS, help="Number of parallel processes to transcode STUdio assets")
+@click.option('--export-workers', '-ew', "export_workers", type=click.IntRange(min=1), default=EXPORT_WORKERS, help="Number of stories exported in parallel (with ALL)")
+@click.option('--compression', '-c', "compression", type=click.Choice(list(ARCHIVE_COMPRESSION)), default=EXPORT_COMPRESSION, help="Exported archives compression (audio and pictures are always stored)")
+@click.option('--incremental', '-inc', "incremental", is_flag=True, help="Skip exported stories unchanged since last export")
+def cli_main(verbose, find, dev, refresh, info, slist, key_v3, exp, imp, rem, workers, export_workers, compression, incremental):
     
     # Initialize logger
     initialize_logger(logging.INFO)
@@ -74,12 +80,16 @@ def cli_main(verbose, find, dev, refresh, info, slist, key_v3, exp, imp, rem):
     # using selected device
     if is_lunii(dev):
         my_dev = LuniiDevice(dev, key_v3)
+        my_dev.transcoding_workers = workers
     elif is_flam(dev):
         my_dev = FlamDevice(dev)
         device_type = "FLAM"
     else: 
         main_logger.log(logging.ERROR, f"This device is not supported: '{dev}'")
         return
+    my_dev.export_workers = export_workers
+    my_dev.export_compression = compression
+    my_dev.export_incremental = incremental
 
     # feeding official db (from cache or live)
     story_load_db(refresh)
@@ -100,12 +110,8 @@ def cli_main(verbose, find, dev, refresh, info, slist, key_v3, exp, imp, rem):
     elif exp:
         zip_list = []
         if exp.upper() == "ALL":
-            if device_type == "LUNII":
-                # full export
-                zip_list = my_dev.export_all("./")
-            else:
-                main_logger.log(logging.ERROR, f"The '{device_type}' device does not support the 'export all' feature")
-                return
+            # full export
+            zip_list = my_dev.export_all("./")
         else:
             # single to export
             one_zip = my_dev.export_story(exp, "./")
@@ -152,4 +158,6 @@ def cli_main(verbose, find, dev, refresh, info, slist, key_v3, exp, imp, rem):
 
 
 if __name__ == '__main__':
+    # required for transcoding processes on frozen executables
+    multiprocessing.freeze_support()
     cli_main()
@@ -7,6 +7,35 @@ LUNII_LOGGER = "lunii-packs"
 REFRESH_CACHE = False
 
 STORY_TRANSCODING_SUPPORTED = shutil.which("ffmpeg") is not None
+# parallel processes for STUdio assets transcoding (1 to disable the pool)
+TRANSCODING_WORKERS = os.cpu_count() or 1
+# ffmpeg processes started ahead of the next job (spares) by each transcoding process, max time
+# for one file and delay to notice an abort (seconds)
+FFMPEG_WARM_SPARES = 1
+FFMPEG_JOB_TIMEOUT = 300
+FFMPEG_ABORT_POLL = 0.1
+# entries queued between import stages (read / cipher / write)
+PIPELINE_DEPTH = 8
+# next archive of import_dir read ahead by chunks (filling OS cache) while current one is written
+PREFETCH_CHUNK = 1024 * 1024
+# story files written on device by aligned blocks, gathered up to coalesce size before being written
+# grouped by directory. Preallocation is off : vfat only keeps size, where libc emulates it by writing.
+WRITE_BLOCK_SIZE = 1024 * 1024
+WRITE_COALESCE_SIZE = 8 * 1024 * 1024
+WRITE_PREALLOCATE = False
+# story resources : only this header is ciphered, payload is copied by chunks on export
+LUNII_HEADER_SIZE = 512
+EXPORT_COPY_CHUNK = 1024 * 1024
+# stories zipped in parallel by export all, and concurrent reads allowed on device
+EXPORT_WORKERS = 4
+EXPORT_DEVICE_READERS = 2
+# stories directories checked in parallel by recovery / cleanup
+SCAN_WORKERS = 8
+# exported archives : "store" all entries, or "deflate" / "archive" (lzma) them, except audio and pictures
+EXPORT_COMPRESSION_STORE = "store"
+EXPORT_COMPRESSION_DEFLATE = "deflate"
+EXPORT_COMPRESSION_ARCHIVE = "archive"
+EXPORT_COMPRESSION = EXPORT_COMPRESSION_DEFLATE
 
 def toggle_refresh_cache():
     global REFRESH_CACHE
@@ -38,7 +67,18 @@ CFG_DIR: Path = os.path.join(Path.home(), ".lunii-qt")
 CACHE_DIR = os.path.join(CFG_DIR, "cache")
 FILE_OFFICIAL_DB = os.path.join(CFG_DIR, "official.db")
 FILE_THIRD_PARTY_DB = os.path.join(CFG_DIR, "third-party.db")
+# indexed copy of official and third-party DBs (JSON files above remain the sources)
+FILE_STORY_DB = os.path.join(CFG_DIR, "stories.sqlite")
+# third-party entries not yet merged in JSON DB (one JSON entry per line)
+FILE_THIRD_PARTY_JOURNAL = os.path.join(CFG_DIR, "third-party.journal")
+# journal is merged back in JSON DB when over this size
+THIRD_PARTY_JOURNAL_SIZE = 64 * 1024
+# archives processed by import_dir, to resume an interrupted run
+FILE_IMPORT_MANIFEST = os.path.join(CFG_DIR, "import-manifest.json")
 V3_KEYS = os.path.join(CFG_DIR, "v3.keys")
+TRANSCODE_CACHE_DIR = os.path.join(CFG_DIR, "transcoded")
+# size cap of transcoded assets cache, least recently used entries are evicted first
+TRANSCODE_CACHE_SIZE = 512 * 1024 * 1024
 
 LUNII_V1or2_UNK = 0
 LUNII_V1 = 1
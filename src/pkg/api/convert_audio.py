@@ -1,104 +1,283 @@
+import atexit
+import multiprocessing
 import os
 import platform
 import subprocess
-import tempfile
+import threading
+import time
+from collections import deque
 from io import BytesIO
 
 import ffmpeg
-from mutagen.mp3 import MP3, BitrateMode, MONO
+from mutagen.mp3 import MPEGInfo, BitrateMode, MONO
+
+from pkg.api.constants import FFMPEG_WARM_SPARES, FFMPEG_JOB_TIMEOUT, FFMPEG_ABORT_POLL
+from pkg.api.transcode_cache import TRANSCODE_CACHE
+
+
+ID3V2_HEADER_SIZE = 10
+ID3V1_SIZE = 128
+ID3V1_EXT_SIZE = 227
+APE_FOOTER_SIZE = 32
+APE_HAS_HEADER = 0x80000000
+
+
+def _syncsafe(buffer):
+    # 4 x 7 bits integer, msb must be cleared
+    if any(byte & 0x80 for byte in buffer):
+        return None
+    return (buffer[0] << 21) | (buffer[1] << 14) | (buffer[2] << 7) | buffer[3]
+
+
+def _id3v2_size(audio_data, offset, magic=b"ID3"):
+    # ID3v2 header / footer : magic(3) version(2) flags(1) size(4)
+    header = audio_data[offset:offset + ID3V2_HEADER_SIZE]
+    if len(header) < ID3V2_HEADER_SIZE or header[:3] != magic or header[3] == 0xFF or header[4] == 0xFF:
+        return None
+    size = _syncsafe(header[6:10])
+    if size is None:
+        return None
+
+    size += ID3V2_HEADER_SIZE
+    # footer present
+    if header[5] & 0x10:
+        size += ID3V2_HEADER_SIZE
+    return size
+
+
+# returns (start, end) of audio stream once ID3v2, ID3v1 and APE tags are skipped
+def mp3_audio_span(audio_data):
+    start = 0
+    end = len(audio_data)
+
+    # leading ID3v2 tags (some encoders stack them)
+    while True:
+        size = _id3v2_size(audio_data, start)
+        if size is None or start + size > end:
+            break
+        start += size
+
+    # trailing tags, in any order
+    while end > start:
+        # ID3v1 (+ extended tag)
+        if end - start >= ID3V1_SIZE and audio_data[end - ID3V1_SIZE:end - ID3V1_SIZE + 3] == b"TAG":
+            end -= ID3V1_SIZE
+            if end - start >= ID3V1_EXT_SIZE and audio_data[end - ID3V1_EXT_SIZE:end - ID3V1_EXT_SIZE + 4] == b"TAG+":
+                end -= ID3V1_EXT_SIZE
+            continue
+
+        # APEv1/v2, size includes footer but not header
+        footer = audio_data[end - APE_FOOTER_SIZE:end] if end - start >= APE_FOOTER_SIZE else b""
+        if footer[:8] == b"APETAGEX":
+            size = int.from_bytes(footer[12:16], 'little')
+            if int.from_bytes(footer[20:24], 'little') & APE_HAS_HEADER:
+                size += APE_FOOTER_SIZE
+            if APE_FOOTER_SIZE <= size <= end - start:
+                end -= size
+                continue
+
+        # ID3v2 appended at the end, found through its footer (and matching header)
+        size = _id3v2_size(audio_data, end - ID3V2_HEADER_SIZE, b"3DI") if end - start >= ID3V2_HEADER_SIZE else None
+        if size and size <= end - start and _id3v2_size(audio_data, end - size) == size:
+            end -= size
+            continue
+
+        break
+
+    return start, end
 
 
 def tags_removal_required(audio_data):
-    audio_bytesio = BytesIO(audio_data)
-    audio = MP3(audio_bytesio)
-    return audio.tags
+    start, end = mp3_audio_span(audio_data)
+    return start > 0 or end < len(audio_data)
 
 
-def transcoding_required(filename: str, audio_data):
+def transcoding_required(filename: str, audio_data, offset=None):
     if not filename.lower().endswith(".mp3"):
         return True
 
-    audio_bytesio = BytesIO(audio_data)
-    audio = MP3(audio_bytesio)
-    # print(f"MP3 {audio.info.bitrate // 1000}Kbps ({audio.info.bitrate_mode} / {audio.info.mode}) for {filename}")
+    # only stream info, tags are not parsed
+    audio_info = MPEGInfo(BytesIO(audio_data), offset)
+    # print(f"MP3 {audio_info.bitrate // 1000}Kbps ({audio_info.bitrate_mode} / {audio_info.mode}) for {filename}")
 
     # not the correct mode
-    if not audio.info.bitrate_mode in [BitrateMode.UNKNOWN, BitrateMode.VBR, BitrateMode.CBR]:
+    if not audio_info.bitrate_mode in [BitrateMode.UNKNOWN, BitrateMode.VBR, BitrateMode.CBR]:
         return True
 
     # not a mono audio
-    if audio.info.mode != MONO:
+    if audio_info.mode != MONO:
         return True
 
     # to be kept as it is
     return False
 
 
+# single pass probe : (transcoding required, tags to be removed)
+def audio_probe(filename: str, audio_data):
+    start, end = mp3_audio_span(audio_data)
+    has_tags = start > 0 or end < len(audio_data)
+    return transcoding_required(filename, audio_data, start), has_tags
+
+
 def mp3_tag_cleanup(audio_data):
-    audio_bytesio = BytesIO(audio_data)
-    audio = MP3(audio_bytesio)
+    start, end = mp3_audio_span(audio_data)
+    if start == 0 and end == len(audio_data):
+        return audio_data
 
-    # write the original MP3 data to a temporary file
-    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-        temp_file.write(audio_data)
+    # returning mp3 without tags
+    return audio_data[start:end]
 
-        # remove tags and update file
-        modified_audio = MP3(temp_file.name)
-        modified_audio.delete()
 
-        # read again the file without tags
-        temp_file.seek(0)
-        audio_data = temp_file.read()
+# Construct the ffmpeg command using the ffmpeg-python syntax
+FFMPEG_CMD = (
+    ffmpeg.input('pipe:0')
+    .output('pipe:', format='mp3',
+            codec='libmp3lame',
+            map='0:a',
+            ar='44100',
+            ac='1',
+            aq='5',
+            # ab='128k', # NOOOOOOOOOOO CBR 😡
+            map_metadata='-1',
+            write_xing='0',
+            id3v2_version='0'
+           )
+    .compile()
+)
 
-    # cleaning up the mess
-    os.remove(temp_file.name)
 
-    # returning mp3 without tags
-    return audio_data
+# ffmpeg processes started ahead of time : each process handles a single file (ffmpeg
+# ends on stdin EOF), but a spare is already loaded and waiting on its stdin when a job
+# comes in, and its replacement warms up while the current job runs.
+# Each transcoding worker process has its own pool, all of them sharing the abort event :
+# once set, running jobs are killed and new ones fail.
+class FfmpegPool:
+    def __init__(self, size=FFMPEG_WARM_SPARES, max_jobs=1, timeout=FFMPEG_JOB_TIMEOUT, abort=None):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.abort = abort or threading.Event()
+
+        # callers above max_jobs wait for a free slot
+        self.__slots = threading.BoundedSemaphore(max_jobs)
+        self.__lock = threading.Lock()
+        self.__idle = deque()
+        self.__running = set()
+
+        # warm processes inherited by a forked process belong to the parent
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.__forget)
+
+    def __spawn(self):
+        current_os = platform.system()
+        if current_os == "Windows":
+            flags = subprocess.CREATE_NO_WINDOW
+        else:
+            flags = 0
+
+        # Run the ffmpeg command using subprocess with stdin and stdout pipes
+        return subprocess.Popen(FFMPEG_CMD,
+                                stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                creationflags=flags)
+
+    def __acquire(self):
+        with self.__lock:
+            while self.__idle:
+                process = self.__idle.popleft()
+                # still waiting for its input ?
+                if process.poll() is None:
+                    break
+                process.communicate()
+            else:
+                process = self.__spawn()
+            self.__running.add(process)
+
+            # warming up next process while this one is busy
+            if len(self.__idle) < self.size:
+                self.__idle.append(self.__spawn())
+        return process
+
+    def transcode(self, audio_data):
+        if self.abort.is_set():
+            return -1, b"", b"transcoding aborted"
+
+        with self.__slots:
+            process = self.__acquire()
+            deadline = time.monotonic() + self.timeout
+            try:
+                while True:
+                    try:
+                        # Feed the audio data to the stdin of the subprocess (only on first call)
+                        stdout, stderr = process.communicate(input=audio_data, timeout=FFMPEG_ABORT_POLL)
+                        break
+                    except subprocess.TimeoutExpired:
+                        audio_data = None
+                        if self.abort.is_set():
+                            error = "transcoding aborted"
+                        elif time.monotonic() > deadline:
+                            error = f"ffmpeg timeout ({self.timeout}s)"
+                        else:
+                            continue
+                        process.kill()
+                        process.communicate()
+                        stdout, stderr = b"", error.encode('utf-8')
+                        break
+            finally:
+                with self.__lock:
+                    self.__running.discard(process)
+
+        return process.returncode, stdout, stderr
+
+    def shutdown(self, kill=False):
+        with self.__lock:
+            idle = list(self.__idle)
+            self.__idle.clear()
+            running = list(self.__running) if kill else []
+
+        for process in idle:
+            process.kill()
+            process.communicate()
+        # running jobs are stopped too, their caller gets an error
+        for process in running:
+            process.kill()
+
+    def __forget(self):
+        # closing our side of the pipes, without touching parent's processes
+        for process in self.__idle:
+            for pipe in [process.stdin, process.stdout, process.stderr]:
+                pipe.close()
+        self.__idle = deque()
+        self.__running = set()
+        self.__lock = threading.Lock()
+        self.__slots = threading.BoundedSemaphore(self.max_jobs)
+
+
+# set by LuniiDevice.abort_process, shared with transcoding worker processes
+TRANSCODE_ABORT = multiprocessing.Event()
+FFMPEG_POOL = FfmpegPool(abort=TRANSCODE_ABORT)
+atexit.register(FFMPEG_POOL.shutdown)
 
 
 def audio_to_mp3(audio_data):
     audio_mp3 = b""
 
-    # Construct the ffmpeg command using the ffmpeg-python syntax
-    ffmpeg_cmd = (
-        ffmpeg.input('pipe:0')
-        .output('pipe:', format='mp3',
-                codec='libmp3lame',
-                map='0:a',
-                ar='44100',
-                ac='1',
-                aq='5',
-                # ab='128k', # NOOOOOOOOOOO CBR 😡
-                map_metadata='-1',
-                write_xing='0',
-                id3v2_version='0'
-               )
-        .compile()
-    )
-
-    current_os = platform.system()
-    if current_os == "Windows":
-        flags = subprocess.CREATE_NO_WINDOW
-    else:
-        flags = 0
-
-    # Run the ffmpeg command using subprocess with stdin and stdout pipes
-    process = subprocess.Popen(ffmpeg_cmd,
-                               stdin=subprocess.PIPE,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE,
-                               creationflags=flags)
+    # same source and same ffmpeg args : already converted
+    cache_key = TRANSCODE_CACHE.key(audio_data, " ".join(FFMPEG_CMD[1:]))
+    cached = TRANSCODE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
 
-    # Feed the audio data to the stdin of the subprocess
-    stdout, stderr = process.communicate(input=audio_data)
+    returncode, stdout, stderr = FFMPEG_POOL.transcode(audio_data)
 
     # Check for errors
-    if process.returncode != 0:
+    if returncode != 0:
         print(f"Error: {stderr.decode('utf-8')}")
     else:
         # 'stdout' now contains the MP3 audio data
         audio_mp3 = stdout
+        TRANSCODE_CACHE.put(cache_key, audio_mp3)
 
     # print(f"{len(audio_mp3)//1024}K")
     return audio_mp3
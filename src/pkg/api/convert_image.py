@@ -1,29 +1,154 @@
-# import time
+import struct
 from io import BytesIO
+
+import numpy as np
 from PIL import Image
 
+from pkg.api.transcode_cache import TRANSCODE_CACHE
 
-def image_to_bitmap_rle4(image_data):
+BMP_WIDTH = 320
+BMP_HEIGHT = 240
+
+BMP_HEADER_SIZE = 54
+BMP_PALETTE_SIZE = 16 * 4
+
+# BMP file header + BITMAPINFOHEADER (40 bytes), 4bpp, RLE4 compression
+BMP_RLE4_HEADER = struct.Struct("<2sIIIIiiHHIIiiII")
+
+# conversion parameters for transcode cache (to be updated on any output change)
+RLE4_CACHE_PARAMS = f"bmp-rle4-gray16:{BMP_WIDTH}x{BMP_HEIGHT}"
+
+
+def _open_image(image_data):
     image_bytesio = BytesIO(image_data)
     img = Image.open(image_bytesio)
 
     # checking if conversion is not necessary
-    if img.format == "BMP" and img.info["compression"] == img.RLE4 and img.size == (320, 240):
-        return image_data
+    if img.format == "BMP" and img.info["compression"] == img.RLE4 and img.size == (BMP_WIDTH, BMP_HEIGHT):
+        return None
+    return img
+
 
-    if img.size != (320, 240):
-        img = img.resize((320, 240))
+def _prepare_image(img):
+    if img.size != (BMP_WIDTH, BMP_HEIGHT):
+        img = img.resize((BMP_WIDTH, BMP_HEIGHT))
     if img.format != "BMP":
         img = img.transpose(Image.FLIP_TOP_BOTTOM)
 
-    # print(img.mode)
     if img.mode not in ["1", "L"]:
         img = img.convert("RGB")
 
+    return img
+
+
+def _bitmap_rle4_file(width, height, bmp_data):
+    data_size = len(bmp_data)
+    data_offset = BMP_HEADER_SIZE + BMP_PALETTE_SIZE
+    file_size = data_offset + data_size
+
+    bmp_buffer = bytearray(file_size)
+
+    # BMP Header
+    BMP_RLE4_HEADER.pack_into(bmp_buffer, 0,
+                              b"BM",            # bitmap signature
+                              file_size,
+                              0,                # Reserved
+                              data_offset,
+                              40,               # Header size (40 bytes)
+                              width,
+                              height,
+                              1,                # Number of color planes (1)
+                              4,                # 4 bits per pixel
+                              2,                # Compression method
+                              data_size,
+                              0,                # Horizontal resolution
+                              0,                # Vertical resolution
+                              0,                # Palette colors (16)
+                              0)                # Important colors (0 = all)
+
+    # BMP Palette (Grayscale)
+    for i in range(16):
+        index = BMP_HEADER_SIZE + i * 4
+        gray = int((255 / 16) * i)
+
+        bmp_buffer[index] = gray  # Blue
+        bmp_buffer[index + 1] = gray  # Green
+        bmp_buffer[index + 2] = gray  # Red
+        bmp_buffer[index + 3] = 0  # Reserved
+
+    # Add BMP data to buffer
+    bmp_buffer[data_offset:] = bmp_data
+
+    return bytes(bmp_buffer)
+
+
+def image_to_bitmap_rle4(image_data):
+    img = _open_image(image_data)
+    if img is None:
+        return image_data
+
+    # already converted ?
+    cache_key = TRANSCODE_CACHE.key(image_data, RLE4_CACHE_PARAMS)
+    cached = TRANSCODE_CACHE.get(cache_key)
+    if cached is not None:
+        return cached
+
+    img = _prepare_image(img)
+
+    # grayscale quantization of the whole frame (4 bits per pixel)
+    if img.mode in ['P', 'L', '1']:
+        # mode "1" is seen as bool by numpy, getdata() gives 0/255
+        gray = np.asarray(img.convert("L"), dtype=np.uint8)
+        pixels = gray // 16
+    else:
+        rgb = np.asarray(img, dtype=np.float64)
+        # same operation order as the per pixel version to keep identical rounding
+        pixels = ((rgb[:, :, 0] * 0.299 +
+                   rgb[:, :, 1] * 0.587 +
+                   rgb[:, :, 2] * 0.114) / 16).astype(np.uint8)
+
+    height, width = pixels.shape
+    flat = pixels.reshape(-1)
+
+    # a run starts on each new line, or when value changes
+    run_start = np.ones((height, width), dtype=bool)
+    run_start[:, 1:] = pixels[:, 1:] != pixels[:, :-1]
+    starts = np.flatnonzero(run_start)
+    lengths = np.diff(np.append(starts, flat.size))
+
+    # runs are limited to 255 pixels, splitting longer ones
+    chunks = (lengths + 254) // 255
+    chunk_run = np.repeat(np.arange(starts.size), chunks)
+    chunk_first = np.cumsum(chunks) - chunks
+    chunk_rank = np.arange(chunk_run.size) - chunk_first[chunk_run]
+    counts = np.minimum(lengths[chunk_run] - chunk_rank * 255, 255)
+
+    # each pair is shifted by the end of line markers (00 00) of previous lines
+    values = flat[starts][chunk_run]
+    rows = starts[chunk_run] // width
+    offsets = 2 * (np.arange(chunk_run.size) + rows)
+
+    # end of line markers are left to 0, end of bitmap is 00 01
+    bmp_data = np.zeros(2 * (chunk_run.size + height), dtype=np.uint8)
+    bmp_data[offsets] = counts
+    bmp_data[offsets + 1] = (values << 4) | values
+    bmp_data[-1] = 1
+
+    bmp_file = _bitmap_rle4_file(width, height, bmp_data.tobytes())
+    TRANSCODE_CACHE.put(cache_key, bmp_file)
+    return bmp_file
+
+
+# reference per pixel implementation, kept for benchmark and validation purposes
+def image_to_bitmap_rle4_legacy(image_data):
+    img = _open_image(image_data)
+    if img is None:
+        return image_data
+    img = _prepare_image(img)
+
     # Get pixel data
     pixel_data = list(img.getdata())
 
-    # start = time.time()
     bmp_data = b""
 
     # Iterate through pixels
@@ -41,7 +166,6 @@ def image_to_bitmap_rle4(image_data):
                 # Get gray values for the current pixel
                 gray = pixel_data[index]
                 grayscale_value = int(gray/16)
-                # print(f"@{x:3}x{y:3}: GR={gray:02X} => GR={grayscale_value:02X}")
             # RGB source
             else:
                 # Get RGB values for the current pixel
@@ -52,7 +176,6 @@ def image_to_bitmap_rle4(image_data):
                          g * 0.587 +
                          b * 0.114) / 16
                     )
-                # print(f"@{x:3}x{y:3}: R={r:02X}, G={g:02X}, B={b:02X} => GR={grayscale_value:02X}")
 
             # checking for new line
             if not x:
@@ -82,47 +205,4 @@ def image_to_bitmap_rle4(image_data):
 
     bmp_data += b"\x00\x01"
 
-    # end = time.time()
-    # print(f"{end-start:2.3}s")
-
-    header_size = 54
-    data_size = len(bmp_data)
-    palette_size = 16 * 4
-    data_offset = header_size + palette_size
-    file_size = data_offset + data_size
-
-    bmp_buffer = bytearray([0] * file_size)
-
-    # BMP Header
-    bmp_buffer[:54] = [
-        0x42, 0x4d,  # BM (bitmap signature)
-        file_size & 0xff, (file_size >> 8) & 0xff, (file_size >> 16) & 0xff, (file_size >> 24) & 0xff,
-        0x00, 0x00, 0x00, 0x00,  # Reserved
-        data_offset & 0xff, (data_offset >> 8) & 0xff, (data_offset >> 16) & 0xff, (data_offset >> 24) & 0xff,
-        0x28, 0x00, 0x00, 0x00,  # Header size (40 bytes)
-        width & 0xff, (width >> 8) & 0xff, (width >> 16) & 0xff, (width >> 24) & 0xff,
-        height & 0xff, (height >> 8) & 0xff, (height >> 16) & 0xff, (height >> 24) & 0xff,
-        0x01, 0x00,  # Number of color planes (1)
-        0x04, 0x00,  # 4 bits per pixel
-        0x02, 0x00, 0x00, 0x00,  # Compression method
-        data_size & 0xff, (data_size >> 8) & 0xff, (data_size >> 16) & 0xff, (data_size >> 24) & 0xff,
-        0x00, 0x00, 0x00, 0x00,  # Horizontal resolution
-        0x00, 0x00, 0x00, 0x00,  # Vertical resolution
-        0x00, 0x00, 0x00, 0x00,  # Palette colors (16)
-        0x00, 0x00, 0x00, 0x00,  # Important colors (0 = all)
-    ]
-
-    # BMP Palette (Grayscale)
-    for i in range(16):
-        index = header_size + i * 4
-        gray = int((255 / 16) * i)
-
-        bmp_buffer[index] = gray  # Blue
-        bmp_buffer[index + 1] = gray  # Green
-        bmp_buffer[index + 2] = gray  # Red
-        bmp_buffer[index + 3] = 0  # Reserved
-
-    # Add BMP data to buffer
-    bmp_buffer[header_size + palette_size:] = bmp_data
-
-    return bytes(bmp_buffer)
+    return _bitmap_rle4_file(width, height, bmp_data)
@@ -7,12 +7,17 @@ from tqdm import tqdm
 from uuid import UUID
 
 import psutil
-import py7zr
 
 from pkg.api import stories
 from pkg.api.constants import *
 from pkg.api.device_lunii import secure_filename
+from pkg.api.device_writer import DeviceWriter
+from pkg.api.export_manifest import ExportManifest
+from pkg.api.pipeline import ARCHIVE_COMPRESSION, DeviceReadGate, ExportJob, ImportPipeline, entry_compression, ordered_map
+from pkg.api.space_plan import cluster_size, story_footprint
 from pkg.api.stories import StoryList, Story, story_is_studio, story_is_lunii
+from pkg.api.story_archive import BAD_ARCHIVE_ERRORS, StoryArchive
+from pkg.api.story_scan import inventory_story, scan_stories
 
 LIB_BASEDIR = "etc/library/"
 
@@ -35,6 +40,14 @@ class FlamDevice:
         self.memory_left = 0
 
         self.abort_process = False
+        # story files coalesced and synced once per story
+        self.writer = DeviceWriter()
+        self.export_workers = EXPORT_WORKERS
+        self.export_readers = EXPORT_DEVICE_READERS
+        self.export_compression = EXPORT_COMPRESSION
+        # skipping stories unchanged since last export (manifest saved next to archives)
+        self.export_incremental = False
+        self.scan_workers = SCAN_WORKERS
 
         # Get logger
         self.logger = logging.getLogger(LUNII_LOGGER)
@@ -144,13 +157,8 @@ class FlamDevice:
             # directory is a partial UUID
             pbar.set_description(f"Processing {story}")
 
-            str_uuid = None
-            # looking complete UUID in official DB
-            if not str_uuid:
-                str_uuid = next((uuid for uuid in stories.DB_OFFICIAL if story.upper() in uuid.upper()), None)
-            # looking complete UUID in third party DB
-            if not str_uuid:
-                str_uuid = next((uuid for uuid in stories.DB_THIRD_PARTY if story.upper() in uuid.upper()), None)
+            # looking complete UUID in official DB, then third party DB
+            str_uuid = stories.DB.find_uuid(story)
             if not str_uuid:
                 str_uuid = story
 
@@ -190,25 +198,16 @@ class FlamDevice:
         removed = 0
         recovered_size = 0
 
-        # getting all stories
+        # getting all stories (with their size)
         content_dir = os.path.join(self.mount_point, self.STORIES_BASEDIR)
-        stories_dir = [entry for entry in os.listdir(content_dir) if os.path.isdir(os.path.join(content_dir, entry))]
-
-        # Manage the progress bar
-        pbar = tqdm(iterable=stories_dir, total=len(stories_dir), bar_format=TQDM_BAR_FORMAT)
-        for story in pbar:
-            # directory is a partial UUID
-            pbar.set_description(f"Processing {story}")
-
-            if story not in self.stories:
+        for scan in scan_stories(content_dir, inventory_story, self.scan_workers).stories:
+            if scan.name not in self.stories:
                 # remove it
                 try:
-                    lost_story_path = os.path.join(content_dir, story)
+                    lost_story_path = os.path.join(content_dir, scan.name)
 
                     # computing lost size
-                    for parent_dir, _, files in os.walk(lost_story_path):
-                        for file in files:
-                            recovered_size += os.path.getsize(os.path.join(parent_dir, file))
+                    recovered_size += scan.inventory.size
 
                     # removing whole directory
                     self.logger.log(logging.INFO, f"Deleting - {lost_story_path}")
@@ -225,101 +224,105 @@ class FlamDevice:
 
         self.logger.log(logging.INFO, f"🚧 Loading {story_path}...")
 
-        archive_size = os.path.getsize(story_path)
-        free_space = psutil.disk_usage(str(self.mount_point)).free
-        if archive_size >= free_space:
-            self.logger.log(logging.ERROR, f"Not enough space left on Flam (only {free_space//1024//1024}MB)")
-            return False
-
         # identifying based on filename
         if story_path.lower().endswith(EXT_ZIP):
             archive_type = TYPE_FLAM_ZIP
         elif story_path.lower().endswith(EXT_7z):
             archive_type = TYPE_FLAM_7Z
+        else:
+            return
 
-        # processing story
-        if archive_type in [TYPE_FLAM_ZIP, TYPE_FLAM_7Z]:
+        # checking if archive is OK, opened once for checks and extraction
+        try:
+            archive = StoryArchive.open(story_path)
+        except BAD_ARCHIVE_ERRORS as e:
+            self.logger.log(logging.ERROR, e)
+            return False
+        archive.archive_type = archive_type
+
+        with archive:
+            # space needed once extracted, rounded to device clusters
+            footprint = story_footprint(archive, cluster_size(self.mount_point))
+            free_space = psutil.disk_usage(str(self.mount_point)).free
+            if footprint >= free_space:
+                self.logger.log(logging.ERROR, f"Not enough space left on Flam (only {free_space//1024//1024}MB, {footprint//1024//1024}MB needed)")
+                return False
+
+            # processing story
             self.logger.log(logging.WARN, "😮‍💨 This process is veeeeeeeeery long due to Flam firmware. 😴 Be patient ...")
 
-        if archive_type == TYPE_FLAM_ZIP:
-            self.logger.log(logging.DEBUG, "Archive => TYPE_FLAM_ZIP")
-            return self.import_flam_zip(story_path)
-        elif archive_type == TYPE_FLAM_7Z:
-            self.logger.log(logging.DEBUG, "Archive => TYPE_FLAM_7Z")
-            return self.import_flam_7z(story_path)
+            if archive_type == TYPE_FLAM_ZIP:
+                self.logger.log(logging.DEBUG, "Archive => TYPE_FLAM_ZIP")
+                return self.import_flam_zip(archive)
+            elif archive_type == TYPE_FLAM_7Z:
+                self.logger.log(logging.DEBUG, "Archive => TYPE_FLAM_7Z")
+                return self.import_flam_7z(archive)
 
-    def import_flam_zip(self, story_path):
-        # checking if archive is OK
-        try:
-            with zipfile.ZipFile(file=story_path):
-                pass  # If opening succeeds, the archive is valid
-        except zipfile.BadZipFile as e:
-            self.logger.log(logging.ERROR, e)
+    def import_flam_zip(self, archive: StoryArchive):
+        # reading all available files
+        zip_contents = archive.names
+
+        if story_is_lunii(zip_contents) or story_is_studio(zip_contents):
+            self.logger.log(logging.ERROR, f"Archive seems to be made of Lunii story (not compatible with Flam)")
             return False
 
-        # opening zip file
-        with zipfile.ZipFile(file=story_path) as zip_file:
-            # reading all available files
-            zip_contents = zip_file.namelist()
+        # getting UUID from path
+        uuid_path = Path(zip_contents[0])
+        uuid_str = uuid_path.parents[0].name if uuid_path.parents[0].name else uuid_path.name
 
-            if story_is_lunii(zip_contents) or story_is_studio(zip_contents):
-                self.logger.log(logging.ERROR, f"Archive seems to be made of Lunii story (not compatible with Flam)")
+        if len(uuid_str) >= 16:  # long enough to be a UUID
+            # self.signal_logger.emit(logging.DEBUG, uuid_str)
+            try:
+                if "-" not in uuid_str:
+                    new_uuid = UUID(bytes=binascii.unhexlify(uuid_str))
+                else:
+                    new_uuid = UUID(uuid_str)
+            except ValueError as e:
+                self.logger.log(logging.ERROR, f"UUID parse error {e}")
                 return False
+        else:
+            self.logger.log(logging.ERROR, "UUID directory is missing in archive !")
+            return False
 
-            # getting UUID from path
-            uuid_path = Path(zip_contents[0])
-            uuid_str = uuid_path.parents[0].name if uuid_path.parents[0].name else uuid_path.name
+        # checking if UUID already loaded
+        if str(new_uuid) in self.stories:
+            self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded, aborting !")
+            return False
 
-            if len(uuid_str) >= 16:  # long enough to be a UUID
-                # self.signal_logger.emit(logging.DEBUG, uuid_str)
-                try:
-                    if "-" not in uuid_str:
-                        new_uuid = UUID(bytes=binascii.unhexlify(uuid_str))
-                    else:
-                        new_uuid = UUID(uuid_str)
-                except ValueError as e:
-                    self.logger.log(logging.ERROR, f"UUID parse error {e}")
-                    return False
-            else:
-                self.logger.log(logging.ERROR, "UUID directory is missing in archive !")
-                return False
+        # decompressing story contents
+        short_uuid = str(new_uuid).upper()[28:]
+        output_path = Path(self.mount_point).joinpath(f"{self.STORIES_BASEDIR}")
+        if not output_path.exists():
+            output_path.mkdir(parents=True)
+        # story directories may have been removed since last import
+        self.writer.discard()
 
-            # checking if UUID already loaded
-            if str(new_uuid) in self.stories:
-                self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded, aborting !")
+        # Loop over each file
+        # Manage the progress bar
+        pbar = tqdm(iterable=zip_contents, total=len(zip_contents), bar_format=TQDM_BAR_FORMAT)
+        for file in pbar:
+            if self.abort_process:
+                self.logger.log(logging.WARNING, f"Import aborted, performing cleanup on current story...")
+                self.writer.discard()
+                self.__clean_up_story_dir(new_uuid)
                 return False
 
-            # decompressing story contents
-            short_uuid = str(new_uuid).upper()[28:]
-            output_path = Path(self.mount_point).joinpath(f"{self.STORIES_BASEDIR}")
-            if not output_path.exists():
-                output_path.mkdir(parents=True)
-
-            # Loop over each file
-            # Manage the progress bar
-            pbar = tqdm(iterable=zip_contents, total=len(zip_contents), bar_format=TQDM_BAR_FORMAT)
-            for file in pbar:
-                if self.abort_process:
-                    self.logger.log(logging.WARNING, f"Import aborted, performing cleanup on current story...")
-                    self.__clean_up_story_dir(new_uuid)
-                    return False
+            if file.endswith("/"):
+                continue
 
-                if file.endswith("/"):
-                    continue
+            pbar.set_description(f"Processing {file}")
 
-                pbar.set_description(f"Processing {file}")
+            # Extract each zip file
+            data = archive.read(file)
 
-                # Extract each zip file
-                data = zip_file.read(file)
+            target: Path = output_path.joinpath(file)
 
-                target: Path = output_path.joinpath(file)
+            # write target file
+            self.writer.write(target, data)
 
-                # create target directory
-                if not target.parent.exists():
-                    target.parent.mkdir(parents=True)
-                # write target file
-                with open(target, "wb") as f_dst:
-                    f_dst.write(data)
+        # story contents reach the device before .pi references it
+        self.writer.flush()
+        self.writer.sync()
 
         # updating .pi file to add new UUID
         self.stories.append(Story(new_uuid))
@@ -327,78 +330,63 @@ class FlamDevice:
 
         return True
     
-    def import_flam_7z(self, story_path):
-        # checking if archive is OK
-        try:
-            with py7zr.SevenZipFile(story_path, mode='r'):
-                pass  # If opening succeeds, the archive is valid
-        except py7zr.exceptions.Bad7zFile as e:
-            self.logger.log(logging.ERROR, e)
+    def import_flam_7z(self, archive: StoryArchive):
+        # reading all available files
+        zip_contents = archive.names
+        if story_is_lunii(zip_contents) or story_is_studio(zip_contents):
+            self.logger.log(logging.ERROR, f"Archive seems to be made of Lunii story (not compatible with Flam)")
             return False
 
-        # opening zip file
-        with py7zr.SevenZipFile(story_path, mode='r') as zip:
-            # reading all available files
-            zip_contents = zip.getnames()
-            if story_is_lunii(zip_contents) or story_is_studio(zip_contents):
-                self.logger.log(logging.ERROR, f"Archive seems to be made of Lunii story (not compatible with Flam)")
-                return False
-
-            # reading all available files
-            zip_contents = zip.list()
-            # getting UUID from path
-            uuid_path = Path(zip_contents[0].filename)
-            uuid_str = uuid_path.parents[0].name if uuid_path.parents[0].name else uuid_path.name
-            if len(uuid_str) >= 16:  # long enough to be a UUID
-                # self.signal_logger.emit(logging.DEBUG, uuid_str)
-                try:
-                    if "-" not in uuid_str:
-                        new_uuid = UUID(bytes=binascii.unhexlify(uuid_str))
-                    else:
-                        new_uuid = UUID(uuid_str)
-                except ValueError as e:
-                    self.logger.log(logging.ERROR, f"UUID parse error {e}")
-                    return False
-            else:
-                self.logger.log(logging.ERROR, "UUID directory is missing in archive !")
+        # getting UUID from path
+        uuid_path = Path(zip_contents[0])
+        uuid_str = uuid_path.parents[0].name if uuid_path.parents[0].name else uuid_path.name
+        if len(uuid_str) >= 16:  # long enough to be a UUID
+            # self.signal_logger.emit(logging.DEBUG, uuid_str)
+            try:
+                if "-" not in uuid_str:
+                    new_uuid = UUID(bytes=binascii.unhexlify(uuid_str))
+                else:
+                    new_uuid = UUID(uuid_str)
+            except ValueError as e:
+                self.logger.log(logging.ERROR, f"UUID parse error {e}")
                 return False
+        else:
+            self.logger.log(logging.ERROR, "UUID directory is missing in archive !")
+            return False
 
-            # checking if UUID already loaded
-            if str(new_uuid) in self.stories:
-                self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded, aborting !")
-                return False
+        # checking if UUID already loaded
+        if str(new_uuid) in self.stories:
+            self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded, aborting !")
+            return False
 
-            # decompressing story contents
-            short_uuid = str(new_uuid).upper()[28:]
-            output_path = Path(self.mount_point).joinpath(f"{self.STORIES_BASEDIR}")
-            if not output_path.exists():
-                output_path.mkdir(parents=True)
-
-            # Loop over each file
-            self.logger.log(logging.INFO, "Reading 7zip archive... (takes time)")
-            contents = zip.readall().items()
-            pbar = tqdm(iterable=enumerate(contents), total=len(contents), bar_format=TQDM_BAR_FORMAT)
-            for index, (fname, bio) in pbar:
+        # decompressing story contents
+        short_uuid = str(new_uuid).upper()[28:]
+        output_path = Path(self.mount_point).joinpath(f"{self.STORIES_BASEDIR}")
+        if not output_path.exists():
+            output_path.mkdir(parents=True)
+        # story directories may have been removed since last import
+        self.writer.discard()
+
+        # Loop over each file, decompressed one by one
+        stream = archive.stream()
+        with ImportPipeline(writer=self.writer) as pipe:
+            # Manage the progress bar (decompressed bytes)
+            pbar = tqdm(total=stream.total_size, unit="B", unit_scale=True, unit_divisor=1024, bar_format=TQDM_BAR_FORMAT)
+            for fname, data in stream:
+                pbar.set_description(f"Processing {fname}")
+                pbar.update(len(data))
                 # abort requested ? early exit
                 if self.abort_process:
                     self.logger.log(logging.WARNING, f"Import aborted, performing cleanup on current story...")
+                    pipe.abort()
                     self.__clean_up_story_dir(new_uuid)
                     return False
 
-                pbar.set_description(f"Processing {fname}")
-
-                if zip_contents[index].is_directory:
-                    continue
-
-                # Extract each zip file
-                target: Path = output_path.joinpath(fname)
-
-                # create target directory
-                if not target.parent.exists():
-                    target.parent.mkdir(parents=True)
                 # write target file
-                with open(target, "wb") as f_dst:
-                    f_dst.write(bio.read())
+                pipe.write(output_path.joinpath(fname), data)
+            pbar.close()
+        self.logger.log(logging.DEBUG, f"Import pipeline : {pipe.stats}")
+        self.writer.sync()
 
         # updating .pi file to add new UUID
         self.stories.append(Story(new_uuid))
@@ -418,8 +406,36 @@ class FlamDevice:
                 self.logger.log(logging.ERROR, f"[{st.str_uuid} - {st.name}]")
             return None
 
-        one_story = slist[0]
-
+        return self.__export_zip(self.__export_job(slist[0], out_path), progress=True)
+
+    def export_all(self, out_path):
+        # stories are prepared in order, then zipped by a pool of workers
+        # device reads are shared by a few readers only, results keep stories order
+        gate = DeviceReadGate(self.export_readers)
+        jobs = self.__export_jobs(out_path)
+
+        # stories being zipped concurrently, progress is reported per story
+        archives = []
+        results = ordered_map(lambda job: self.__export_zip(job, gate), jobs, self.export_workers)
+        pbar = tqdm(iterable=results, total=len(self.stories), unit="story", bar_format=TQDM_BAR_FORMAT)
+        for one_zip in pbar:
+            if one_zip:
+                pbar.set_description(f"Exported {one_zip.name}")
+                archives.append(one_zip)
+        pbar.close()
+
+        self.logger.log(logging.DEBUG, gate)
+        return archives
+
+    def __export_jobs(self, out_path):
+        for count, story in enumerate(self.stories):
+            # abort requested ? no more stories
+            if self.abort_process:
+                return
+            self.logger.log(logging.INFO, f"{count+1:>2}/{len(self.stories)} ")
+            yield self.__export_job(story, out_path)
+
+    def __export_job(self, one_story: Story, out_path):
         # checking that .content dir exist
         content_path = Path(self.mount_point).joinpath(self.STORIES_BASEDIR)
         if not content_path.is_dir():
@@ -450,23 +466,56 @@ class FlamDevice:
                 index = abs_file.find(str(one_story.uuid))
                 story_arcnames.append(abs_file[index:])
 
+        job = ExportJob(one_story, story_path, zip_path, story_flist, arcnames=story_arcnames)
+
+        # incremental mode, checking device files against last export
+        if self.export_incremental:
+            job.manifest = ExportManifest.scan(story_path, story_flist, {"compression": self.export_compression})
+            if job.manifest.unchanged(zip_path):
+                self.logger.log(logging.INFO, "✅ Unchanged since last export, skipping")
+                job.unchanged = True
+        return job
+
+    def __export_zip(self, job, gate=None, progress=False):
+        if not job:
+            return None
+        if job.unchanged:
+            return job.zip_path
+
+        # archive is rewritten, previous manifest no longer applies
+        if job.manifest:
+            ExportManifest.discard(job.zip_path)
         try:
-            with zipfile.ZipFile(zip_path, 'w') as zip_out:
+            with zipfile.ZipFile(job.zip_path, 'w', compression=ARCHIVE_COMPRESSION[self.export_compression]) as zip_out:
                 self.logger.log(logging.DEBUG, "> Zipping story ...")
-                pbar = tqdm(iterable=enumerate(story_flist), total=len(story_flist), bar_format=TQDM_BAR_FORMAT)
+                pbar = tqdm(iterable=enumerate(job.files), total=len(job.files), bar_format=TQDM_BAR_FORMAT, disable=not progress)
                 for index, file in pbar:
                     # abort requested ? early exit
                     if self.abort_process:
                         return None
 
                     pbar.set_description(f"Processing {file}")
-                    zip_out.write(file, story_arcnames[index])
+                    arcname = job.arcnames[index]
+                    if gate:
+                        self.__zip_gated(zip_out, file, arcname, gate)
+                    else:
+                        zip_out.write(file, arcname, entry_compression(arcname, zip_out.compression))
 
         except PermissionError as e:
             self.logger.log(logging.ERROR, f"failed to create ZIP - {e}")
             return None
 
-        return zip_path
+        if job.manifest:
+            job.manifest.save(job.zip_path)
+        return job.zip_path
+
+    @staticmethod
+    def __zip_gated(zip_out: zipfile.ZipFile, file, arcname, gate):
+        # same as ZipFile.write(), device reads going through the gate
+        zinfo = zipfile.ZipInfo.from_file(file, arcname)
+        zinfo.compress_type = entry_compression(arcname, zip_out.compression)
+        with open(file, "rb") as fsrc, zip_out.open(zinfo, "w") as fdst:
+            shutil.copyfileobj(gate.reader(fsrc), fdst, EXPORT_COPY_CHUNK)
 
     def __clean_up_story_dir(self, story_uuid: UUID):
         story_dir = Path(self.mount_point).joinpath(f"{self.STORIES_BASEDIR}{str(story_uuid)}")
@@ -1,31 +1,42 @@
 import glob
+import hashlib
 import json
 import os.path
 import shutil
+import time
 from string import hexdigits
 import zipfile
 import psutil
-import py7zr
 import unicodedata
 import xxtea
 import binascii
 import logging
+from contextlib import contextmanager
 from uuid import UUID
 
-from Crypto.Cipher import AES
-
 from tqdm import tqdm
 
 from pkg.api.aes_keys import fetch_keys, reverse_bytes
 from pkg.api.constants import *
 from pkg.api import stories
-from pkg.api.convert_audio import audio_to_mp3, transcoding_required, tags_removal_required, mp3_tag_cleanup
-from pkg.api.convert_image import image_to_bitmap_rle4
+from pkg.api.convert_audio import FFMPEG_POOL, TRANSCODE_ABORT
+from pkg.api.device_writer import DeviceWriter
+from pkg.api.export_manifest import ExportManifest
+from pkg.api.import_manifest import STATUS_FAILED, STATUS_IMPORTED, STATUS_LOADED, ImportManifest
+from pkg.api.pipeline import ARCHIVE_COMPRESSION, ArchivePrefetch, DeviceReadGate, ExportJob, ImportPipeline, entry_compression, ordered_map
+from pkg.api.space_plan import cluster_size, story_footprint
 from pkg.api.stories import FILE_META, FILE_STUDIO_JSON, FILE_STUDIO_THUMB, FILE_THUMB, FILE_UUID, StoryList, Story, StudioStory
+from pkg.api.story_archive import BAD_ARCHIVE_ERRORS, StoryArchive
+from pkg.api.story_keys import StoryKeyCache
+from pkg.api.story_scan import ScanReport, StoryInventory, StoryScan, inventory_story, scan_stories
+from pkg.api.story_staging import StoryStaging
+from pkg.api.transcode_cache import TRANSCODE_CACHE
+from pkg.api.transcoding import ASSET_AUDIO, ASSET_IMAGE, transcode_assets
 
 
 class LuniiDevice:
     STORIES_BASEDIR = ".content/"
+    STAGING_BASEDIR = ".staging/"
     
     stories: StoryList
 
@@ -39,6 +50,8 @@ class LuniiDevice:
         self.device_iv = None
         self.story_key = None
         self.story_iv = None
+        # story keys deciphered from bt files, AES factories and ciphering counters
+        self.story_keys = StoryKeyCache()
         self.snu = ""
         self.fw_vers_major = 0
         self.fw_vers_minor = 0
@@ -47,6 +60,21 @@ class LuniiDevice:
 
         self.debug_plain = False
         self.abort_process = False
+        self.transcoding_workers = TRANSCODING_WORKERS
+        self.export_workers = EXPORT_WORKERS
+        self.export_readers = EXPORT_DEVICE_READERS
+        self.export_compression = EXPORT_COMPRESSION
+        # skipping stories unchanged since last export (manifest saved next to archives)
+        self.export_incremental = False
+        self.scan_workers = SCAN_WORKERS
+        # stories imported aside then renamed into place, .pi written once per batch
+        self.staging = StoryStaging(os.path.join(mount_point, self.STAGING_BASEDIR),
+                                    os.path.join(mount_point, self.STORIES_BASEDIR))
+        self.__batch_depth = 0
+        # story files coalesced and synced once per story (FAT over USB)
+        self.writer = DeviceWriter()
+        # story UUID read from last imported archive (even if already loaded)
+        self.archive_uuid = None
 
         # Get logger
         self.logger = logging.getLogger(LUNII_LOGGER)
@@ -57,12 +85,31 @@ class LuniiDevice:
 
         # loading internal stories + pi update for duplicates filtering
         self.stories = feed_stories(self.mount_point)
+        # finishing (or rolling back) an interrupted import
+        for story_uuid in self.staging.recover():
+            if str(story_uuid) not in self.stories:
+                self.stories.append(Story(story_uuid))
         self.update_pack_index()
+        self.staging.done()
 
     @property
     def snu_str(self):
         return self.snu.hex().upper().lstrip("0")
 
+    @property
+    def abort_process(self):
+        return self.__abort_process
+
+    @abort_process.setter
+    def abort_process(self, value):
+        self.__abort_process = value
+        # no need to wait for running audio transcoding, in this process and in transcoding workers
+        if value:
+            TRANSCODE_ABORT.set()
+            FFMPEG_POOL.shutdown(kill=True)
+        else:
+            TRANSCODE_ABORT.clear()
+
     # opens the .md file to read all information related to device
     def __feed_device(self):
         
@@ -164,104 +211,148 @@ class LuniiDevice:
                                        f"Story Key : {binascii.hexlify(self.story_key, ' ', 1).upper() if self.story_key  else 'N/A'}\n"
                                        f"Story IV  : {binascii.hexlify(self.story_iv,  ' ', 1).upper() if self.story_iv   else 'N/A'}")
 
-    def __v1v2_decipher(self, buffer, key, offset, dec_len):
+    # Ciphering only applies to file header : "_into" functions transform a writable buffer
+    # (bytearray, memoryview, mmap) in place and return it, leaving the payload untouched.
+    # "_chunks" ones return [header, payload] to be written as is, payload being a view of the source.
+    # Other ones take any bytes-like object and return new bytes, the payload being copied once.
+    @staticmethod
+    def __header_range(buffer, offset, length):
         # checking offset
         if offset > len(buffer):
             offset = len(buffer)
         # checking len
-        if offset + dec_len > len(buffer):
-            dec_len = len(buffer) - offset
+        if offset + length > len(buffer):
+            length = len(buffer) - offset
+        return offset, length
+
+    def __v1v2_decipher_into(self, buffer, key, offset, dec_len):
+        start = time.perf_counter()
+        offset, dec_len = self.__header_range(buffer, offset, dec_len)
         # if something to be done
-        if offset < len(buffer) and offset + dec_len <= len(buffer):
-            plain = xxtea.decrypt(buffer[offset:dec_len], key, padding=False, rounds=lunii_tea_rounds(buffer[offset:dec_len]))
-            ba_buffer = bytearray(buffer)
-            ba_buffer[offset:dec_len] = plain
-            buffer = bytes(ba_buffer)
+        if offset < len(buffer):
+            with memoryview(buffer) as view:
+                header = view[offset:dec_len]
+                header[:] = xxtea.decrypt(header, key, padding=False, rounds=lunii_tea_rounds(header))
+            self.story_keys.stats.count(False, dec_len - offset, start)
         return buffer
 
-    def __v3_decipher(self, buffer, key, iv, offset, dec_len):
-        # checking offset
-        if offset > len(buffer):
-            offset = len(buffer)
-        # checking len
-        if offset + dec_len > len(buffer):
-            dec_len = len(buffer) - offset
+    def __v3_decipher_into(self, buffer, key, iv, offset, dec_len):
+        start = time.perf_counter()
+        offset, dec_len = self.__header_range(buffer, offset, dec_len)
         # if something to be done
-        if offset < len(buffer) and offset + dec_len <= len(buffer):
-            decipher = AES.new(key, AES.MODE_CBC, iv)
-            plain = decipher.decrypt(buffer[offset:dec_len])
-            ba_buffer = bytearray(buffer)
-            ba_buffer[offset:dec_len] = plain
-            buffer = bytes(ba_buffer)
+        if offset < len(buffer):
+            with memoryview(buffer) as view:
+                header = view[offset:dec_len]
+                self.story_keys.decrypt_into(key, iv, header)
+            self.story_keys.stats.count(False, dec_len - offset, start)
         return buffer
 
-    def decipher(self, buffer, key, iv=None, offset=0, dec_len=512):
-        if self.device_version == LUNII_V3:
-            return self.__v3_decipher(buffer, key, iv, offset, dec_len)
-        else:
-            return self.__v1v2_decipher(buffer, key, offset, dec_len)
-
-    def __v1v2_cipher(self, buffer, key, offset, enc_len):
-        # checking offset
-        if offset > len(buffer):
-            offset = len(buffer)
-        # checking len
-        if offset + enc_len > len(buffer):
-            enc_len = len(buffer) - offset
+    def __v1v2_cipher_into(self, buffer, key, offset, enc_len):
+        start = time.perf_counter()
+        offset, enc_len = self.__header_range(buffer, offset, enc_len)
         # if something to be done
-        if offset < len(buffer) and offset + enc_len <= len(buffer):
-            ciphered = xxtea.encrypt(buffer[offset:enc_len], key, padding=False, rounds=lunii_tea_rounds(buffer[offset:enc_len]))
-            ba_buffer = bytearray(buffer)
-            ba_buffer[offset:enc_len] = ciphered
-            buffer = bytes(ba_buffer)
+        if offset < len(buffer):
+            with memoryview(buffer) as view:
+                header = view[offset:enc_len]
+                header[:] = xxtea.encrypt(header, key, padding=False, rounds=lunii_tea_rounds(header))
+            self.story_keys.stats.count(True, enc_len - offset, start)
         return buffer
 
-    def __v3_cipher(self, buffer, key, iv, offset, enc_len):
-        # checking offset
-        if offset > len(buffer):
-            offset = len(buffer)
-        # checking len
-        if offset + enc_len > len(buffer):
-            enc_len = len(buffer) - offset
+    def __v3_cipher_into(self, buffer, key, iv, offset, enc_len):
+        start = time.perf_counter()
+        offset, enc_len = self.__header_range(buffer, offset, enc_len)
         # checking padding
         if enc_len % 16 != 0:
             padlen = 16 - len(buffer) % 16
+            # buffer must grow, only for files smaller than header (cheap copy)
+            if not isinstance(buffer, bytearray):
+                buffer = bytearray(buffer)
             buffer += b"\x00" * padlen
             enc_len += padlen
         # if something to be done
-        if offset < len(buffer) and offset + enc_len <= len(buffer):
-            cipher = AES.new(key, AES.MODE_CBC, iv)
-            ciphered = cipher.encrypt(buffer[offset:enc_len])
-            ba_buffer = bytearray(buffer)
-            ba_buffer[offset:enc_len] = ciphered
-            buffer = bytes(ba_buffer)
+        if offset < len(buffer):
+            with memoryview(buffer) as view:
+                header = view[offset:enc_len]
+                self.story_keys.encrypt_into(key, iv, header)
+            self.story_keys.stats.count(True, enc_len - offset, start)
         return buffer
 
-    def cipher(self, buffer, key, iv=None, offset=0, enc_len=512):
+    def decipher_into(self, buffer, key, iv=None, offset=0, dec_len=512):
+        if self.device_version == LUNII_V3:
+            return self.__v3_decipher_into(buffer, key, iv, offset, dec_len)
+        else:
+            return self.__v1v2_decipher_into(buffer, key, offset, dec_len)
+
+    def cipher_into(self, buffer, key, iv=None, offset=0, enc_len=512):
         if self.debug_plain:
             return buffer
 
         if self.device_version == LUNII_V3:
-            return self.__v3_cipher(buffer, key, iv, offset, enc_len)
+            return self.__v3_cipher_into(buffer, key, iv, offset, enc_len)
         else:
-            return self.__v1v2_cipher(buffer, key, offset, enc_len)
+            return self.__v1v2_cipher_into(buffer, key, offset, enc_len)
+
+    @staticmethod
+    def __transform_chunks(transform, buffer, length):
+        # header is processed on its own copy, payload is left in source buffer
+        header = transform(bytearray(buffer[:length]))
+        return [header, memoryview(buffer)[length:]]
+
+    def __transform_copy(self, transform, buffer, length):
+        return b"".join(self.__transform_chunks(transform, buffer, length))
+
+    def __v1v2_decipher(self, buffer, key, offset, dec_len):
+        return self.__transform_copy(lambda header: self.__v1v2_decipher_into(header, key, offset, dec_len), buffer, dec_len)
+
+    def decipher(self, buffer, key, iv=None, offset=0, dec_len=512):
+        return self.__transform_copy(lambda header: self.decipher_into(header, key, iv, offset, dec_len), buffer, dec_len)
+
+    def cipher(self, buffer, key, iv=None, offset=0, enc_len=512):
+        if self.debug_plain:
+            return buffer
+
+        return self.__transform_copy(lambda header: self.cipher_into(header, key, iv, offset, enc_len), buffer, enc_len)
+
+    def cipher_chunks(self, buffer, key, iv=None, offset=0, enc_len=512):
+        if self.debug_plain:
+            return [buffer]
+
+        return self.__transform_chunks(lambda header: self.cipher_into(header, key, iv, offset, enc_len), buffer, enc_len)
 
     def load_story_keys(self, bt_file_path):
+        self.story_key, self.story_iv = self.__get_story_keys(bt_file_path)
+
+    def __get_story_keys(self, bt_file_path):
         if self.device_key and self.device_iv and bt_file_path and os.path.isfile(bt_file_path):
-            # loading real keys from bt file
-            with open(bt_file_path, "rb") as fpbt:
-                ciphered = fpbt.read(0x20)
-            plain = self.decipher(ciphered, self.device_key, self.device_iv)
-            self.story_key = reverse_bytes(plain[:0x10])
-            self.story_iv = reverse_bytes(plain[0x10:0x20])
-        else:
-            # forging keys based on md ciphered part
-            self.load_md_fakestory_keys()
+            # loading real keys from bt file (deciphered once, until bt changes)
+            return self.story_keys.get(bt_file_path, self.__read_story_keys)
+
+        # forging keys based on md ciphered part
+        return self.__md_fakestory_keys()
+
+    def __read_story_keys(self, bt_file_path):
+        with open(bt_file_path, "rb") as fpbt:
+            ciphered = fpbt.read(0x20)
+        plain = self.decipher(ciphered, self.device_key, self.device_iv)
+        return reverse_bytes(plain[:0x10]), reverse_bytes(plain[0x10:0x20])
+
+    def __write_bt(self, bt_path):
+        # story contents reach the device before bt marks it complete
+        self.writer.flush()
+        self.writer.sync()
+        with open(bt_path, "wb") as fp_bt:
+            fp_bt.write(self.bt)
+        # keys must be read again from this new file
+        self.story_keys.invalidate(bt_path)
 
     def load_md_fakestory_keys(self):
+        self.story_key, self.story_iv = self.__md_fakestory_keys()
+
+    def __md_fakestory_keys(self):
         # forging keys based on md ciphered part
-        self.story_key = reverse_bytes(binascii.hexlify(self.snu) + b"\x00\x00")
-        self.story_iv = reverse_bytes(b"\x00\x00\x00\x00\x00\x00\x00\x00" + binascii.hexlify(self.snu)[:8])
+        story_key = reverse_bytes(binascii.hexlify(self.snu) + b"\x00\x00")
+        story_iv = reverse_bytes(b"\x00\x00\x00\x00\x00\x00\x00\x00" + binascii.hexlify(self.snu)[:8])
+        return story_key, story_iv
 
     @property
     def snu_hex(self):
@@ -301,139 +392,180 @@ class LuniiDevice:
         return repr_str
 
     def export_all(self, out_path):
+        # stories are prepared in order (checks, keys), then zipped by a pool of workers
+        # device reads are shared by a few readers only, results keep stories order
+        gate = DeviceReadGate(self.export_readers)
+        jobs = self.__export_jobs(out_path)
+
+        # stories being zipped concurrently, progress is reported per story
         archives = []
-        for count, story in enumerate(self.stories):
-            self.logger.log(logging.INFO, f"{count+1:>2}/{len(self.stories)} ")
-            one_zip = self.export_story(str(story)[28:], out_path)
+        results = ordered_map(lambda job: self.__export_zip(job, gate), jobs, self.export_workers)
+        pbar = tqdm(iterable=results, total=len(self.stories), unit="story", bar_format=TQDM_BAR_FORMAT)
+        for one_zip in pbar:
             if one_zip:
+                pbar.set_description(f"Exported {one_zip.name}")
                 archives.append(one_zip)
+        pbar.close()
+
+        self.logger.log(logging.DEBUG, gate)
+        self.logger.log(logging.DEBUG, self.story_keys)
         return archives
 
+    def __export_jobs(self, out_path):
+        for count, story in enumerate(self.stories):
+            # abort requested ? no more stories
+            if self.abort_process:
+                return
+            self.logger.log(logging.INFO, f"{count+1:>2}/{len(self.stories)} ")
+            yield self.__export_job(story, out_path)
+
     def update_pack_index(self):
         pi_path = Path(self.mount_point).joinpath(".pi")
         pi_hidden_path = Path(self.mount_point).joinpath(".pi.hidden")
-        pi_path.unlink(missing_ok=True)
-        pi_hidden_path.unlink(missing_ok=True)
-        with open(pi_path, "wb") as fp_pi, open(pi_hidden_path, "wb") as fp_hidden:
-            for story in self.stories:
-                if story.hidden:
-                    fp_hidden.write(story.uuid.bytes)
-                else:
-                    fp_pi.write(story.uuid.bytes)
+        pi_data = b"".join(story.uuid.bytes for story in self.stories if not story.hidden)
+        pi_hidden_data = b"".join(story.uuid.bytes for story in self.stories if story.hidden)
+        # written aside then renamed, device never sees a truncated index
+        for index_path, data in [(pi_path, pi_data), (pi_hidden_path, pi_hidden_data)]:
+            index_tmp = index_path.with_name(index_path.name + ".tmp")
+            with open(index_tmp, "wb") as fp_index:
+                fp_index.write(data)
+            os.replace(index_tmp, index_path)
         return
 
-    def __valid_story(self, story_path):
+    # within this block, imported stories are added to .pi at exit (single index write)
+    #   with device.import_batch():
+    #       for pk in ...:
+    #           device.import_story(pk)
+    @contextmanager
+    def import_batch(self):
+        self.__batch_depth += 1
+        try:
+            yield
+        finally:
+            self.__batch_depth -= 1
+            if not self.__batch_depth:
+                self.update_pack_index()
+                self.staging.done()
+
+    # staging directory of a new story, no directory known by writer from a previous one
+    def __begin_story(self, story_uuid: UUID):
+        self.writer.discard()
+        return self.staging.begin(story_uuid)
+
+    # moves a complete staged story into place, then adds it to .pi (False if refused)
+    def __commit_story(self, story_uuid: UUID):
+        # title and description saved before the story is in place (batch import)
+        stories.thirdparty_db_flush()
+        story_path = self.staging.commit(story_uuid)
+        if not story_path:
+            return False
+        # keys cached for a previous story at same place are obsolete
+        self.story_keys.invalidate(story_path.joinpath("bt"))
+
+        self.stories.append(Story(story_uuid))
+        if not self.__batch_depth:
+            self.update_pack_index()
+            self.staging.done()
+        return True
+
+    # validates one story directory, called from scan threads : device state is left untouched
+    def __check_story(self, scan: StoryScan):
+        # looking complete UUID in official DB, then third party DB
+        str_uuid = stories.DB.find_uuid(scan.name)
+        # padding partial UUID
+        if not str_uuid and len(scan.name) == 8 and all(c in hexdigits for c in scan.name):
+            str_uuid = "00"*12 + scan.name
+
+        # prepare for story analysis
+        try:
+            scan.uuid = UUID(str_uuid)
+        except (TypeError, ValueError):
+            return
+        scan.str_uuid = str_uuid
+
         # getting all files in story
-        story_files = glob.glob(os.path.join(story_path, "**/*"), recursive=True)
+        inventory = scan.inventory = StoryInventory(scan.path)
+        story_path = Path(scan.path)
 
         # expected files
         expected_files = ["li", "ni", "ri", "si"]
         for pattern in expected_files:
-            if not any(entry.lower().endswith(pattern) for entry in story_files):
-                self.logger.log(logging.WARN, f"Missing {pattern} in {story_path}")
-                return False
+            if not inventory.any_endswith(pattern):
+                scan.issues.append(f"Missing {pattern} in {scan.path}")
+                return
 
         # checking for bt file
         # for Lunii v3, checking keys (original or trick)
+        story_keys = None
         if self.device_version == LUNII_V3:
             # loading story keys
-            self.load_story_keys(os.path.join(story_path, "bt"))
+            story_keys = self.__get_story_keys(os.path.join(scan.path, "bt"))
             # are keys usable ?
-            if not self.__story_check_v3key(Path(story_path), self.story_key, self.story_iv):
+            if not self.__story_check_v3key(story_path, *story_keys):
                 # not the trick keys or dev keys unknown... can't get further
-                return True
+                scan.valid = True
+                return
 
-        # checking auth file (if possible) + fix
+        # checking auth file (if possible), fix is written by caller
         if self.device_version <= LUNII_V2:
-            if not self.__story_check_v2bt(Path(story_path)):
-                self.logger.log(logging.WARN, f"Bad authorization file bt in {story_path}")
-
-                # Fixing bt file
-                data_ri = b""
-                with open(os.path.join(story_path, "ri"), "rb") as fp:
+            if not self.__story_check_v2bt(story_path):
+                scan.issues.append(f"Bad authorization file bt in {scan.path}")
+                with open(os.path.join(scan.path, "ri"), "rb") as fp:
                     data_ri = fp.read(0x40)
-                self.bt = self.cipher(data_ri[0:0x40], self.device_key)
-
-                # creating authorization file : bt
-                self.logger.log(logging.INFO, "Authorization file creation...")
-                with open(os.path.join(story_path, "bt"), "wb") as fp_bt:
-                    fp_bt.write(self.bt)
-
+                scan.bt_fix = self.cipher(data_ri[0:0x40], self.device_key)
 
         # expected dirs
         expected_dirs = ["rf", "sf"]
         for pattern in expected_dirs:
-            if not any(entry.lower().endswith(pattern) for entry in story_files):
-                self.logger.log(logging.WARN, f"Missing {pattern} in {story_path}")
-                return False
+            if not inventory.any_endswith(pattern):
+                scan.issues.append(f"Missing {pattern} in {scan.path}")
+                return
+
+        # parsing ri / si files - each resource must exist
+        for index_file, res_dir in [("ri", "rf"), ("si", "sf")]:
+            index_plain = self.__get_plain_data(os.path.join(scan.path, index_file), story_keys).decode("utf-8")
+            index_plain = index_plain.rstrip('\x00')
+            for res in [index_plain[i:i+12] for i in range(0, len(index_plain), 12)]:
+                res = res.replace('\\', '/')
+                if not inventory.has_file(f"{res_dir}/{res}"):
+                    scan.issues.append(f"Missing {res_dir}/{res} in {scan.path}")
+                    return
 
-        # parsing ri file - each resource must exist
-        ri_plain = self.__get_plain_data(os.path.join(story_path, "ri")).decode("utf-8")
-        ri_plain = ri_plain.rstrip('\x00')
-        ri_lines = [ri_plain[i:i+12] for i in range(0, len(ri_plain), 12)]
-        for res in ri_lines:
-            res = res.replace('\\', '/')
-            res_path = os.path.join(story_path, "rf", res)
-            if not os.path.isfile(res_path):
-                self.logger.log(logging.WARN, f"Missing rf/{res} in {story_path}")
-                return False
+        # all requested files are there, including auth file ans resources
+        scan.valid = True
 
-        # parsing si file - each resource must exist
-        si_plain = self.__get_plain_data(os.path.join(story_path, "si")).decode("utf-8")
-        si_plain = si_plain.rstrip('\x00')
-        si_lines = [si_plain[i:i+12] for i in range(0, len(si_plain), 12)]
-        for res in si_lines:
-            res = res.replace('\\', '/')
-            res_path = os.path.join(story_path, "sf", res)
-            if not os.path.isfile(res_path):
-                self.logger.log(logging.WARN, f"Missing sf/{res} in {story_path}")
-                return False
+    # one pass over .content, stories directories being checked concurrently
+    def scan_stories(self, validate=True) -> ScanReport:
+        content_dir = os.path.join(self.mount_point, self.STORIES_BASEDIR)
+        report = scan_stories(content_dir, self.__check_story if validate else inventory_story, self.scan_workers)
 
-        # all requested files are there, including auth file ans resources
-        return True
+        for scan in report.stories:
+            scan.listed = (scan.str_uuid or scan.name) in self.stories
+        return report
 
     # try to recover lost stories from .content directory
     def recover_stories(self, dry_run: bool):
         recovered = 0
 
-        # getting all stories
-        content_dir = os.path.join(self.mount_point, self.STORIES_BASEDIR)
-        try:
-            stories_dir = [entry for entry in os.listdir(content_dir) if os.path.isdir(os.path.join(content_dir, entry))]
-        except FileNotFoundError:
-            return recovered
-        stories_dir.sort()
-
-        # Manage the progress bar
-        pbar = tqdm(iterable=stories_dir, total=len(stories_dir), bar_format=TQDM_BAR_FORMAT)
-        for story in pbar:
-            # directory is a partial UUID
-            pbar.set_description(f"Processing {story}")
-
-            str_uuid = None
-            # looking complete UUID in official DB
-            if not str_uuid:
-                str_uuid = next((uuid for uuid in stories.DB_OFFICIAL if story.upper() in uuid.upper()), None)
-            # looking complete UUID in third party DB
-            if not str_uuid:
-                str_uuid = next((uuid for uuid in stories.DB_THIRD_PARTY if story.upper() in uuid.upper()), None)
-            # padding partial UUID
-            if not str_uuid and len(story) == 8 and all(c in hexdigits for c in story):
-                str_uuid = "00"*12 + story
-
-            # prepare for story analysis
-            try:
-                full_uuid = UUID(str_uuid)
-            except (TypeError, ValueError) as e:
-                self.logger.log(logging.DEBUG, f"Not a valid UUID - {str_uuid}")
+        for scan in self.scan_stories().stories:
+            if not scan.str_uuid:
+                self.logger.log(logging.DEBUG, f"Not a valid UUID - {scan.name}")
                 continue
 
-            one_story = Story(full_uuid)
-            story_dir = os.path.join(content_dir, story)
+            for issue in scan.issues:
+                self.logger.log(logging.WARN, issue)
+            # fixing bt file
+            if scan.bt_fix:
+                self.bt = scan.bt_fix
+                # creating authorization file : bt
+                self.logger.log(logging.INFO, "Authorization file creation...")
+                self.__write_bt(os.path.join(scan.path, "bt"))
 
-            if str_uuid not in self.stories:
+            full_uuid = scan.uuid
+            one_story = Story(full_uuid)
+            if not scan.listed:
                 # Lost Story
-                if self.__valid_story(story_dir):
+                if scan.valid:
 
                     # is it a dry run ?
                     if not dry_run:
@@ -446,36 +578,28 @@ class LuniiDevice:
                     self.logger.log(logging.INFO, f"Skipping lost story (seems broken/incomplete) - {str(full_uuid).upper()} - {one_story.name}")
             else:
                 # In DB story
-                if not self.__valid_story(story_dir):
+                if not scan.valid:
                     self.logger.log(logging.WARNING, f"Already in list but invalid - {str(full_uuid).upper()} - {one_story.name}")
                 else:
                     self.logger.log(logging.DEBUG, f"Already in list - {str(full_uuid).upper()} - {one_story.name}")
 
+        self.logger.log(logging.DEBUG, self.story_keys)
         return recovered
 
     def cleanup_stories(self):
         removed = 0
         recovered_size = 0
 
-        # getting all stories
+        # getting all stories (with their size)
         content_dir = os.path.join(self.mount_point, self.STORIES_BASEDIR)
-        stories_dir = [entry for entry in os.listdir(content_dir) if os.path.isdir(os.path.join(content_dir, entry))]
-
-        # Manage the progress bar
-        pbar = tqdm(iterable=stories_dir, total=len(stories_dir), bar_format=TQDM_BAR_FORMAT)
-        for story in pbar:
-            # directory is a partial UUID
-            pbar.set_description(f"Processing {story}")
-
-            if story not in self.stories:
+        for scan in self.scan_stories(validate=False).stories:
+            if scan.name not in self.stories:
                 # remove it
                 try:
-                    lost_story_path = os.path.join(content_dir, story)
+                    lost_story_path = os.path.join(content_dir, scan.name)
 
                     # computing lost size
-                    for parent_dir, _, files in os.walk(lost_story_path):
-                        for file in files:
-                            recovered_size += os.path.getsize(os.path.join(parent_dir, file))
+                    recovered_size += scan.inventory.size
 
                     # removing whole directory
                     self.logger.log(logging.INFO, f"Deleting - {lost_story_path}")
@@ -487,14 +611,41 @@ class LuniiDevice:
 
         return removed, recovered_size//1024//1024
 
-    def __get_plain_data(self, file):
+    def __get_plain_data(self, file, story_keys=None):
         if not os.path.isfile(file):
             return b""
 
-        # opening file
+        # opening file (into a buffer to be deciphered in place)
+        data = bytearray(os.path.getsize(file))
         with open(file, "rb") as fsrc:
-            data = fsrc.read()
+            fsrc.readinto(data)
+
+        # process file with correct key
+        key, iv = self.__get_plain_key(file, story_keys)
+        if key:
+            return self.decipher_into(data, key, iv)
 
+        return data
+
+    def __export_file(self, zip_out: zipfile.ZipFile, file, arcname, story_keys=None, gate=None):
+        # same entry attributes than ZipFile.writestr()
+        zinfo = zipfile.ZipInfo(arcname, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = entry_compression(arcname, zip_out.compression)
+        zinfo.external_attr = 0o600 << 16
+        zinfo.file_size = os.path.getsize(file)
+
+        # only header is deciphered, payload is streamed untouched to the archive
+        key, iv = self.__get_plain_key(file, story_keys)
+        with open(file, "rb") as fsrc, zip_out.open(zinfo, "w") as fdst:
+            if gate:
+                fsrc = gate.reader(fsrc)
+            header = bytearray(fsrc.read(LUNII_HEADER_SIZE))
+            if key:
+                self.decipher_into(header, key, iv)
+            fdst.write(header)
+            shutil.copyfileobj(fsrc, fdst, EXPORT_COPY_CHUNK)
+
+    def __get_plain_key(self, file, story_keys=None):
         # selecting key
         key = None
         iv = None
@@ -502,8 +653,7 @@ class LuniiDevice:
             key = lunii_generic_key
             iv = None
         elif self.device_version == LUNII_V3:
-            key = self.story_key
-            iv = self.story_iv
+            key, iv = story_keys or (self.story_key, self.story_iv)
            
         if file.endswith("bt"):
             if self.device_version <= LUNII_V2:
@@ -515,11 +665,7 @@ class LuniiDevice:
         if file.endswith("ni") or file.endswith("nm"):
             key = None
 
-        # process file with correct key
-        if key:
-            return self.decipher(data, key, iv)
-
-        return data
+        return key, iv
 
     def __get_plain_name(self, file, uuid):
         file = file.split(uuid.upper())[1]
@@ -537,6 +683,9 @@ class LuniiDevice:
         return file
 
     def __get_ciphered_data(self, file, data):
+        return b"".join(self.__get_ciphered_chunks(file, data))
+
+    def __get_ciphered_chunks(self, file, data):
         # selecting key
         if self.device_version <= LUNII_V2:
             key = lunii_generic_key
@@ -552,9 +701,18 @@ class LuniiDevice:
 
         # process file with correct key
         if key:
-            return self.cipher(data, key, iv)
+            return self.cipher_chunks(data, key, iv)
 
-        return data
+        return [data]
+
+    def __get_transciphered_chunks(self, file, data_v2):
+        if file.endswith("ni") or file.endswith("nm"):
+            return self.__get_ciphered_chunks(file, data_v2)
+
+        # generic v2 header deciphered, then ciphered for this device, payload is left untouched
+        header = bytearray(data_v2[:LUNII_HEADER_SIZE])
+        self.__v1v2_decipher_into(header, lunii_generic_key, 0, LUNII_HEADER_SIZE)
+        return [self.__get_ciphered_data(file, header), memoryview(data_v2)[LUNII_HEADER_SIZE:]]
 
     def __get_ciphered_name(self, file: str, studio_ri=False, studio_si=False):
         file = file.removesuffix('.plain')
@@ -588,358 +746,363 @@ class LuniiDevice:
         pk_list = []
         for ext in LUNII_SUPPORTED_EXT:
             pk_list += glob.glob(os.path.join(story_path, "**/*" + ext), recursive=True)
+        # .pk pattern also matches .v1.pk / .v2.pk / .plain.pk archives
+        pk_list = list(dict.fromkeys(pk_list))
         self.logger.log(logging.INFO, f"Importing {len(pk_list)} archives...")
-        for index, pk in enumerate(pk_list):
-            self.logger.log(logging.INFO, f"{index+1:>2}/{len(pk_list)} > {pk}")
-            self.import_story(pk)
-        
+
+        # archives imported by a previous run are skipped without being opened
+        manifest = ImportManifest().load()
+        todo_list = []
+        for pk in pk_list:
+            story_uuid = manifest.story_uuid(pk)
+            if story_uuid and str(story_uuid) in self.stories:
+                self.logger.log(logging.DEBUG, f"Skipping {pk}, already loaded - {story_uuid}")
+            else:
+                todo_list.append(pk)
+        if len(todo_list) < len(pk_list):
+            self.logger.log(logging.INFO, f"{len(pk_list) - len(todo_list)} archives already loaded, skipped")
+        # whole batch checked against free space before writing anything
+        footprints = self.__plan_imports(todo_list)
+        todo_list = list(footprints)
+
+        # third-party metadata saved once for all archives
+        with stories.thirdparty_db_batch(), self.import_batch(), ArchivePrefetch() as prefetch:
+            for index, pk in enumerate(todo_list):
+                # next archive read while this one is written to device
+                if index + 1 < len(todo_list):
+                    prefetch.fetch(todo_list[index + 1])
+
+                self.logger.log(logging.INFO, f"{index+1:>2}/{len(todo_list)} > {pk}")
+                self.archive_uuid = None
+                if self.import_story(pk, footprints[pk]):
+                    status = STATUS_IMPORTED
+                elif self.archive_uuid and str(self.archive_uuid) in self.stories:
+                    status = STATUS_LOADED
+                else:
+                    status = STATUS_FAILED
+
+                # saved after each archive, an interrupted run resumes from here
+                manifest.record(pk, self.archive_uuid, status)
+                manifest.save()
+
+        self.logger.log(logging.DEBUG, self.story_keys)
         return True
     
-    def import_story(self, story_path):
-        archive_type = TYPE_UNK
+    # archives fitting in free space (in given order) with their footprint, those left over
+    # are rejected at once
+    def __plan_imports(self, pk_list):
+        cluster = cluster_size(self.mount_point)
+        free_space = psutil.disk_usage(str(self.mount_point)).free
 
+        planned = {}
+        for pk in pk_list:
+            try:
+                with StoryArchive.open(pk) as archive:
+                    self.__archive_type(archive)
+                    footprint = story_footprint(archive, cluster)
+            except BAD_ARCHIVE_ERRORS + (OSError,):
+                # reported by import
+                planned[pk] = None
+                continue
+
+            if footprint >= free_space:
+                self.logger.log(logging.ERROR, f"Not enough space left on Lunii for {pk} (only {free_space//1024//1024}MB, {footprint//1024//1024}MB needed)")
+                continue
+            free_space -= footprint
+            planned[pk] = footprint
+
+        if len(planned) < len(pk_list):
+            self.logger.log(logging.WARNING, f"{len(pk_list) - len(planned)} archives won't fit on Lunii, skipped")
+        return planned
+
+    # footprint is the one planned by import_dir, computed otherwise
+    def import_story(self, story_path, footprint=None):
         self.logger.log(logging.INFO, f"🚧 Loading {story_path}...")
 
-        archive_size = os.path.getsize(story_path)
-        free_space = psutil.disk_usage(str(self.mount_point)).free
-        if archive_size >= free_space:
-            self.logger.log(logging.ERROR, f"Not enough space left on Lunii (only {free_space//1024//1024}MB)")
+        # checking if archive is OK, opened once for detection, checks and extraction
+        try:
+            archive = StoryArchive.open(story_path)
+        except BAD_ARCHIVE_ERRORS as e:
+            self.logger.log(logging.ERROR, e)
             return False
 
+        with archive:
+            archive_type = self.__archive_type(archive)
+
+            # space needed once extracted (and transcoded), rounded to device clusters
+            if footprint is None:
+                footprint = story_footprint(archive, cluster_size(self.mount_point))
+            free_space = psutil.disk_usage(str(self.mount_point)).free
+            if footprint >= free_space:
+                self.logger.log(logging.ERROR, f"Not enough space left on Lunii (only {free_space//1024//1024}MB, {footprint//1024//1024}MB needed)")
+                return False
+
+            # processing story, whatever is left in staging (error, abort) is dropped
+            try:
+                if archive_type == TYPE_PLAIN:
+                    self.logger.log(logging.DEBUG, "Archive => TYPE_PLAIN")
+                    return self.import_story_plain(archive)
+                elif archive_type == TYPE_ZIP:
+                    self.logger.log(logging.DEBUG, "Archive => TYPE_ZIP")
+                    return self.import_story_zip(archive)
+                elif archive_type == TYPE_7Z:
+                    self.logger.log(logging.DEBUG, "Archive => TYPE_7Z")
+                    return self.import_story_7z(archive)
+                elif archive_type == TYPE_V2:
+                    self.logger.log(logging.DEBUG, "Archive => TYPE_V2")
+                    return self.import_story_v2(archive)
+                elif archive_type == TYPE_V3:
+                    self.logger.log(logging.DEBUG, "Archive => TYPE_V3")
+                    return self.import_story_v3(archive)
+                elif archive_type == TYPE_STUDIO_ZIP:
+                    self.logger.log(logging.DEBUG, "Archive => TYPE_STUDIO_ZIP")
+                    return self.import_story_studio_zip(archive)
+                elif archive_type == TYPE_STUDIO_7Z:
+                    self.logger.log(logging.DEBUG, "Archive => TYPE_STUDIO_7Z")
+                    return self.import_story_studio_7z(archive)
+            finally:
+                # files of a failed story are never written
+                self.writer.discard()
+                self.staging.rollback()
+
+    def __archive_type(self, archive: StoryArchive):
+        archive_type = TYPE_UNK
+        story_path = str(archive.path).lower()
+        # reading all available files
+        contents = archive.names
+
         # identifying based on filename
-        if story_path.lower().endswith(EXT_PK_PLAIN):
+        if story_path.endswith(EXT_PK_PLAIN):
             archive_type = TYPE_PLAIN
-        elif story_path.lower().endswith(EXT_PK_V2):
+        elif story_path.endswith(EXT_PK_V2):
             archive_type = TYPE_V2
-        elif story_path.lower().endswith(EXT_PK_V1):
+        elif story_path.endswith(EXT_PK_V1):
             archive_type = TYPE_V2
-        elif story_path.lower().endswith(EXT_ZIP):
+        elif story_path.endswith(EXT_ZIP):
             archive_type = TYPE_ZIP
-        elif story_path.lower().endswith(EXT_7z):
+        elif story_path.endswith(EXT_7z):
             archive_type = TYPE_7Z
-        elif story_path.lower().endswith(EXT_PK_VX):
+        elif story_path.endswith(EXT_PK_VX):
             # trying to guess version v1/2 or v3 based on bt contents
-            with zipfile.ZipFile(file=story_path) as zip_file:
-                # reading all available files
-                zip_contents = zip_file.namelist()
-
-                # based on bt file
-                bt_files = [entry for entry in zip_contents if entry.endswith("bt")]
-                if bt_files:
-                    bt_size = zip_file.getinfo(bt_files[0]).file_size
-                    if bt_size == 0x20:
-                        archive_type = TYPE_V3
-                    else:
-                        archive_type = TYPE_V2
-                # based on ri
-                elif (any(file.endswith("ri") for file in zip_contents) and
-                      any(file.endswith("si") for file in zip_contents) and
-                      any(file.endswith("ni") for file in zip_contents) and
-                      any(file.endswith("li") for file in zip_contents)):
-                    # trying to decipher ri with v2
-
-                    ri_file = next(file for file in zip_contents if file.endswith("ri"))
-                    ri_ciphered = zip_file.read(ri_file)
-                    ri_plain = self.__v1v2_decipher(ri_ciphered, lunii_generic_key, 0, 512)
-                    if ri_plain[:4] == b"000\\":
-                        archive_type = TYPE_V2
-                    else:
-                        archive_type = TYPE_V3
+            bt_files = [entry for entry in contents if entry.endswith("bt")]
+            if bt_files:
+                bt_size = archive.sizes.get(bt_files[0], 0)
+                if bt_size == 0x20:
+                    archive_type = TYPE_V3
+                else:
+                    archive_type = TYPE_V2
+            # based on ri
+            elif (any(file.endswith("ri") for file in contents) and
+                  any(file.endswith("si") for file in contents) and
+                  any(file.endswith("ni") for file in contents) and
+                  any(file.endswith("li") for file in contents)):
+                # trying to decipher ri with v2
+
+                ri_file = next(file for file in contents if file.endswith("ri"))
+                ri_ciphered = archive.read(ri_file)
+                ri_plain = self.__v1v2_decipher(ri_ciphered, lunii_generic_key, 0, 512)
+                if ri_plain[:4] == b"000\\":
+                    archive_type = TYPE_V2
                 else:
-                    archive_type = TYPE_UNK
+                    archive_type = TYPE_V3
+            else:
+                archive_type = TYPE_UNK
 
         # supplementary verification for zip
         if archive_type == TYPE_ZIP:
-            # trying to figure out based on zip contents
-            with zipfile.ZipFile(file=story_path) as zip_file:
-                # reading all available files
-                zip_contents = zip_file.namelist()
-
-                # checking for STUdio format
-                if FILE_STUDIO_JSON in zip_contents and any('assets/' in entry for entry in zip_contents):
-                    archive_type = TYPE_STUDIO_ZIP
-                elif FILE_UUID in zip_contents:
-                    archive_type = TYPE_ZIP
-                else:
-                    archive_type = TYPE_V2
+            # checking for STUdio format
+            if FILE_STUDIO_JSON in contents and any('assets/' in entry for entry in contents):
+                archive_type = TYPE_STUDIO_ZIP
+            elif FILE_UUID in contents:
+                archive_type = TYPE_ZIP
+            else:
+                archive_type = TYPE_V2
         # supplementary verification for 7z
         elif archive_type == TYPE_7Z:
-            # trying to figure out based on 7z contents
-            with py7zr.SevenZipFile(story_path, 'r') as archive:
-                # reading all available files
-                contents = archive.getnames()
-
-                # checking for STUdio format
-                if FILE_STUDIO_JSON in contents and any('assets/' in entry for entry in contents):
-                    archive_type = TYPE_STUDIO_7Z
-
-        # processing story
-        if archive_type == TYPE_PLAIN:
-            self.logger.log(logging.DEBUG, "Archive => TYPE_PLAIN")
-            return self.import_story_plain(story_path)
-        elif archive_type == TYPE_ZIP:
-            self.logger.log(logging.DEBUG, "Archive => TYPE_ZIP")
-            return self.import_story_zip(story_path)
-        elif archive_type == TYPE_7Z:
-            self.logger.log(logging.DEBUG, "Archive => TYPE_7Z")
-            return self.import_story_7z(story_path)
-        elif archive_type == TYPE_V2:
-            self.logger.log(logging.DEBUG, "Archive => TYPE_V2")
-            return self.import_story_v2(story_path)
-        elif archive_type == TYPE_V3:
-            self.logger.log(logging.DEBUG, "Archive => TYPE_V3")
-            return self.import_story_v3(story_path)
-        elif archive_type == TYPE_STUDIO_ZIP:
-            self.logger.log(logging.DEBUG, "Archive => TYPE_STUDIO_ZIP")
-            return self.import_story_studio_zip(story_path)
-        elif archive_type == TYPE_STUDIO_7Z:
-            self.logger.log(logging.DEBUG, "Archive => TYPE_STUDIO_7Z")
-            return self.import_story_studio_7z(story_path)
-
-    def import_story_plain(self, story_path):
-        # checking if archive is OK
+            # checking for STUdio format
+            if FILE_STUDIO_JSON in contents and any('assets/' in entry for entry in contents):
+                archive_type = TYPE_STUDIO_7Z
+
+        archive.archive_type = archive_type
+        return archive_type
+
+    def import_story_plain(self, archive: StoryArchive):
+        # reading all available files
+        zip_contents = archive.names
+        if FILE_UUID not in zip_contents:
+            self.logger.log(logging.ERROR, "No UUID file found in archive. Unable to add this story.")
+            return False
+
+        # getting UUID file
         try:
-            with zipfile.ZipFile(file=story_path):
-                pass  # If opening succeeds, the archive is valid
-        except zipfile.BadZipFile as e:
+            new_uuid = UUID(bytes=archive.read(FILE_UUID))
+        except ValueError as e:
             self.logger.log(logging.ERROR, e)
             return False
-        
-        # opening zip file
-        with zipfile.ZipFile(file=story_path) as zip_file:
-            # reading all available files
-            zip_contents = zip_file.namelist()
-            if FILE_UUID not in zip_contents:
-                self.logger.log(logging.ERROR, "No UUID file found in archive. Unable to add this story.")
-                return False
+    
+        # checking if UUID already loaded
+        self.archive_uuid = new_uuid
+        if str(new_uuid) in self.stories:
+            self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded !")
+            return False
 
-            # getting UUID file
-            try:
-                new_uuid = UUID(bytes=zip_file.read(FILE_UUID))
-            except ValueError as e:
-                self.logger.log(logging.ERROR, e)
+        # thirdparty story ?
+        if FILE_META in zip_contents:
+            # creating story entry in thirdparty db
+            meta = archive.read(FILE_META)
+            s_meta = json.loads(meta)
+            if s_meta.get("uuid").upper() != str(new_uuid).upper():
                 return False
-        
-            # checking if UUID already loaded
-            if str(new_uuid) in self.stories:
-                self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded !")
-                return False
-
-            # thirdparty story ?
-            if FILE_META in zip_contents:
-                # creating story entry in thirdparty db
-                meta = zip_file.read(FILE_META)
-                s_meta = json.loads(meta)
-                if s_meta.get("uuid").upper() != str(new_uuid).upper():
-                    return False
-                stories.thirdparty_db_add_story(new_uuid, s_meta.get("title"), s_meta.get("description"))
-            if FILE_THUMB in zip_contents:
-                # creating story picture in cache
-                image_data = zip_file.read(FILE_THUMB)
-                stories.thirdparty_db_add_thumb(new_uuid, image_data)
-
-            # decompressing story contents
-            short_uuid = str(new_uuid).upper()[28:]
-            output_path = Path(self.mount_point).joinpath(f"{self.STORIES_BASEDIR}{short_uuid}")
-            if not output_path.exists():
-                output_path.mkdir(parents=True)
-
-            # Loop over each file
+            stories.thirdparty_db_add_story(new_uuid, s_meta.get("title"), s_meta.get("description"))
+        if FILE_THUMB in zip_contents:
+            # creating story picture in cache
+            image_data = archive.read(FILE_THUMB)
+            stories.thirdparty_db_add_thumb(new_uuid, image_data)
+
+        # decompressing story contents
+        output_path = self.__begin_story(new_uuid)
+
+        # Loop over each file, skipping .plain.pk specific files
+        story_files = [file for file in zip_contents if file not in [FILE_UUID, FILE_META, FILE_THUMB]]
+        with ImportPipeline(archive.read, writer=self.writer) as pipe:
             # Manage the progress bar
-            pbar = tqdm(iterable=zip_contents, total=len(zip_contents), bar_format=TQDM_BAR_FORMAT)
-            for file in pbar:
+            pbar = tqdm(iterable=pipe.entries(story_files), total=len(story_files), bar_format=TQDM_BAR_FORMAT)
+            for file, data_plain in pbar:
                 # abort requested ? early exit
                 if self.abort_process:
                     self.logger.log(logging.WARNING, f"Import aborted, performing cleanup on current story...")
-                    self.__clean_up_story_dir(new_uuid)
+                    pipe.abort()
+                    self.staging.rollback(new_uuid)
                     return False
 
-                # skipping .plain.pk specific files 
-                if file in [FILE_UUID, FILE_META, FILE_THUMB]:
-                    continue
-
                 pbar.set_description(f"Processing {file}")
 
-                # Extract each zip file
-                data_plain = zip_file.read(file)
-
                 # updating filename, and ciphering header if necessary
-                data = self.__get_ciphered_data(file, data_plain)
+                data = self.__get_ciphered_chunks(file, data_plain)
                 file_newname = self.__get_ciphered_name(file)
 
-                target: Path = output_path.joinpath(file_newname)
-
-                # create target directory
-                if not target.parent.exists():
-                    target.parent.mkdir(parents=True)
                 # write target file
-                with open(target, "wb") as f_dst:
-                    f_dst.write(data)
+                pipe.write(output_path.joinpath(file_newname), data)
 
-                # in case of v2 device, we need to prepare bt file 
+                # in case of v2 device, we need to prepare bt file (from ciphered header chunk)
                 if self.device_version <= LUNII_V2 and file.endswith("ri.plain"):
-                    self.bt = self.cipher(data[0:0x40], self.device_key)
+                    self.bt = self.cipher(data[0][0:0x40], self.device_key)
+        self.logger.log(logging.DEBUG, f"Import pipeline : {pipe.stats}")
 
         # creating authorization file : bt
         self.logger.log(logging.INFO, "Authorization file creation...")
         bt_path = output_path.joinpath("bt")
-        with open(bt_path, "wb") as fp_bt:
-            fp_bt.write(self.bt)
+        self.__write_bt(bt_path)
 
-        # updating .pi file to add new UUID
-        self.stories.append(Story(new_uuid))
-        self.update_pack_index()
+        # moving story in place, and updating .pi file to add new UUID
+        return self.__commit_story(new_uuid)
 
-        return True
+    def import_story_zip(self, archive: StoryArchive):
+        # reading all available files
+        zip_contents = archive.names
+        if FILE_UUID not in zip_contents:
+            self.logger.log(logging.ERROR, "No UUID file found in archive. Unable to add this story.")
+            return False
+        if FILE_STUDIO_JSON in zip_contents:
+            self.logger.log(logging.ERROR, "Studio story format is not supported. Unable to add this story.")
+            return False
 
-    def import_story_zip(self, story_path):
-        # checking if archive is OK
+        # getting UUID file
         try:
-            with zipfile.ZipFile(file=story_path):
-                pass  # If opening succeeds, the archive is valid
-        except zipfile.BadZipFile as e:
+            new_uuid = UUID(bytes=archive.read(FILE_UUID))
+        except ValueError as e:
             self.logger.log(logging.ERROR, e)
             return False
-        
-        # opening zip file
-        with zipfile.ZipFile(file=story_path) as zip_file:
-            # reading all available files
-            zip_contents = zip_file.namelist()
-            if FILE_UUID not in zip_contents:
-                self.logger.log(logging.ERROR, "No UUID file found in archive. Unable to add this story.")
-                return False
-            if FILE_STUDIO_JSON in zip_contents:
-                self.logger.log(logging.ERROR, "Studio story format is not supported. Unable to add this story.")
-                return False
-
-            # getting UUID file
-            try:
-                new_uuid = UUID(bytes=zip_file.read(FILE_UUID))
-            except ValueError as e:
-                self.logger.log(logging.ERROR, e)
-                return False
-        
-            # checking if UUID already loaded
-            if str(new_uuid) in self.stories:
-                self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded !")
-                return False
+    
+        # checking if UUID already loaded
+        self.archive_uuid = new_uuid
+        if str(new_uuid) in self.stories:
+            self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded !")
+            return False
 
-            # decompressing story contents
-            short_uuid = str(new_uuid).upper()[28:]
-            output_path = Path(self.mount_point).joinpath(f"{self.STORIES_BASEDIR}/{short_uuid}")
-            if not output_path.exists():
-                output_path.mkdir(parents=True)
+        # decompressing story contents
+        output_path = self.__begin_story(new_uuid)
 
-            # Loop over each file
+        # Loop over each file
+        story_files = [file for file in zip_contents if file != FILE_UUID and not file.endswith("bt")]
+        with ImportPipeline(archive.read, writer=self.writer) as pipe:
             # Manage the progress bar
-            pbar = tqdm(iterable=zip_contents, total=len(zip_contents), bar_format=TQDM_BAR_FORMAT)
-            for file in pbar:
+            pbar = tqdm(iterable=pipe.entries(story_files), total=len(story_files), bar_format=TQDM_BAR_FORMAT)
+            for file, data_v2 in pbar:
                 # abort requested ? early exit
                 if self.abort_process:
                     self.logger.log(logging.WARNING, f"Import aborted, performing cleanup on current story...")
-                    self.__clean_up_story_dir(new_uuid)
+                    pipe.abort()
+                    self.staging.rollback(new_uuid)
                     return False
 
-                if file == FILE_UUID or file.endswith("bt"):
-                    continue
-
                 pbar.set_description(f"Processing {file}")
 
-                # Extract each zip file
-                data_v2 = zip_file.read(file)
-
-                if file.endswith("ni") or file.endswith("nm"):
-                    data_plain = data_v2
-                else:
-                    data_plain = self.__v1v2_decipher(data_v2, lunii_generic_key, 0, 512)
-                # updating filename, and ciphering header if necessary
-                data = self.__get_ciphered_data(file, data_plain)
+                # updating filename, and transciphering header if necessary
+                data = self.__get_transciphered_chunks(file, data_v2)
                 file_newname = self.__get_ciphered_name(file)
 
-                target: Path = output_path.joinpath(file_newname)
-
-                # create target directory
-                if not target.parent.exists():
-                    target.parent.mkdir(parents=True)
                 # write target file
-                with open(target, "wb") as f_dst:
-                    f_dst.write(data)
+                pipe.write(output_path.joinpath(file_newname), data)
 
-                # in case of v2 device, we need to prepare bt file 
+                # in case of v2 device, we need to prepare bt file (from ciphered header chunk)
                 if self.device_version <= LUNII_V2 and file.endswith("ri"):
-                    self.bt = self.cipher(data[0:0x40], self.device_key)
+                    self.bt = self.cipher(data[0][0:0x40], self.device_key)
+        self.logger.log(logging.DEBUG, f"Import pipeline : {pipe.stats}")
 
         # creating authorization file : bt
         self.logger.log(logging.INFO, "Authorization file creation...")
         bt_path = output_path.joinpath("bt")
-        with open(bt_path, "wb") as fp_bt:
-            fp_bt.write(self.bt)
+        self.__write_bt(bt_path)
 
-        # updating .pi file to add new UUID
-        self.stories.append(Story(new_uuid))
-        self.update_pack_index()
+        # moving story in place, and updating .pi file to add new UUID
+        return self.__commit_story(new_uuid)
 
-        return True
+    def import_story_7z(self, archive: StoryArchive):
+        # reading all available files
+        archive_contents = archive.names
 
-    def import_story_7z(self, story_path):
-        # checking if archive is OK
-        try:
-            with py7zr.SevenZipFile(story_path, mode='r'):
-                pass  # If opening succeeds, the archive is valid
-        except py7zr.exceptions.Bad7zFile as e:
-            self.logger.log(logging.ERROR, e)
-            return False
-
-        # opening zip file
-        with py7zr.SevenZipFile(story_path, mode='r') as zip:
-            # reading all available files
-            archive_contents = zip.list()
-
-            # getting UUID from path
-            uuid_path = Path(archive_contents[0].filename)
-            uuid_str = uuid_path.parents[0].name if uuid_path.parents[0].name else uuid_path.name
-            if len(uuid_str) >= 16:  # long enough to be a UUID
-                try:
-                    if "-" not in uuid_str:
-                        new_uuid = UUID(bytes=binascii.unhexlify(uuid_str))
-                    else:
-                        new_uuid = UUID(uuid_str)
-                except ValueError as e:
-                    self.logger.log(logging.ERROR, f"UUID parse error {e}")
-                    return False
-            else:
-                self.logger.log(logging.ERROR, "UUID directory is missing in archive !")
+        # getting UUID from path
+        uuid_path = Path(archive_contents[0])
+        uuid_str = uuid_path.parents[0].name if uuid_path.parents[0].name else uuid_path.name
+        if len(uuid_str) >= 16:  # long enough to be a UUID
+            try:
+                if "-" not in uuid_str:
+                    new_uuid = UUID(bytes=binascii.unhexlify(uuid_str))
+                else:
+                    new_uuid = UUID(uuid_str)
+            except ValueError as e:
+                self.logger.log(logging.ERROR, f"UUID parse error {e}")
                 return False
+        else:
+            self.logger.log(logging.ERROR, "UUID directory is missing in archive !")
+            return False
 
-            # checking if UUID already loaded
-            if str(new_uuid) in self.stories:
-                self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded !")
-                return False
-            
-            # decompressing story contents
-            output_path = Path(self.mount_point).joinpath(self.STORIES_BASEDIR)
-            # {str(new_uuid).upper()[28:]
-            if not output_path.exists():
-                output_path.mkdir(parents=True)
-
-            # Loop over each file
-            short_uuid = str(new_uuid).upper()[28:]
-            contents = zip.readall().items()
-            pbar = tqdm(iterable=contents, total=len(contents), bar_format=TQDM_BAR_FORMAT)
-            for fname, bio in pbar:
+        # checking if UUID already loaded
+        self.archive_uuid = new_uuid
+        if str(new_uuid) in self.stories:
+            self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded !")
+            return False
+        
+        # decompressing story contents
+        # archive paths include story directory
+        output_path = self.__begin_story(new_uuid).parent
+
+        # Loop over each file, decompressed one by one
+        stream = archive.stream([file for file in archive.files if not file.endswith("bt")])
+        with ImportPipeline(writer=self.writer) as pipe:
+            # Manage the progress bar (decompressed bytes)
+            pbar = tqdm(total=stream.total_size, unit="B", unit_scale=True, unit_divisor=1024, bar_format=TQDM_BAR_FORMAT)
+            for fname, data_v2 in stream:
                 pbar.set_description(f"Processing {fname}")
+                pbar.update(len(data_v2))
                 # abort requested ? early exit
                 if self.abort_process:
                     self.logger.log(logging.WARNING, f"Import aborted, performing cleanup on current story...")
-                    self.__clean_up_story_dir(new_uuid)
+                    pipe.abort()
+                    self.staging.rollback(new_uuid)
                     return False
 
-                if fname.endswith("bt"):
-                    continue
-
-                # Extract each zip file
-                data_v2 = bio.read()
-
                 # stripping extra uuid chars
                 if "-" not in fname:
                     file = fname[24:]
@@ -948,102 +1111,75 @@ class LuniiDevice:
 
                 if self.device_version <= LUNII_V2:
                     # from v2 to v2, data can be kept as it is
-                    data = data_v2
+                    data = [data_v2]
                 else:
                     # need to transcipher for v3
-                    if file.endswith("ni") or file.endswith("nm"):
-                        data_plain = data_v2
-                    else:
-                        data_plain = self.__v1v2_decipher(data_v2, lunii_generic_key, 0, 512)
-                    # updating filename, and ciphering header if necessary
-                    data = self.__get_ciphered_data(file, data_plain)
-
-                file_newname = self.__get_ciphered_name(file)
-                target: Path = output_path.joinpath(file_newname)
+                    # updating filename, and transciphering header if necessary
+                    data = self.__get_transciphered_chunks(file, data_v2)
 
-                # create target directory
-                if not target.parent.exists():
-                    target.parent.mkdir(parents=True)
                 # write target file
-                with open(target, "wb") as f_dst:
-                    f_dst.write(data)
+                file_newname = self.__get_ciphered_name(file)
+                pipe.write(output_path.joinpath(file_newname), data)
 
-                # in case of v2 device, we need to prepare bt file 
+                # in case of v2 device, we need to prepare bt file (from ciphered header chunk)
                 if self.device_version <= LUNII_V2 and file.endswith("ri"):
-                    self.bt = self.cipher(data[0:0x40], self.device_key)
+                    self.bt = self.cipher(data[0][0:0x40], self.device_key)
+            pbar.close()
+        self.logger.log(logging.DEBUG, f"Import pipeline : {pipe.stats}")
 
         # creating authorization file : bt
         self.logger.log(logging.INFO, "Authorization file creation...")
         bt_path = output_path.joinpath(str(new_uuid).upper()[28:]+"/bt")
-        with open(bt_path, "wb") as fp_bt:
-            fp_bt.write(self.bt)
+        self.__write_bt(bt_path)
 
-        # updating .pi file to add new UUID
-        self.stories.append(Story(new_uuid))
-        self.update_pack_index()
+        # moving story in place, and updating .pi file to add new UUID
+        return self.__commit_story(new_uuid)
 
-        return True
+    def import_story_v2(self, archive: StoryArchive):
+        # reading all available files
+        zip_contents = archive.names
 
-    def import_story_v2(self, story_path):
-        # checking if archive is OK
-        try:
-            with zipfile.ZipFile(file=story_path):
-                pass  # If opening succeeds, the archive is valid
-        except zipfile.BadZipFile as e:
-            self.logger.log(logging.ERROR, e)
-            return False
-        
-        # opening zip file
-        with zipfile.ZipFile(file=story_path) as zip_file:
-            # reading all available files
-            zip_contents = zip_file.namelist()
-
-            # getting UUID from path
-            uuid_path = Path(zip_contents[0])
-            uuid_str = uuid_path.parents[0].name if uuid_path.parents[0].name else uuid_path.name
-            if len(uuid_str) >= 16:  # long enough to be a UUID
-                # self.signal_logger.emit(logging.DEBUG, uuid_str)
-                try:
-                    if "-" not in uuid_str:
-                        new_uuid = UUID(bytes=binascii.unhexlify(uuid_str))
-                    else:
-                        new_uuid = UUID(uuid_str)
-                except ValueError as e:
-                    self.logger.log(logging.ERROR, f"UUID parse error {e}")
-                    return False
-            else:
-                self.logger.log(logging.ERROR, "UUID directory is missing in archive !")
+        # getting UUID from path
+        uuid_path = Path(zip_contents[0])
+        uuid_str = uuid_path.parents[0].name if uuid_path.parents[0].name else uuid_path.name
+        if len(uuid_str) >= 16:  # long enough to be a UUID
+            # self.signal_logger.emit(logging.DEBUG, uuid_str)
+            try:
+                if "-" not in uuid_str:
+                    new_uuid = UUID(bytes=binascii.unhexlify(uuid_str))
+                else:
+                    new_uuid = UUID(uuid_str)
+            except ValueError as e:
+                self.logger.log(logging.ERROR, f"UUID parse error {e}")
                 return False
+        else:
+            self.logger.log(logging.ERROR, "UUID directory is missing in archive !")
+            return False
 
-            # checking if UUID already loaded
-            if str(new_uuid) in self.stories:
-                self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded !")
-                return False
+        # checking if UUID already loaded
+        self.archive_uuid = new_uuid
+        if str(new_uuid) in self.stories:
+            self.logger.log(logging.WARNING, f"'{self.stories.get_story(new_uuid).name}' is already loaded !")
+            return False
 
-            # decompressing story contents
-            output_path = Path(self.mount_point).joinpath(self.STORIES_BASEDIR)
-            # {str(new_uuid).upper()[28:]
-            if not output_path.exists():
-                output_path.mkdir(parents=True)
+        # decompressing story contents
+        # archive paths include story directory
+        output_path = self.__begin_story(new_uuid).parent
 
-            # Loop over each file
-            short_uuid = str(new_uuid).upper()[28:]
-            pbar = tqdm(iterable=zip_contents, total=len(zip_contents), bar_format=TQDM_BAR_FORMAT)
-            for file in pbar:
+        # Loop over each file
+        story_files = [file for file in archive.files if not file.endswith("bt")]
+        with ImportPipeline(archive.read, writer=self.writer) as pipe:
+            # Manage the progress bar
+            pbar = tqdm(iterable=pipe.entries(story_files), total=len(story_files), bar_format=TQDM_BAR_FORMAT)
+            for file, data_v2 in pbar:
                 # abort requested ? early exit
                 if self.abort_process:
                     self.logger.log(logging.WARNING, f"Import aborted, performing cleanup on current story...")
-                    self.__clean_up_story_dir(new_uuid)
+                    pipe.abort()
+                    self.staging.rollback(new_uuid)
                     return False
 
                 pbar.set_description(f"Processing {file}")
-                if zip_file.getinfo(file).is_dir():
-                    continue
-                if file.endswith("bt"):
-                    continue
-
-                # Extract each zip file
-                data_v2 = zip_file.read(file)
 
                 # stripping extra uuid chars
                 if "-" not in file:
@@ -1053,154 +1189,70 @@ class LuniiDevice:
 
                 if self.device_version <= LUNII_V2:
                     # from v2 to v2, data can be kept as it is
-                    data = data_v2
+                    data = [data_v2]
                 else:
                     # need to transcipher for v3
-                    if file.endswith("ni") or file.endswith("nm"):
-                        data_plain = data_v2
-                    else:
-                        data_plain = self.__v1v2_decipher(data_v2, lunii_generic_key, 0, 512)
-                    # updating filename, and ciphering header if necessary
-                    data = self.__get_ciphered_data(file, data_plain)
+                    # updating filename, and transciphering header if necessary
+                    data = self.__get_transciphered_chunks(file, data_v2)
 
                 file_newname = self.__get_ciphered_name(file)
-                target: Path = output_path.joinpath(file_newname)
 
-                # create target directory
-                if not target.parent.exists():
-                    target.parent.mkdir(parents=True)
                 # write target file
-                with open(target, "wb") as f_dst:
-                    f_dst.write(data)
+                pipe.write(output_path.joinpath(file_newname), data)
 
-                # in case of v2 device, we need to prepare bt file 
+                # in case of v2 device, we need to prepare bt file (from ciphered header chunk)
                 if self.device_version <= LUNII_V2 and file.endswith("ri"):
-                    self.bt = self.cipher(data[0:0x40], self.device_key)
+                    self.bt = self.cipher(data[0][0:0x40], self.device_key)
+        self.logger.log(logging.DEBUG, f"Import pipeline : {pipe.stats}")
 
         # creating authorization file : bt
         self.logger.log(logging.INFO, "Authorization file creation...")
         bt_path = output_path.joinpath(str(new_uuid).upper()[28:]+"/bt")
-        with open(bt_path, "wb") as fp_bt:
-            fp_bt.write(self.bt)
+        self.__write_bt(bt_path)
 
-        # updating .pi file to add new UUID
-        self.stories.append(Story(new_uuid))
-        self.update_pack_index()
-
-        return True
+        # moving story in place, and updating .pi file to add new UUID
+        return self.__commit_story(new_uuid)
 
-    def import_story_v3(self, story_path):
+    def import_story_v3(self, archive: StoryArchive):
         self.logger.log(logging.ERROR, "unsupported story format")
         return False
 
-    def import_story_studio_zip(self, story_path):
-        # checking if archive is OK
+    def import_story_studio_zip(self, archive: StoryArchive):
+        # reading all available files
+        zip_contents = archive.names
+        if FILE_UUID in zip_contents:
+            self.logger.log(logging.ERROR, "plain.pk format detected ! Unable to add this story.")
+            return False
+        if FILE_STUDIO_JSON not in zip_contents:
+            self.logger.log(logging.ERROR, "missing 'story.json'. Unable to add this story.")
+            return False
+
+        # getting UUID file
         try:
-            with zipfile.ZipFile(file=story_path):
-                pass  # If opening succeeds, the archive is valid
-        except zipfile.BadZipFile as e:
+            story_json = json.loads(archive.read(FILE_STUDIO_JSON))
+        except ValueError as e:
             self.logger.log(logging.ERROR, e)
             return False
-        
-        # opening zip file
-        with zipfile.ZipFile(file=story_path) as zip_file:
-            # reading all available files
-            zip_contents = zip_file.namelist()
-            if FILE_UUID in zip_contents:
-                self.logger.log(logging.ERROR, "plain.pk format detected ! Unable to add this story.")
-                return False
-            if FILE_STUDIO_JSON not in zip_contents:
-                self.logger.log(logging.ERROR, "missing 'story.json'. Unable to add this story.")
-                return False
-
-            # getting UUID file
-            try:
-                story_json = json.loads(zip_file.read(FILE_STUDIO_JSON))
-            except ValueError as e:
-                self.logger.log(logging.ERROR, e)
-                return False
-
-            one_story = StudioStory(story_json)
-            if not one_story.compatible:
-                self.logger.log(logging.ERROR, "STUdio story with non MP3 audio file. You need FFMPEG tool to import such kind of story, refer to README.md")
-                return False
 
-            stories.thirdparty_db_add_story(one_story.uuid, one_story.title, one_story.description)
-
-            # checking if UUID already loaded
-            if str(one_story.uuid) in self.stories:
-                self.logger.log(logging.WARNING, f"'{one_story.name}' is already loaded !")
-                return False
-
-            # decompressing story contents
-            short_uuid = one_story.short_uuid
-            output_path = Path(self.mount_point).joinpath(f"{self.STORIES_BASEDIR}{short_uuid}")
-            if not output_path.exists():
-                output_path.mkdir(parents=True)
-
-            # Loop over each file
-            pbar = tqdm(iterable=zip_contents, total=len(zip_contents), bar_format=TQDM_BAR_FORMAT)
-            for file in pbar:
-                # abort requested ? early exit
-                if self.abort_process:
-                    self.logger.log(logging.WARNING, f"Import aborted, performing cleanup on current story...")
-                    self.__clean_up_story_dir(one_story.uuid)
-                    return False
-                
-                pbar.set_description(f"Processing {file}")
-
-                if zip_file.getinfo(file).is_dir():
-                    continue
-                if file.endswith(FILE_STUDIO_JSON):
-                    continue
-                if file.endswith(FILE_STUDIO_THUMB):
-                    # adding thumb to DB
-                    data = zip_file.read(file)
-                    stories.thirdparty_db_add_thumb(one_story.uuid, data)
-                    continue
-                if not file.startswith("assets"):
-                    continue
+        one_story = StudioStory(story_json)
+        if not one_story.compatible:
+            self.logger.log(logging.ERROR, "STUdio story with non MP3 audio file. You need FFMPEG tool to import such kind of story, refer to README.md")
+            return False
 
-                # Extract each zip file
-                data = zip_file.read(file)
-
-                # stripping extra "assets/" chars
-                file = file[7:]
-                if file in one_story.ri:
-                    file_newname = self.__get_ciphered_name(one_story.ri[file][0], studio_ri=True)
-                    # transcode image if necessary
-                    data = image_to_bitmap_rle4(data)
-                elif file in one_story.si:
-                    file_newname = self.__get_ciphered_name(one_story.si[file][0], studio_si=True)
-                    # transcode audio if necessary
-                    if transcoding_required(file, data):
-                        if not STORY_TRANSCODING_SUPPORTED:
-                            self.logger.log(logging.ERROR, "STUdio story with non MP3 audio file. You need FFMPEG tool to import such kind of story, refer to README.md")
-                            return False
-
-                        self.logger.log(logging.WARN, f"⌛ Transcoding audio {file_newname} : {len(data)//1024:4} KB ...")
-                        # len_before = len(data)//1024
-                        data = audio_to_mp3(data)
-                        # print(f"Transcoded from {len_before:4}KB to {len(data)//1024:4}KB")
-                    # removing tags if necessary
-                    if tags_removal_required(data):
-                        self.logger.log(logging.WARN, f"⌛ Removing tags from audio {file_newname}")
-                        data = mp3_tag_cleanup(data)
+        stories.thirdparty_db_add_story(one_story.uuid, one_story.title, one_story.description)
 
-                else:
-                    # unexpected file, skipping
-                    continue
+        # checking if UUID already loaded
+        self.archive_uuid = one_story.uuid
+        if str(one_story.uuid) in self.stories:
+            self.logger.log(logging.WARNING, f"'{one_story.name}' is already loaded !")
+            return False
 
-                # updating filename, and ciphering header if necessary
-                data_ciphered = self.__get_ciphered_data(file, data)
-                target: Path = output_path.joinpath(file_newname)
+        # decompressing story contents
+        output_path = self.__begin_story(one_story.uuid)
 
-                # create target directory
-                if not target.parent.exists():
-                    target.parent.mkdir(parents=True)
-                # write target file
-                with open(target, "wb") as f_dst:
-                    f_dst.write(data_ciphered)
+        # Loop over each asset
+        if not self.__import_studio_assets(one_story, output_path, archive.entries()):
+            return False
 
         # creating lunii index files : ri
         ri_data = one_story.get_ri_data()
@@ -1213,120 +1265,53 @@ class LuniiDevice:
         # creating lunii index files : si, ni, li
         self.__write(one_story.get_si_data(), output_path, "si")
         self.__write(one_story.get_li_data(), output_path, "li")
-        self.__write(one_story.get_ni_data(), output_path, "ni")
+        # ni is never ciphered, streamed to device
+        self.writer.write(output_path.joinpath("ni"), one_story.write_ni)
 
         # creating authorization file : bt
         self.logger.log(logging.INFO, "Authorization file creation...")
         bt_path = output_path.joinpath("bt")
-        with open(bt_path, "wb") as fp_bt:
-            fp_bt.write(self.bt)
-
-        # # updating .pi file to add new UUID
-        self.stories.append(Story(one_story.uuid))
-        self.update_pack_index()
+        self.__write_bt(bt_path)
 
-        return True
+        # moving story in place, and updating .pi file to add new UUID
+        return self.__commit_story(one_story.uuid)
 
-    def import_story_studio_7z(self, story_path):
-        # checking if archive is OK
+    def import_story_studio_7z(self, archive: StoryArchive):
+        # reading all available files
+        zip_contents = archive.names
+        if FILE_UUID in zip_contents:
+            self.logger.log(logging.ERROR, "plain.pk format detected ! Unable to add this story.")
+            return False
+        if FILE_STUDIO_JSON not in zip_contents:
+            self.logger.log(logging.ERROR, "missing 'story.json'. Unable to add this story.")
+            return False
+  
+        # getting UUID file
         try:
-            with py7zr.SevenZipFile(story_path, mode='r'):
-                pass  # If opening succeeds, the archive is valid
-        except py7zr.exceptions.Bad7zFile as e:
+            story_json = json.loads(archive.read(FILE_STUDIO_JSON))
+        except ValueError as e:
             self.logger.log(logging.ERROR, e)
             return False
 
-        # opening zip file
-        with py7zr.SevenZipFile(story_path, mode='r') as zip:
-            # reading all available files
-            zip_contents = zip.readall()
-            if FILE_UUID in zip_contents:
-                self.logger.log(logging.ERROR, "plain.pk format detected ! Unable to add this story.")
-                return False
-            if FILE_STUDIO_JSON not in zip_contents:
-                self.logger.log(logging.ERROR, "missing 'story.json'. Unable to add this story.")
-                return False
-  
-            # getting UUID file
-            try:
-                story_json = json.loads(zip_contents[FILE_STUDIO_JSON].read())
-            except ValueError as e:
-                self.logger.log(logging.ERROR, e)
-                return False
-
-            one_story = StudioStory(story_json)
-            if not one_story.compatible:
-                self.logger.log(logging.ERROR, "STUdio story with non MP3 audio file. You need FFMPEG tool to import such kind of story, refer to README.md")
-                return False
-
-            stories.thirdparty_db_add_story(one_story.uuid, one_story.title, one_story.description)
-
-            # checking if UUID already loaded
-            if str(one_story.uuid) in self.stories:
-                self.logger.log(logging.WARNING, f"'{one_story.name}' is already loaded !")
-                return False
-
-            # decompressing story contents
-            short_uuid = one_story.short_uuid
-            output_path = Path(self.mount_point).joinpath(f"{self.STORIES_BASEDIR}{short_uuid}")
-            if not output_path.exists():
-                output_path.mkdir(parents=True)
-
-            # Loop over each file
-            contents = zip_contents.items()
-            pbar = tqdm(iterable=contents, total=len(contents), bar_format=TQDM_BAR_FORMAT)
-            for fname, bio in pbar:
-                # abort requested ? early exit
-                if self.abort_process:
-                    self.logger.log(logging.WARNING, f"Import aborted, performing cleanup on current story...")
-                    self.__clean_up_story_dir(one_story.uuid)
-                    return False
-                
-                pbar.set_description(f"Processing {fname}")
+        one_story = StudioStory(story_json)
+        if not one_story.compatible:
+            self.logger.log(logging.ERROR, "STUdio story with non MP3 audio file. You need FFMPEG tool to import such kind of story, refer to README.md")
+            return False
 
-                if fname.endswith(FILE_STUDIO_JSON):
-                    continue
-                if fname.endswith(FILE_STUDIO_THUMB):
-                    # adding thumb to DB
-                    data = bio.read()
-                    stories.thirdparty_db_add_thumb(one_story.uuid, data)
-                    continue
-                if not fname.startswith("assets"):
-                    continue
+        stories.thirdparty_db_add_story(one_story.uuid, one_story.title, one_story.description)
 
-                # Extract each zip file
-                data = bio.read()
-
-                # stripping extra "assets/" chars
-                fname = fname[7:]
-                if fname in one_story.ri:
-                    file_newname = self.__get_ciphered_name(one_story.ri[fname][0], studio_ri=True)
-                    # transcode image if necessary
-                    data = image_to_bitmap_rle4(data)
-                elif fname in one_story.si:
-                    file_newname = self.__get_ciphered_name(one_story.si[fname][0], studio_si=True)
-                    # transcode audio if necessary
-                    if transcoding_required(fname, data):
-                        if not STORY_TRANSCODING_SUPPORTED:
-                            self.logger.log(logging.ERROR, "STUdio story with non MP3 audio file. You need FFMPEG tool to import such kind of story, refer to README.md")
-                            return False
-
-                        self.logger.log(logging.WARN, f"⌛ Transcoding audio {file_newname} : {len(data)//1024:4} KB ...")
-                        data = audio_to_mp3(data)
-                else:
-                    # unexpected file, skipping
-                    continue
+        # checking if UUID already loaded
+        self.archive_uuid = one_story.uuid
+        if str(one_story.uuid) in self.stories:
+            self.logger.log(logging.WARNING, f"'{one_story.name}' is already loaded !")
+            return False
 
-                # updating filename, and ciphering header if necessary
-                data_ciphered = self.__get_ciphered_data(fname, data)
-                target: Path = output_path.joinpath(file_newname)
+        # decompressing story contents
+        output_path = self.__begin_story(one_story.uuid)
 
-                # create target directory
-                if not target.parent.exists():
-                    target.parent.mkdir(parents=True)
-                # write target file
-                with open(target, "wb") as f_dst:
-                    f_dst.write(data_ciphered)
+        # Loop over each asset, decompressed one by one
+        if not self.__import_studio_assets(one_story, output_path, archive.entries(), cleanup_tags=False):
+            return False
 
         # creating lunii index files : ri
         ri_data = one_story.get_ri_data()
@@ -1339,26 +1324,88 @@ class LuniiDevice:
         # creating lunii index files : si, ni, li
         self.__write(one_story.get_si_data(), output_path, "si")
         self.__write(one_story.get_li_data(), output_path, "li")
-        self.__write(one_story.get_ni_data(), output_path, "ni")
+        # ni is never ciphered, streamed to device
+        self.writer.write(output_path.joinpath("ni"), one_story.write_ni)
 
         # creating authorization file : bt
         self.logger.log(logging.INFO, "Authorization file creation...")
         bt_path = output_path.joinpath("bt")
-        with open(bt_path, "wb") as fp_bt:
-            fp_bt.write(self.bt)
+        self.__write_bt(bt_path)
 
-        # # updating .pi file to add new UUID
-        self.stories.append(Story(one_story.uuid))
-        self.update_pack_index()
+        # moving story in place, and updating .pi file to add new UUID
+        return self.__commit_story(one_story.uuid)
+
+    def __studio_asset_jobs(self, one_story, entries):
+        for fname, read_entry in entries:
+            if fname.endswith(FILE_STUDIO_JSON):
+                continue
+            if fname.endswith(FILE_STUDIO_THUMB):
+                # adding thumb to DB
+                stories.thirdparty_db_add_thumb(one_story.uuid, read_entry())
+                continue
+            if not fname.startswith("assets"):
+                continue
+
+            # stripping extra "assets/" chars
+            file = fname[7:]
+            if file in one_story.ri:
+                file_newname = self.__get_ciphered_name(one_story.ri[file][0], studio_ri=True)
+                kind = ASSET_IMAGE
+            elif file in one_story.si:
+                file_newname = self.__get_ciphered_name(one_story.si[file][0], studio_si=True)
+                kind = ASSET_AUDIO
+            else:
+                # unexpected file, skipping
+                continue
+
+            # Extract each file (only when the transcoding stage is ready to take it)
+            yield (file, file_newname), kind, file, read_entry()
+
+    def __import_studio_assets(self, one_story, output_path, entries, cleanup_tags=True):
+        # assets are transcoded by a pool of processes, then ciphered and written from here
+        jobs = self.__studio_asset_jobs(one_story, entries)
+        results = transcode_assets(jobs, self.transcoding_workers, cleanup_tags)
+
+        # Manage the progress bar
+        total = len(one_story.ri) + len(one_story.si)
+        pbar = tqdm(iterable=results, total=total, bar_format=TQDM_BAR_FORMAT)
+        try:
+            for (file, file_newname), asset in pbar:
+                # abort requested ? early exit
+                if self.abort_process:
+                    self.logger.log(logging.WARNING, f"Import aborted, performing cleanup on current story...")
+                    results.close()
+                    self.writer.discard()
+                    self.staging.rollback(one_story.uuid)
+                    return False
+
+                pbar.set_description(f"Processing {file}")
+
+                if asset.unsupported:
+                    self.logger.log(logging.ERROR, "STUdio story with non MP3 audio file. You need FFMPEG tool to import such kind of story, refer to README.md")
+                    results.close()
+                    return False
+                if asset.transcoded:
+                    self.logger.log(logging.WARN, f"⌛ Transcoded audio {file_newname} : {asset.source_size//1024:4} KB")
+                if asset.tags_removed:
+                    self.logger.log(logging.WARN, f"⌛ Removed tags from audio {file_newname}")
+
+                # updating filename, and ciphering header if necessary
+                data_ciphered = self.__get_ciphered_chunks(file, asset.data)
+                target: Path = output_path.joinpath(file_newname)
+
+                # write target file
+                self.writer.write(target, data_ciphered)
+        finally:
+            pbar.close()
 
+        self.logger.log(logging.INFO, TRANSCODE_CACHE)
         return True
 
     def __write(self, data_plain, output_path, file):
         path_file = os.path.join(output_path, file)
-        with open(path_file, "wb") as fp:
-            data = self.__get_ciphered_data(path_file, data_plain)
-            # data =  data_plain
-            fp.write(data)
+        data = self.__get_ciphered_chunks(path_file, data_plain)
+        self.writer.write(path_file, list(data))
 
     def __story_check_v3key(self, story_path: Path, key, iv):
         # Trying to decipher RI/SI for path check
@@ -1404,7 +1451,9 @@ class LuniiDevice:
                 self.logger.log(logging.ERROR, f"[{st.str_uuid} - {st.name}]")
             return None
 
-        one_story = slist[0]
+        return self.__export_zip(self.__export_job(slist[0], out_path), progress=True)
+
+    def __export_job(self, one_story: Story, out_path):
         uuid = one_story.str_uuid[28:]
 
         # checking that .content dir exist
@@ -1443,23 +1492,53 @@ class LuniiDevice:
                     continue
                 story_flist.append(os.path.join(root, filename))
 
+        # story keys are captured, device ones may change before the job is processed
+        job = ExportJob(one_story, story_path, zip_path, story_flist, story_keys=(self.story_key, self.story_iv))
+
+        # incremental mode, checking device files against last export
+        if self.export_incremental:
+            job.manifest = ExportManifest.scan(story_path, story_flist, self.__export_settings(one_story))
+            if job.manifest.unchanged(zip_path):
+                self.logger.log(logging.INFO, "✅ Unchanged since last export, skipping")
+                job.unchanged = True
+        return job
+
+    def __export_settings(self, one_story: Story):
+        settings = {"compression": self.export_compression}
+
+        # thirdparty stories archives also hold their metadata
+        if not one_story.is_official():
+            meta = one_story.get_meta()
+            settings["meta"] = hashlib.sha1(meta.encode("utf-8")).hexdigest() if meta else ""
+        return settings
+
+    def __export_zip(self, job, gate=None, progress=False):
+        if not job:
+            return None
+        if job.unchanged:
+            return job.zip_path
+
+        one_story = job.story
+        uuid = one_story.str_uuid[28:]
+        # archive is rewritten, previous manifest no longer applies
+        if job.manifest:
+            ExportManifest.discard(job.zip_path)
         try:
-            with zipfile.ZipFile(zip_path, 'w') as zip_out:
+            with zipfile.ZipFile(job.zip_path, 'w', compression=ARCHIVE_COMPRESSION[self.export_compression]) as zip_out:
                 self.logger.log(logging.DEBUG, "> Zipping story ...")
-                pbar = tqdm(iterable=story_flist, total=len(story_flist), bar_format=TQDM_BAR_FORMAT)
+                pbar = tqdm(iterable=job.files, total=len(job.files), bar_format=TQDM_BAR_FORMAT, disable=not progress)
                 for file in pbar:
                     # abort requested ? early exit
                     if self.abort_process:
                         return None
                     
-                    target_name = Path(file).relative_to(story_path)
+                    target_name = Path(file).relative_to(job.story_path)
                     pbar.set_description(f"Processing {target_name}")
 
                     # Extract each file to another directory
                     # decipher if necessary (mp3 / bmp / li / ri / si)
-                    data_plain = self.__get_plain_data(file)
                     file_newname = self.__get_plain_name(file, uuid)
-                    zip_out.writestr(file_newname, data_plain)
+                    self.__export_file(zip_out, file, file_newname, job.story_keys, gate)
 
                 # adding uuid file
                 self.logger.log(logging.DEBUG, "> Adding UUID ...")
@@ -1470,7 +1549,7 @@ class LuniiDevice:
                     self.logger.log(logging.DEBUG, "> Adding thumbnail ...")
                     pict_data = one_story.get_picture()
                     if pict_data:
-                        zip_out.writestr(FILE_THUMB, pict_data)
+                        zip_out.writestr(FILE_THUMB, pict_data, entry_compression(FILE_THUMB, zip_out.compression))
 
                     self.logger.log(logging.DEBUG, "> Adding metadata ...")
                     meta = one_story.get_meta()
@@ -1480,8 +1559,13 @@ class LuniiDevice:
         except PermissionError as e:
             self.logger.log(logging.ERROR, f"failed to create ZIP - {e}")
             return None
-        
-        return zip_path
+
+        if job.manifest:
+            job.manifest.save(job.zip_path)
+
+        if progress:
+            self.logger.log(logging.DEBUG, self.story_keys)
+        return job.zip_path
 
     def __clean_up_story_dir(self, story_uuid: UUID):
         story_dir = Path(self.mount_point).joinpath(f"{self.STORIES_BASEDIR}{story_uuid.hex.upper()[-8:]}")
@@ -0,0 +1,173 @@
+import ctypes
+import os
+import threading
+import time
+from pathlib import Path
+
+from pkg.api.constants import WRITE_BLOCK_SIZE, WRITE_COALESCE_SIZE, WRITE_PREALLOCATE
+
+# syncfs() flushes the device filesystem only (Linux), where os.sync() flushes all of them
+try:
+    _syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+except (OSError, AttributeError, TypeError):
+    _syncfs = None
+
+
+class WriterStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.writes = 0
+        self.dirs = 0
+        self.write_time = 0.0
+        self.syncs = 0
+        self.sync_time = 0.0
+
+    def __repr__(self):
+        rate = self.bytes / 1024 / 1024 / (self.write_time + self.sync_time) if self.write_time + self.sync_time else 0
+        return (f"{self.files} files, {self.bytes//1024} KB in {self.writes} writes, {self.dirs} dirs created - "
+                f"write {self.write_time:.2f}s, sync {self.sync_time:.2f}s ({self.syncs}) - {rate:.1f} MB/s")
+
+
+# Writes story files on device. On FAT over USB mass storage, metadata operations
+# and small unaligned writes cost more than data itself :
+#  - created directories are remembered, no exists() / mkdir() per file
+#  - files are gathered up to coalesce_size, then written grouped by directory
+#  - each file is written by blocks aligned on file offsets (optionally preallocated)
+#  - sync() flushes written files to device once, instead of implicit flushes
+#
+#   writer.write(target, [header, payload])
+#   writer.write(target, story.write_ni)
+#   ...
+#   writer.flush()
+#   writer.sync()
+#
+# discard() drops pending files and forgets directories (removed or renamed story).
+class DeviceWriter:
+    def __init__(self, block_size=WRITE_BLOCK_SIZE, coalesce_size=WRITE_COALESCE_SIZE, preallocate=WRITE_PREALLOCATE):
+        self.block_size = block_size
+        self.coalesce_size = coalesce_size
+        self.preallocate = preallocate and hasattr(os, "posix_fallocate")
+        self.stats = WriterStats()
+
+        self.__dirs = set()
+        self.__pending = []
+        self.__pending_size = 0
+        self.__written = []
+        self.__lock = threading.RLock()
+
+    # data is a bytes-like object, a list of them written one after the other,
+    # or a function writing the file into the file object it is given
+    def write(self, target, data):
+        chunks = data if isinstance(data, list) or callable(data) else [data]
+        with self.__lock:
+            self.__pending.append((Path(target), chunks))
+            if not callable(chunks):
+                self.__pending_size += sum(len(chunk) for chunk in chunks)
+            if self.__pending_size >= self.coalesce_size:
+                self.flush()
+
+    def flush(self):
+        with self.__lock:
+            pending = self.__pending
+            self.__pending = []
+            self.__pending_size = 0
+
+            # grouped by directory (stable, archive order kept within a directory)
+            pending.sort(key=lambda item: str(item[0].parent))
+            for target, chunks in pending:
+                self.__write_file(target, chunks)
+
+    def sync(self):
+        with self.__lock:
+            # files of a discarded story may have been removed since
+            written = [path for path in self.__written if path.exists()]
+            self.__written = []
+            if not written:
+                return
+
+            start = time.perf_counter()
+            if _syncfs:
+                fd = os.open(written[0].parent, os.O_RDONLY)
+                try:
+                    if _syncfs(fd):
+                        raise OSError(ctypes.get_errno(), "syncfs failed", str(written[0].parent))
+                finally:
+                    os.close(fd)
+            else:
+                # no filesystem flush available, committing each file
+                for path in written:
+                    with open(path, "rb+") as fp:
+                        os.fsync(fp.fileno())
+            self.stats.sync_time += time.perf_counter() - start
+            self.stats.syncs += 1
+
+    def discard(self):
+        with self.__lock:
+            self.__pending = []
+            self.__pending_size = 0
+            self.__written = []
+            self.__dirs.clear()
+
+    def __write_file(self, target: Path, chunks):
+        start = time.perf_counter()
+        if target.parent not in self.__dirs:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            self.__dirs.add(target.parent)
+            self.stats.dirs += 1
+
+        if callable(chunks):
+            # size unknown beforehand, buffered by blocks
+            with open(target, "wb", buffering=self.block_size) as fp:
+                chunks(fp)
+                size = fp.tell()
+            self.stats.writes += -(-size // self.block_size)
+        else:
+            size = sum(len(chunk) for chunk in chunks)
+            self.__write_chunks(target, chunks, size)
+
+        self.__written.append(target)
+        self.stats.files += 1
+        self.stats.bytes += size
+        self.stats.write_time += time.perf_counter() - start
+
+    def __write_chunks(self, target, chunks, size):
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            if self.preallocate and size:
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError:
+                    # not supported by this filesystem
+                    self.preallocate = False
+
+            for block in self.__blocks(chunks):
+                view = memoryview(block)
+                while view:
+                    view = view[os.write(fd, view):]
+                    self.stats.writes += 1
+        finally:
+            os.close(fd)
+
+    # blocks of block_size, on file offsets multiple of block_size : small chunks are
+    # gathered, big ones are sliced without copy
+    def __blocks(self, chunks):
+        block = bytearray()
+        for chunk in chunks:
+            view = memoryview(chunk).cast("B")
+            if block:
+                needed = self.block_size - len(block)
+                block += view[:needed]
+                view = view[needed:]
+                if len(block) < self.block_size:
+                    continue
+                yield block
+                block = bytearray()
+
+            aligned = len(view) - len(view) % self.block_size
+            for offset in range(0, aligned, self.block_size):
+                yield view[offset:offset + self.block_size]
+            block += view[aligned:]
+
+        if block:
+            yield block
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from pkg.api.constants import LUNII_HEADER_SIZE
+
+MANIFEST_VERSION = 1
+EXT_MANIFEST = ".manifest.json"
+
+
+# Describes the device files an archive was exported from, saved next to the archive.
+# Each file is recorded with its size and mtime. As FAT mtime resolution is 2s, headers of
+# files at story root (index files) are also hashed, they are rewritten with any story update.
+class ExportManifest:
+    def __init__(self, files=None, settings=None, headers=""):
+        self.files = files or {}
+        self.settings = settings or {}
+        self.headers = headers
+        self.archive_size = 0
+
+    @staticmethod
+    def path(zip_path):
+        return f"{zip_path}{EXT_MANIFEST}"
+
+    @classmethod
+    def scan(cls, story_path, files, settings):
+        entries = {}
+        digest = hashlib.sha1()
+        for file in sorted(files):
+            stat = os.stat(file)
+            name = Path(file).relative_to(story_path).as_posix()
+            entries[name] = [stat.st_size, stat.st_mtime_ns]
+
+            if "/" not in name:
+                with open(file, "rb") as fp:
+                    digest.update(name.encode("utf-8"))
+                    digest.update(fp.read(LUNII_HEADER_SIZE))
+
+        return cls(entries, settings, digest.hexdigest())
+
+    @classmethod
+    def load(cls, zip_path):
+        try:
+            with open(cls.path(zip_path), "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("version") != MANIFEST_VERSION:
+                return None
+
+            manifest = cls(data["files"], data["settings"], data["headers"])
+            manifest.archive_size = data["archive_size"]
+            return manifest
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, zip_path):
+        self.archive_size = os.path.getsize(zip_path)
+        data = {"version": MANIFEST_VERSION,
+                "archive_size": self.archive_size,
+                "settings": self.settings,
+                "headers": self.headers,
+                "files": self.files}
+
+        # writing aside then renaming, an interrupted save leaves no manifest
+        manifest_path = self.path(zip_path)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(data, fp)
+        os.replace(tmp_path, manifest_path)
+
+    @classmethod
+    def discard(cls, zip_path):
+        try:
+            os.remove(cls.path(zip_path))
+        except OSError:
+            pass
+
+    def unchanged(self, zip_path):
+        # archive must still be the one produced from recorded files
+        previous = self.load(zip_path)
+        if not previous or not os.path.isfile(zip_path):
+            return False
+        if os.path.getsize(zip_path) != previous.archive_size:
+            return False
+
+        return (self.files == previous.files and
+                self.headers == previous.headers and
+                self.settings == previous.settings)
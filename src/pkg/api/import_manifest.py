@@ -0,0 +1,88 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from uuid import UUID
+
+from pkg.api.constants import FILE_IMPORT_MANIFEST
+
+IMPORT_MANIFEST_VERSION = 1
+# archive head and tail (zip central directory, 7z header) identify its contents
+FINGERPRINT_SIZE = 64 * 1024
+
+STATUS_IMPORTED = "imported"
+STATUS_LOADED = "loaded"
+STATUS_FAILED = "failed"
+
+
+def archive_fingerprint(archive_path, size):
+    digest = hashlib.sha1()
+    with open(archive_path, "rb") as fp:
+        digest.update(fp.read(FINGERPRINT_SIZE))
+        if size > FINGERPRINT_SIZE:
+            fp.seek(max(FINGERPRINT_SIZE, size - FINGERPRINT_SIZE))
+            digest.update(fp.read(FINGERPRINT_SIZE))
+    return digest.hexdigest()
+
+
+# Archives processed by import_dir, kept across runs : path, size, mtime, fingerprint,
+# story UUID and status. Rerunning an interrupted import, archives whose story is
+# already on device are skipped without being opened.
+class ImportManifest:
+    def __init__(self, manifest_path=FILE_IMPORT_MANIFEST):
+        self.manifest_path = manifest_path
+        self.entries = {}
+
+    def load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as fp:
+                data = json.load(fp)
+            if data.get("version") == IMPORT_MANIFEST_VERSION:
+                self.entries = data["archives"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            self.entries = {}
+        return self
+
+    def save(self):
+        Path(os.path.dirname(self.manifest_path)).mkdir(parents=True, exist_ok=True)
+        data = {"version": IMPORT_MANIFEST_VERSION, "archives": self.entries}
+
+        # saved aside then renamed to never leave a truncated file
+        manifest_tmp = self.manifest_path + ".tmp"
+        with open(manifest_tmp, "w", encoding="utf-8") as fp:
+            json.dump(data, fp)
+        os.replace(manifest_tmp, self.manifest_path)
+
+    # story UUID of an archive, if unchanged since it was recorded
+    def story_uuid(self, archive_path):
+        entry = self.entries.get(os.path.abspath(archive_path))
+        if not entry or not entry.get("uuid"):
+            return None
+
+        try:
+            stat = os.stat(archive_path)
+            if entry["size"] != stat.st_size:
+                return None
+            if entry["mtime_ns"] != stat.st_mtime_ns:
+                # touched or copied again, same contents ?
+                if entry["hash"] != archive_fingerprint(archive_path, stat.st_size):
+                    return None
+                entry["mtime_ns"] = stat.st_mtime_ns
+            return UUID(entry["uuid"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def record(self, archive_path, story_uuid, status):
+        try:
+            stat = os.stat(archive_path)
+            fingerprint = archive_fingerprint(archive_path, stat.st_size)
+        except OSError:
+            return
+
+        self.entries[os.path.abspath(archive_path)] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": fingerprint,
+            "uuid": str(story_uuid) if story_uuid else None,
+            "status": status,
+        }
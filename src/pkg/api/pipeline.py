@@ -0,0 +1,420 @@
+import queue
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from pkg.api.constants import PIPELINE_DEPTH, PREFETCH_CHUNK, EXPORT_DEVICE_READERS, \
+    EXPORT_COMPRESSION_STORE, EXPORT_COMPRESSION_DEFLATE, EXPORT_COMPRESSION_ARCHIVE
+from pkg.api.device_writer import DeviceWriter
+
+# end of stream marker
+_DONE = object()
+
+ARCHIVE_COMPRESSION = {
+    EXPORT_COMPRESSION_STORE: zipfile.ZIP_STORED,
+    EXPORT_COMPRESSION_DEFLATE: zipfile.ZIP_DEFLATED,
+    EXPORT_COMPRESSION_ARCHIVE: zipfile.ZIP_LZMA,
+}
+# already compressed payloads, compressing them again only costs time
+COMPRESSED_EXT = (".mp3", ".ogg", ".png", ".jpg", ".jpeg")
+
+
+def entry_compression(arcname, compression):
+    if arcname.lower().endswith(COMPRESSED_EXT):
+        return zipfile.ZIP_STORED
+    return compression
+
+
+class PipelineStats:
+    def __init__(self):
+        self.files = 0
+        self.read_bytes = 0
+        self.read_time = 0.0
+        self.write_bytes = 0
+        self.write_time = 0.0
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+
+    @staticmethod
+    def rate(size, duration):
+        return size / 1024 / 1024 / duration if duration else 0
+
+    def __repr__(self):
+        return (f"{self.files} files in {self.elapsed:.1f}s - "
+                f"read {self.read_bytes//1024} KB ({self.rate(self.read_bytes, self.read_time):.1f} MB/s), "
+                f"written {self.write_bytes//1024} KB ({self.rate(self.write_bytes, self.write_time):.1f} MB/s), "
+                f"overall {self.rate(self.write_bytes, self.elapsed):.1f} MB/s")
+
+
+# Three stages import : a reader thread inflates archive entries, the caller thread
+# transforms them (ciphering headers, renaming) and a writer thread stores them on device.
+# Stages are linked by bounded queues, so at most 2 x depth entries are held in memory.
+#
+#   with ImportPipeline(zip_file.read) as pipe:
+#       for name, data in pipe.entries(names):
+#           pipe.write(target, transform(data))
+#
+# Written data is a bytes-like object, or a list of them written one after the other.
+#
+# Leaving the block without exception waits for all writes, raising any writer error.
+# abort() (or an exception) drops pending entries, and returns once threads are stopped.
+# Without read_entry, only the writer stage is used (entries come from another source).
+# Files are stored through a DeviceWriter, flushed (not synced) when the block is left.
+class ImportPipeline:
+    def __init__(self, read_entry=None, depth=PIPELINE_DEPTH, writer=None):
+        self.read_entry = read_entry
+        self.writer = writer or DeviceWriter()
+        self.stats = PipelineStats()
+
+        self.__read_q = queue.Queue(maxsize=depth)
+        self.__write_q = queue.Queue(maxsize=depth)
+        self.__stop = threading.Event()
+        self.__error = None
+
+        self.__reader = None
+        self.__writer = threading.Thread(target=self.__write_loop, daemon=True)
+
+    def __enter__(self):
+        self.__writer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type or self.__stop.is_set():
+            self.abort()
+            # a failing stage is reported if caller did not raise its own error
+            if not exc_type:
+                self.__raise_error()
+            return False
+
+        # flushing remaining writes
+        self.__put(self.__write_q, _DONE)
+        self.__writer.join()
+        self.stats.elapsed = time.perf_counter() - self.stats.start
+        self.__raise_error()
+        return False
+
+    def __put(self, fifo, item):
+        # never blocking forever on a stopped stage
+        while not self.__stop.is_set():
+            try:
+                fifo.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __get(self, fifo):
+        while not self.__stop.is_set():
+            try:
+                return fifo.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def __fail(self, error):
+        if not self.__error:
+            self.__error = error
+        self.__stop.set()
+
+    def __raise_error(self):
+        if self.__error:
+            raise self.__error
+
+    def __read_loop(self, names):
+        try:
+            for name in names:
+                start = time.perf_counter()
+                data = self.read_entry(name)
+                self.stats.read_time += time.perf_counter() - start
+                self.stats.read_bytes += len(data)
+
+                if not self.__put(self.__read_q, (name, data)):
+                    return
+            self.__put(self.__read_q, _DONE)
+        except Exception as e:
+            self.__fail(e)
+
+    def __write_loop(self):
+        try:
+            while True:
+                item = self.__get(self.__write_q)
+                start = time.perf_counter()
+                if item is _DONE:
+                    self.writer.flush()
+                    self.stats.write_time += time.perf_counter() - start
+                    return
+                target, data = item
+
+                # data may be split in chunks, as header and payload
+                chunks = data if isinstance(data, list) else [data]
+                self.writer.write(target, chunks)
+                self.stats.write_time += time.perf_counter() - start
+                self.stats.write_bytes += sum(len(chunk) for chunk in chunks)
+                self.stats.files += 1
+        except Exception as e:
+            self.__fail(e)
+
+    def entries(self, names):
+        self.__reader = threading.Thread(target=self.__read_loop, args=(names,), daemon=True)
+        self.__reader.start()
+
+        while True:
+            item = self.__get(self.__read_q)
+            if item is _DONE:
+                break
+            yield item
+        self.__raise_error()
+
+    def write(self, target: Path, data):
+        if not self.__put(self.__write_q, (target, data)):
+            self.__raise_error()
+
+    def abort(self):
+        self.__stop.set()
+        for thread in [self.__reader, self.__writer]:
+            if thread and thread.is_alive():
+                thread.join()
+        self.writer.discard()
+        self.stats.elapsed = time.perf_counter() - self.stats.start
+
+
+class _StreamAborted(Exception):
+    pass
+
+
+# py7zr output target for one archive entry (path like interface expected by py7zr workers)
+class _SevenZipEntry:
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.name = name
+        self.chunks = []
+
+    @property
+    def parent(self):
+        return self
+
+    def mkdir(self, parents=None, exist_ok=False):
+        pass
+
+    def open(self, mode=None):
+        return self
+
+    def write(self, data):
+        self.chunks.append(data)
+        return len(data)
+
+    def seek(self, position):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # entry fully decompressed (and CRC checked), handing it over
+        if not exc_type:
+            self.stream.push(self.name, b"".join(self.chunks))
+            self.chunks = []
+        return False
+
+
+# Decompresses a 7z archive in a background thread, one entry at a time, in archive order.
+# Instead of readall(), at most depth entries are held in memory, whatever the archive size.
+# Decompression is the slow stage, a short lookahead is enough to keep consumers busy.
+#
+#   with py7zr.SevenZipFile(path, mode='r') as archive:
+#       stream = SevenZipStream(archive)
+#       for name, data in stream:
+#           ...
+#
+# names restricts extraction to some entries, directories are always skipped.
+# total_size is the uncompressed size of selected entries (for progress bars).
+class SevenZipStream:
+    def __init__(self, archive, names=None, depth=2):
+        self.archive = archive
+        self.files = [f for f in archive.files
+                      if not f.is_directory and (names is None or f.filename in names)]
+        self.total_size = sum(f.uncompressed or 0 for f in self.files)
+
+        self.__queue = queue.Queue(maxsize=depth)
+        self.__stop = threading.Event()
+        self.__error = None
+
+    def push(self, name, data):
+        while not self.__stop.is_set():
+            try:
+                self.__queue.put((name, data), timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        # consumer is gone, interrupting decompression
+        raise _StreamAborted()
+
+    def __extract(self):
+        try:
+            # archive may have been read before
+            self.archive.reset()
+            selected = {f.id for f in self.files}
+            for f in self.archive.files:
+                target = _SevenZipEntry(self, f.filename) if f.id in selected else None
+                self.archive.worker.register_filelike(f.id, target)
+            # sequential extraction to keep archive order and a single decompressor
+            self.archive.worker.extract(self.archive.fp, None, parallel=False)
+        except _StreamAborted:
+            pass
+        except Exception as e:
+            self.__error = e
+        finally:
+            self.__stop.set()
+
+    def __iter__(self):
+        extractor = threading.Thread(target=self.__extract, daemon=True)
+        extractor.start()
+        try:
+            while True:
+                try:
+                    yield self.__queue.get(timeout=0.1)
+                except queue.Empty:
+                    # stopped and drained
+                    if self.__stop.is_set() and self.__queue.empty():
+                        break
+        finally:
+            self.__stop.set()
+            extractor.join()
+
+        if self.__error:
+            raise self.__error
+
+
+# reads next archive ahead (filling OS cache) while previous one is written to device
+class ArchivePrefetch:
+    def __init__(self, chunk_size=PREFETCH_CHUNK):
+        self.chunk_size = chunk_size
+        self.fetched_bytes = 0
+        self.__executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self.__future = None
+        self.__stop = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def fetch(self, path):
+        # source slower than device, previous read still running : not piling up
+        if self.__future and not self.__future.done():
+            return
+        self.__future = self.__executor.submit(self.__read, path)
+
+    def __read(self, path):
+        try:
+            with open(path, "rb", buffering=0) as fp:
+                while not self.__stop.is_set():
+                    chunk = fp.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    self.fetched_bytes += len(chunk)
+        except OSError:
+            # only a hint, errors are reported by import
+            pass
+
+    def close(self):
+        self.__stop.set()
+        self.__executor.shutdown(wait=True)
+
+
+# Caps concurrent reads on a storage device : USB mass storage and SD cards lose bandwidth
+# with many interleaved readers, while deciphering and zip writing can run in parallel.
+#
+#   with open(file, "rb") as fp:
+#       shutil.copyfileobj(gate.reader(fp), fp_dst)
+#
+# Read throughput is measured per reader, to be compared with device bandwidth.
+class DeviceReadGate:
+    def __init__(self, readers=EXPORT_DEVICE_READERS):
+        self.readers = readers
+        self.read_bytes = 0
+        self.read_time = 0.0
+
+        self.__slots = threading.BoundedSemaphore(readers)
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return (f"Device reads : {self.read_bytes//1024} KB by {self.readers} reader(s), "
+                f"{PipelineStats.rate(self.read_bytes, self.read_time):.1f} MB/s per reader")
+
+    def read(self, fp, size=-1):
+        with self.__slots:
+            start = time.perf_counter()
+            data = fp.read(size)
+            duration = time.perf_counter() - start
+
+        with self.__lock:
+            self.read_bytes += len(data)
+            self.read_time += duration
+        return data
+
+    def reader(self, fp):
+        return _GatedReader(self, fp)
+
+
+class _GatedReader:
+    def __init__(self, gate, fp):
+        self.gate = gate
+        self.fp = fp
+
+    def read(self, size=-1):
+        return self.gate.read(self.fp, size)
+
+
+# one story to be exported, prepared in caller thread then zipped by a worker
+# arcnames (archive names of files) or story_keys (to decipher them) depend on the device
+class ExportJob:
+    def __init__(self, story, story_path: Path, zip_path: Path, files, arcnames=None, story_keys=None):
+        self.story = story
+        self.story_path = story_path
+        self.zip_path = zip_path
+        self.files = files
+        self.arcnames = arcnames
+        self.story_keys = story_keys
+        # incremental export
+        self.manifest = None
+        self.unchanged = False
+
+
+# Calls func on each item from a thread pool, yields results in the same order than items.
+# Items are consumed lazily (in caller thread), at most 2 x workers of them are in flight.
+def ordered_map(func, items, workers):
+    # no pool required, processing in current thread
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    max_pending = 2 * workers
+    pending = deque()
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for item in items:
+            pending.append(pool.submit(func, item))
+
+            # queue full, waiting for the oldest item
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        # draining remaining items
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # early exit (abort, error) : dropping items not started yet
+        pool.shutdown(wait=True, cancel_futures=True)
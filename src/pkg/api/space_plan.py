@@ -0,0 +1,158 @@
+import ctypes
+import os
+from io import BytesIO
+
+import mutagen
+from mutagen.flac import FLAC
+from mutagen.mp3 import MP3, BitrateMode, HeaderNotFoundError, MPEGFrame
+from mutagen.ogg import OggFileType
+from mutagen.wave import WAVE
+
+from pkg.api.constants import TYPE_PLAIN, TYPE_STUDIO_ZIP, TYPE_STUDIO_7Z, TYPE_FLAM_ZIP, TYPE_FLAM_7Z
+from pkg.api.convert_audio import audio_probe, mp3_audio_span
+from pkg.api.stories import FILE_META, FILE_STUDIO_JSON, FILE_STUDIO_THUMB, FILE_THUMB, FILE_UUID
+
+# FAT32 default for SD cards and USB sticks over 8GB, when it can't be read
+DEFAULT_CLUSTER_SIZE = 32 * 1024
+# STUdio pictures become RLE4 bitmaps of 320x240 (one 2 bytes run per pixel at worst, + end of
+# lines, headers and palette). Pictures are mostly below one byte per pixel, noisy ones being
+# big sources too.
+STUDIO_IMAGE_PIXELS = 320 * 240
+STUDIO_IMAGE_MAX_SIZE = 2 * STUDIO_IMAGE_PIXELS + 2 * 240 + 2 + 118
+STUDIO_IMAGE_EXT = (".png", ".jpg", ".jpeg", ".bmp")
+# STUdio audio converted by ffmpeg (LAME VBR aq=5, mono, 44.1kHz) stays around 62 kbps on white noise,
+# its worst case : it may be bigger than a low bitrate source. Audio is probed from its first bytes
+# (zip), its duration coming from headers or from the bitrate seen there.
+TRANSCODED_AUDIO_BITRATE = 80 * 1000
+AUDIO_PROBE_SIZE = 64 * 1024
+# duration unknown from first bytes (MP4...) : sources are assumed to be at least at this bitrate
+MIN_SOURCE_BITRATE = 8 * 1000
+# authorization file written by import
+BT_SIZE = 0x40
+
+
+def cluster_size(mount_point):
+    try:
+        if hasattr(os, "statvfs"):
+            stat = os.statvfs(mount_point)
+            return stat.f_frsize or stat.f_bsize or DEFAULT_CLUSTER_SIZE
+
+        root = os.path.splitdrive(os.path.abspath(mount_point))[0] + "\\"
+        sectors, sector_size, free_clusters, total_clusters = (ctypes.c_ulong() for _ in range(4))
+        if ctypes.windll.kernel32.GetDiskFreeSpaceW(root, ctypes.byref(sectors), ctypes.byref(sector_size),
+                                                    ctypes.byref(free_clusters), ctypes.byref(total_clusters)):
+            return sectors.value * sector_size.value or DEFAULT_CLUSTER_SIZE
+    except (OSError, AttributeError, ValueError):
+        pass
+    return DEFAULT_CLUSTER_SIZE
+
+
+def studio_image_size(source_size):
+    return min(STUDIO_IMAGE_MAX_SIZE, max(STUDIO_IMAGE_PIXELS, source_size))
+
+
+# average bitrate of MP3 frames in first bytes (0 if none)
+def mp3_frames_bitrate(audio_data):
+    fp = BytesIO(audio_data)
+    fp.seek(mp3_audio_span(audio_data)[0])
+    bitrates = []
+    try:
+        while True:
+            bitrates.append(MPEGFrame(fp).bitrate)
+    except HeaderNotFoundError:
+        pass
+    return sum(bitrates) / len(bitrates) if bitrates else 0
+
+
+# duration of a source from its first bytes (0 if unknown)
+def audio_duration(audio_data, source_size):
+    try:
+        audio = mutagen.File(BytesIO(audio_data))
+    except mutagen.MutagenError:
+        return 0
+    if audio is None:
+        return 0
+
+    info = audio.info
+    if isinstance(audio, WAVE) and info.bitrate:
+        # PCM, sizes in headers of a streamed WAV are wrong
+        return source_size * 8 / info.bitrate
+    if isinstance(audio, FLAC):
+        # total samples in STREAMINFO
+        return info.length
+    if isinstance(audio, MP3):
+        # from VBR header, or frames read
+        bitrate = info.bitrate if info.bitrate_mode != BitrateMode.UNKNOWN else mp3_frames_bitrate(audio_data)
+        return source_size * 8 / bitrate if bitrate else 0
+    if len(audio_data) >= source_size:
+        return info.length
+    if isinstance(audio, OggFileType):
+        # position of the last page read
+        return info.length * source_size / len(audio_data)
+    return 0
+
+
+# size of one STUdio audio asset once on device, from its first bytes
+def studio_audio_size(archive, name, audio_data):
+    source_size = archive.sizes[name]
+    try:
+        transcode, _ = audio_probe(name, audio_data)
+    except mutagen.MutagenError:
+        transcode = True
+    if not transcode:
+        return source_size
+
+    max_duration = source_size * 8 / MIN_SOURCE_BITRATE
+    duration = min(audio_duration(audio_data, source_size) or max_duration, max_duration)
+    return int(duration * TRANSCODED_AUDIO_BITRATE / 8)
+
+
+# (name, data) of STUdio audio assets, only first bytes of zip entries
+def studio_audio_entries(archive, names):
+    if archive.is_7z:
+        # solid archive, decompressed as a whole
+        return archive.stream(names)
+    return ((name, archive.head(name, AUDIO_PROBE_SIZE)) for name in names)
+
+
+def allocated(size, cluster):
+    return -(-size // cluster) * cluster
+
+
+# sizes of files written on device, from archive headers (only STUdio audio is read)
+def story_files(archive):
+    if archive.archive_type in [TYPE_STUDIO_ZIP, TYPE_STUDIO_7Z]:
+        # index files are smaller than story.json
+        json_size = archive.sizes.get(FILE_STUDIO_JSON, 0)
+        files = {index: json_size for index in ["ri", "si", "li", "ni"]}
+        audio = []
+        for name, size in archive.sizes.items():
+            if not name.startswith("assets/") or name.endswith(FILE_STUDIO_THUMB):
+                continue
+            if name.lower().endswith(STUDIO_IMAGE_EXT):
+                files[f"rf/000/{name[7:]}"] = studio_image_size(size)
+            else:
+                audio.append(name)
+        for name, data in studio_audio_entries(archive, audio):
+            files[f"sf/000/{name[7:]}"] = studio_audio_size(archive, name, data)
+    elif archive.archive_type == TYPE_PLAIN:
+        files = {name: size for name, size in archive.sizes.items() if name not in [FILE_UUID, FILE_META, FILE_THUMB]}
+    else:
+        files = dict(archive.sizes)
+
+    if archive.archive_type not in [TYPE_FLAM_ZIP, TYPE_FLAM_7Z]:
+        files = {name: size for name, size in files.items() if not name.endswith("bt")}
+        files["bt"] = BT_SIZE
+    return files
+
+
+# device space taken by one story : each file and directory rounded up to clusters
+def story_footprint(archive, cluster):
+    files = story_files(archive)
+
+    dirs = {""}
+    for name in files:
+        parts = name.split("/")[:-1]
+        dirs.update("/".join(parts[:depth]) for depth in range(1, len(parts) + 1))
+
+    return sum(allocated(size, cluster) for size in files.values()) + len(dirs) * cluster
@@ -1,6 +1,10 @@
 import json
 import os
 import shutil
+import struct
+import sys
+from array import array
+from contextlib import contextmanager
 from pathlib import Path
 from typing import List
 from uuid import UUID
@@ -8,18 +12,30 @@ from uuid import UUID
 import requests
 
 from pkg.api.constants import OFFICIAL_DB_URL, CFG_DIR, CACHE_DIR, FILE_OFFICIAL_DB, FILE_THIRD_PARTY_DB, \
-    STORY_TRANSCODING_SUPPORTED, OFFICIAL_TOKEN_URL
+    STORY_TRANSCODING_SUPPORTED, OFFICIAL_TOKEN_URL, FILE_THIRD_PARTY_JOURNAL, THIRD_PARTY_JOURNAL_SIZE
+from pkg.api.story_db import SOURCE_OFFICIAL, SOURCE_THIRD_PARTY, StoryDB, official_row, third_party_row
 
 STORY_UNKNOWN  = "Unknown story (maybe a User created story)..."
 DESC_NOT_FOUND = "No description found."
 
-# https://server-data-prod.lunii.com/v2/packs
-DB_OFFICIAL = {}
-DB_THIRD_PARTY = {}
+# official (https://server-data-prod.lunii.com/v2/packs) and third-party stories
+DB = StoryDB()
+# third-party entries of current batch (None if no batch)
+THIRD_PARTY_BATCH = None
 
 NODE_SIZE = 0x2C
 NI_HEADER_SIZE = 0x200
 
+# ni header : format, pack version, header size, node size, nodes, images, sounds, factory flag
+NI_HEADER = struct.Struct("<HHIIIIIB")
+# ni node : image and sound indexes, then ok and home transitions (list index, options, option index)
+NI_NODE = struct.Struct("<ii3i3i")
+NI_NODE_CONTROLS = struct.Struct("<HHHHH2x")
+NI_NODE_PADDING = b"\xAA" * (NODE_SIZE - NI_NODE.size)
+NI_NO_TRANSITION = (-1, -1, -1)
+# nodes packed at once when writing ni to a file
+NI_CHUNK_NODES = 1024
+
 FILE_THUMB = "_thumbnail.png"
 FILE_META  = "_metadata.json"
 FILE_UUID  = "uuid.bin"
@@ -37,6 +53,8 @@ class StudioStory:
 
         self.js_snodes = None
         self.js_anodes = None
+        # action nodes by id (first one wins, as a linear search would)
+        self.anodes_by_id = dict()
         self.ri = dict()
         self.si = dict()
         self.li: List[int] = list()
@@ -94,50 +112,52 @@ class StudioStory:
                     normalized_name = normalized_name[-8:].upper()
                     self.si[audio] = (normalized_name, len(self.si))
 
+        # stage nodes position by uuid (first one wins, as a linear search would)
+        snodes_index = dict()
+        for index, snode in enumerate(self.js_snodes):
+            snodes_index.setdefault(snode.get('uuid'), index)
+
         # looping action nodes
         absolute_index = 0
         self.js_anodes = story_json.get('actionNodes')
         for anode in self.js_anodes:
+            self.anodes_by_id.setdefault(anode.get('id'), anode)
             anode["global_index"] = absolute_index
             absolute_index += len(anode.get("options"))
             for option in anode.get("options"):
-                option_index = next((index for index, snode in enumerate(self.js_snodes) if snode.get('uuid') == option), -1)
-                self.li.append(option_index)
+                self.li.append(snodes_index.get(option, -1))
 
         self.compatible = True
 
     def get_ri_data(self):
-        data_ri = ""
-        for file in self.ri:
-            data_ri += f"000\\{self.ri[file][0]}"
-        return data_ri.encode('utf-8')
-    
-    def get_si_data(self):
-        data_si = ""
-        for file in self.si:
-            data_si += f"000\\{self.si[file][0]}"
-        return data_si.encode('utf-8')
-    
-    def get_ni_data(self):
-        ni_buffer = b""
-
-        # header section
-        ni_buffer += int(self.format_version[1:]).to_bytes(2, byteorder='little')
-        ni_buffer += int(self.pack_version).to_bytes(2, byteorder='little')
-        ni_buffer += int(NI_HEADER_SIZE).to_bytes(4, byteorder='little')
-        ni_buffer += int(NODE_SIZE).to_bytes(4, byteorder='little')
-        ni_buffer += len(self.js_snodes).to_bytes(4, byteorder='little')
-        ni_buffer += len(self.ri).to_bytes(4, byteorder='little')
-        ni_buffer += len(self.si).to_bytes(4, byteorder='little')
-        ni_buffer += int(1).to_bytes(1, byteorder='little')
-
-        # padding the header with 00
-        ni_buffer += b"\x00" * (NI_HEADER_SIZE - len(ni_buffer))
-
-        # node section
-        for snode in self.js_snodes:
-            current_node = b""
+        return "".join(f"000\\{name}" for name, _ in self.ri.values()).encode('utf-8')
 
+    def get_si_data(self):
+        return "".join(f"000\\{name}" for name, _ in self.si.values()).encode('utf-8')
+
+    def __ni_header(self):
+        header = bytearray(NI_HEADER_SIZE)
+        NI_HEADER.pack_into(header, 0,
+                            int(self.format_version[1:]),
+                            int(self.pack_version),
+                            NI_HEADER_SIZE,
+                            NODE_SIZE,
+                            len(self.js_snodes),
+                            len(self.ri),
+                            len(self.si),
+                            1)
+        return header
+
+    def __ni_transition(self, trans_node):
+        if not trans_node:
+            return NI_NO_TRANSITION
+
+        # looking for action node
+        anode = self.anodes_by_id.get(trans_node.get("actionNode"), -1)
+        return anode.get("global_index"), len(anode.get('options')), trans_node.get('optionIndex')
+
+    def __pack_ni_nodes(self, buffer, offset, snodes):
+        for snode in snodes:
             # image / audio for nodes
             ri_index = -1
             si_index = -1
@@ -145,74 +165,57 @@ class StudioStory:
                 ri_index = self.ri[snode.get('image')][1]
             if snode.get('audio') in self.si:
                 si_index = self.si[snode.get('audio')][1]
-            current_node += ri_index.to_bytes(4, byteorder='little', signed=True)
-            current_node += si_index.to_bytes(4, byteorder='little', signed=True)
-            
-            # ok transition
-            trans_node = snode.get("okTransition")
-            if trans_node:
-                # looking for action node
-                anode_uuid = trans_node.get("actionNode")
-                anode = next((one_node for one_node in self.js_anodes if one_node.get('id') == anode_uuid), -1)
-                li_index = anode.get("global_index")
-                # transition settings
-                current_node += li_index.to_bytes(4, byteorder='little', signed=True)
-                current_node += len(anode.get('options')).to_bytes(4, byteorder='little', signed=True)
-                current_node += trans_node.get('optionIndex').to_bytes(4, byteorder='little', signed=True)
-            else:
-                current_node += b"\xFF\xFF\xFF\xFF" * 3
-
-            # home transition
-            trans_node = snode.get("homeTransition")
-            if trans_node:
-                # looking for action node
-                anode_uuid = trans_node.get("actionNode")
-                anode = next((one_node for one_node in self.js_anodes if one_node.get('id') == anode_uuid), -1)
-                li_index = anode.get("global_index")
-                # transition settings
-                current_node += li_index.to_bytes(4, byteorder='little', signed=True)
-                current_node += len(anode.get('options')).to_bytes(4, byteorder='little', signed=True)
-                current_node += trans_node.get('optionIndex').to_bytes(4, byteorder='little', signed=True)
-            else:
-                current_node += b"\xFF\xFF\xFF\xFF" * 3
+
+            NI_NODE.pack_into(buffer, offset,
+                              ri_index, si_index,
+                              *self.__ni_transition(snode.get("okTransition")),
+                              *self.__ni_transition(snode.get("homeTransition")))
 
             # control section
             controls = snode.get("controlSettings")
             if controls:
-                current_node += controls.get("wheel").to_bytes(2, byteorder="little")
-                current_node += controls.get("ok").to_bytes(2, byteorder="little")
-                current_node += controls.get("home").to_bytes(2, byteorder="little")
-                current_node += controls.get("pause").to_bytes(2, byteorder="little")
-                current_node += controls.get("autoplay").to_bytes(2, byteorder="little")
-                current_node += b"\x00\x00"
+                NI_NODE_CONTROLS.pack_into(buffer, offset + NI_NODE.size,
+                                           controls.get("wheel"),
+                                           controls.get("ok"),
+                                           controls.get("home"),
+                                           controls.get("pause"),
+                                           controls.get("autoplay"))
+            else:
+                buffer[offset + NI_NODE.size:offset + NODE_SIZE] = NI_NODE_PADDING
 
-            # FINAL : adding current node to list
-            ni_buffer += current_node
-            ni_buffer += b"\xAA" * (NODE_SIZE - len(current_node))
+            offset += NODE_SIZE
 
-        return ni_buffer
+    def get_ni_data(self):
+        ni_buffer = self.__ni_header()
+        ni_buffer.extend(bytes(NODE_SIZE * len(self.js_snodes)))
+        self.__pack_ni_nodes(ni_buffer, NI_HEADER_SIZE, self.js_snodes)
+        return bytes(ni_buffer)
 
-    def get_li_data(self):
-        li_buffer = b""
+    # same as get_ni_data(), a chunk of nodes at a time
+    def write_ni(self, fp):
+        fp.write(self.__ni_header())
 
-        # parsing list node index
-        for index in self.li:
-            # Write index as signed 4-byte integer (little endian)
-            li_buffer += index.to_bytes(4, byteorder='little', signed=True)
+        chunk = bytearray(NODE_SIZE * NI_CHUNK_NODES)
+        for first in range(0, len(self.js_snodes), NI_CHUNK_NODES):
+            snodes = self.js_snodes[first:first + NI_CHUNK_NODES]
+            self.__pack_ni_nodes(chunk, 0, snodes)
+            fp.write(memoryview(chunk)[:NODE_SIZE * len(snodes)])
 
+    def get_li_data(self):
+        # list node indexes as signed 4-byte integers (little endian)
+        li_buffer = array('i', self.li)
         # adding extra padding for small stories
-        while len(li_buffer) < 8:
-            li_buffer += b"\x00"
-
-        return li_buffer
+        while len(li_buffer) < 2:
+            li_buffer.append(0)
+        if sys.byteorder != "little":
+            li_buffer.byteswap()
+        return li_buffer.tobytes()
 
     def write_bt(self, path_ni):
         pass
 
 
 def story_load_db(reload=False):
-    global DB_OFFICIAL
-    global DB_THIRD_PARTY
     retVal = True
 
     # fetching db if necessary
@@ -243,13 +246,12 @@ def story_load_db(reload=False):
         except (requests.exceptions.Timeout, requests.exceptions.RequestException, requests.exceptions.ConnectionError):
             retVal = False
 
-    # trying to load official DB
+    # trying to load official DB (only parsed if updated)
     if os.path.isfile(FILE_OFFICIAL_DB):
         try:
-            with open(FILE_OFFICIAL_DB, encoding='utf-8') as fp_db:
-                db_stories = json.load(fp_db)
-                DB_OFFICIAL = {db_stories[key]["uuid"].upper(): value for (key, value) in db_stories.items()}
-        except:
+            DB.sync_source(SOURCE_OFFICIAL, FILE_OFFICIAL_DB, official_row)
+        except (OSError, ValueError):
+            DB.drop_source(SOURCE_OFFICIAL)
             db = Path(FILE_OFFICIAL_DB)
             db.unlink(FILE_OFFICIAL_DB)
 
@@ -261,13 +263,15 @@ def story_load_db(reload=False):
         # Copy the file
         shutil.copyfile(file, FILE_THIRD_PARTY_DB)
 
+    # merging pending entries
+    thirdparty_db_compact()
+
     # there should be an unofficial DB
     if os.path.isfile(FILE_THIRD_PARTY_DB):
         try:
-            with open(FILE_THIRD_PARTY_DB, encoding='utf-8') as fp_db:
-                db_stories = json.load(fp_db)
-                DB_THIRD_PARTY = {db_stories[key]["uuid"].upper(): value for (key, value) in db_stories.items()}
-        except:
+            DB.sync_source(SOURCE_THIRD_PARTY, FILE_THIRD_PARTY_DB, third_party_row)
+        except (OSError, ValueError):
+            DB.drop_source(SOURCE_THIRD_PARTY)
             db = Path(FILE_THIRD_PARTY_DB)
             db.unlink(FILE_THIRD_PARTY_DB)
 
@@ -289,7 +293,48 @@ def thirdparty_db_add_thumb(uuid: UUID, image_data: bytes):
             fp.write(image_data)
 
 
-def thirdparty_db_add_story(uuid: UUID, title: str, desc: str):
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+def _journal_append(entries):
+    # creating dir if not there
+    if not os.path.isdir(CFG_DIR):
+        Path(CFG_DIR).mkdir(parents=True, exist_ok=True)
+
+    with open(FILE_THIRD_PARTY_JOURNAL, "a", encoding='utf-8') as fp_journal:
+        fp_journal.write("".join(json.dumps(entry) + "\n" for entry in entries))
+
+    # merging journal once big enough
+    if os.path.getsize(FILE_THIRD_PARTY_JOURNAL) >= THIRD_PARTY_JOURNAL_SIZE:
+        thirdparty_db_compact()
+
+
+def _journal_read():
+    entries = []
+    try:
+        with open(FILE_THIRD_PARTY_JOURNAL, encoding='utf-8') as fp_journal:
+            for line in fp_journal:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # partially written entry (interrupted process)
+                    continue
+    except OSError:
+        pass
+    return entries
+
+
+# merges journal entries into third-party JSON DB (single rewrite), then clears journal
+def thirdparty_db_compact():
+    entries = _journal_read()
+    if not entries:
+        return
+
     db_stories = dict()
 
     # trying to load third-party DB
@@ -300,23 +345,65 @@ def thirdparty_db_add_story(uuid: UUID, title: str, desc: str):
         except:
             db = Path(FILE_THIRD_PARTY_DB)
             db.unlink(FILE_THIRD_PARTY_DB)
+    db_stamp = _file_stamp(FILE_THIRD_PARTY_DB)
 
-    # creating new entry
-    db_stories[uuid.hex] = {'uuid': str(uuid), 'title': title, 'description': desc}
+    # latest entry wins
+    for entry in entries:
+        db_stories[UUID(entry['uuid']).hex] = entry
 
-    # saving updated db
-    with open(FILE_THIRD_PARTY_DB, "w", encoding='utf-8') as fp_db:
+    # saving updated db, aside then renamed to never leave a truncated file
+    db_tmp = FILE_THIRD_PARTY_DB + ".tmp"
+    with open(db_tmp, "w", encoding='utf-8') as fp_db:
         json.dump(db_stories, fp_db)
+    os.replace(db_tmp, FILE_THIRD_PARTY_DB)
+    os.remove(FILE_THIRD_PARTY_JOURNAL)
+
+    # index already holds these entries, only tracking the new file
+    DB.add_stories([third_party_row(entry) for entry in entries], FILE_THIRD_PARTY_DB, db_stamp)
+
+
+# within this block, third-party entries are saved to journal by thirdparty_db_flush() (once
+# per imported story), then merged at exit (single JSON DB rewrite)
+#   with thirdparty_db_batch():
+#       for story in ...:
+#           thirdparty_db_add_story(...)
+#           thirdparty_db_flush()
+@contextmanager
+def thirdparty_db_batch():
+    global THIRD_PARTY_BATCH
 
-    # reloading DBs
-    story_load_db()
+    # nested batch, outer one commits
+    if THIRD_PARTY_BATCH is not None:
+        yield
+        return
 
+    THIRD_PARTY_BATCH = []
+    try:
+        yield
+    finally:
+        thirdparty_db_flush()
+        THIRD_PARTY_BATCH = None
+        thirdparty_db_compact()
 
-def _uuid_match(uuid: UUID, key_part: str):
-    uuid = uuid.hex.upper()
-    key_part = key_part.replace("-", "").upper()
 
-    return key_part in uuid
+# saves entries of current batch to journal (single append), a crash keeps them
+def thirdparty_db_flush():
+    if THIRD_PARTY_BATCH:
+        _journal_append(THIRD_PARTY_BATCH)
+        THIRD_PARTY_BATCH.clear()
+
+
+def thirdparty_db_add_story(uuid: UUID, title: str, desc: str):
+    entry = {'uuid': str(uuid), 'title': title, 'description': desc}
+
+    # available at once for current process
+    DB.add_stories([third_party_row(entry)])
+
+    # saving entry (at least in journal)
+    if THIRD_PARTY_BATCH is not None:
+        THIRD_PARTY_BATCH.append(entry)
+    else:
+        _journal_append([entry])
 
 
 class Story:
@@ -338,44 +425,13 @@ class Story:
 
     @property
     def name(self):
-        one_uuid = str(self.uuid).upper()
-
-        for db in [DB_OFFICIAL, DB_THIRD_PARTY]:
-            # checking current db
-            if one_uuid in db:
-                if db[one_uuid].get("locales_available") and db[one_uuid].get("localized_infos"):
-                    locale = list(db[one_uuid]["locales_available"].keys())[0]
-                    title = db[one_uuid]["localized_infos"][locale].get("title")
-                    return title
-                else:
-                    title = db[one_uuid].get("title")
-                    if title:
-                        return title
-
-
-        return STORY_UNKNOWN
+        title = DB.title(self.str_uuid)
+        return title if title else STORY_UNKNOWN
 
     @property
     def desc(self):
-        one_uuid = str(self.uuid).upper()
-
-        for db in [DB_OFFICIAL, DB_THIRD_PARTY]:
-            # checking current db
-            if one_uuid in db:
-                if db[one_uuid].get("locales_available") and db[one_uuid].get("localized_infos"):
-                    locale = list(db[one_uuid]["locales_available"].keys())[0]
-                    desc: str = db[one_uuid]["localized_infos"][locale].get("description")
-                    # removing html parts
-                    while desc.lstrip().startswith("<"):
-                        pos = desc.find(">")
-                        desc = desc[pos+1:].lstrip()
-                    return desc
-                else:
-                    desc = db[one_uuid].get("description")
-                    if desc:
-                        return desc
-
-        return DESC_NOT_FOUND
+        desc = DB.description(self.str_uuid)
+        return desc if desc else DESC_NOT_FOUND
 
     def get_picture(self, reload: bool = False):
         image_data = None
@@ -416,49 +472,136 @@ class Story:
         return image_data
 
     def picture_url(self):
-        one_uuid = str(self.uuid).upper()
-
-        if one_uuid in DB_OFFICIAL:
-            locale = list(DB_OFFICIAL[one_uuid]["locales_available"].keys())[0]
-            image = DB_OFFICIAL[one_uuid]["localized_infos"][locale].get("image")
-            if image:
-                url = "https://storage.googleapis.com/lunii-data-prod" + image.get("image_url")
-                return url
-        return None
+        return DB.image_url(self.str_uuid)
 
     def get_meta(self):
-        one_uuid = self.str_uuid
+        return DB.meta(self.str_uuid)
 
-        # checking third-party DB
-        if one_uuid in DB_THIRD_PARTY:
-            meta = DB_THIRD_PARTY[one_uuid]
-            return json.dumps(meta)
+    def is_official(self):
+        return DB.is_official(self.str_uuid)
 
-        return None
 
-    def is_official(self):
-        global DB_OFFICIAL
-        return str(self.uuid).upper() in DB_OFFICIAL
+def _uuid_key(key_part):
+    return str(key_part).replace("-", "").upper()
 
 
+# Stories are indexed on their UUID hex string (upper case, without dashes) :
+# - a dict for full UUIDs (O(1) lookups, like done by feed_stories)
+# - a single newline separated string for partial ones (short UUIDs from CLI, any substring),
+#   each entry taking UUID_HEX_LEN+1 chars, so a match offset gives back the story position
+# Indexes are built on first lookup, and dropped by any change (except dict on append()).
 class StoryList(List[Story]):
-    def __init__(self):
-        super().__init__()
+    UUID_HEX_LEN = 32
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._by_hex = None
+        self._hex_str = None
+
+    def _invalidate(self):
+        self._by_hex = None
+        self._hex_str = None
+
+    def _index(self):
+        if self._by_hex is None:
+            self._by_hex = dict()
+            for one_story in self:
+                self._by_hex.setdefault(one_story.uuid.hex.upper(), []).append(one_story)
+        return self._by_hex
+
+    def _index_str(self):
+        if self._hex_str is None:
+            self._hex_str = "".join(one_story.uuid.hex.upper() + "\n" for one_story in self)
+        return self._hex_str
+
+    def _find(self, key_part, first_only=False):
+        key = _uuid_key(key_part)
+
+        # full UUID
+        if len(key) == self.UUID_HEX_LEN:
+            slist = self._index().get(key, [])
+            return slist[:1] if first_only else list(slist)
+
+        # separator can't be part of a UUID
+        if "\n" in key:
+            return []
+        if not key:
+            return list(self[:1]) if first_only else list(self)
+
+        # partial UUID, scanning whole index at once
+        slist = []
+        index_str = self._index_str()
+        entry_len = self.UUID_HEX_LEN + 1
+        pos = index_str.find(key)
+        while pos != -1:
+            entry = pos // entry_len
+            slist.append(self[entry])
+            if first_only:
+                break
+            # one match per story is enough
+            pos = index_str.find(key, (entry + 1) * entry_len)
+        return slist
 
     def __contains__(self, key_part):
-        for one_story in self:
-            if _uuid_match(one_story.uuid, str(key_part)):
-                return True
-        return False
+        return bool(self._find(key_part, first_only=True))
 
     def get_story(self, key_part: str):
-        for one_story in self:
-            if _uuid_match(one_story.uuid, str(key_part)):
-                return one_story
+        slist = self._find(key_part, first_only=True)
+        if slist:
+            return slist[0]
 
     def matching_stories(self, short_uuid):
-        slist = [one_story for one_story in self if _uuid_match(one_story.uuid, short_uuid)]
-        return slist
+        return self._find(short_uuid)
+
+    def append(self, one_story: Story):
+        super().append(one_story)
+        if self._by_hex is not None:
+            self._by_hex.setdefault(one_story.uuid.hex.upper(), []).append(one_story)
+        self._hex_str = None
+
+    def extend(self, iterable):
+        super().extend(iterable)
+        self._invalidate()
+
+    def insert(self, index, one_story: Story):
+        super().insert(index, one_story)
+        self._invalidate()
+
+    def remove(self, one_story):
+        super().remove(one_story)
+        self._invalidate()
+
+    def pop(self, index=-1):
+        self._invalidate()
+        return super().pop(index)
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+    def sort(self, *args, **kwargs):
+        super().sort(*args, **kwargs)
+        self._invalidate()
+
+    def reverse(self):
+        super().reverse()
+        self._invalidate()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._invalidate()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._invalidate()
+
+    def __iadd__(self, other):
+        self._invalidate()
+        return super().__iadd__(other)
+
+    def __imul__(self, count):
+        self._invalidate()
+        return super().__imul__(count)
 
 
 def story_is_studio(contents):
@@ -0,0 +1,84 @@
+import zipfile
+
+import py7zr
+
+from pkg.api.constants import EXT_7z, TYPE_UNK
+from pkg.api.pipeline import SevenZipStream
+
+# raised when opening a corrupted (or not supported) archive
+BAD_ARCHIVE_ERRORS = (zipfile.BadZipFile, py7zr.exceptions.Bad7zFile)
+
+
+# One story archive (zip or 7z), opened once. Contents are listed at opening, then
+# shared by type detection, validation and extraction, whatever the backend.
+#
+#   with StoryArchive.open(story_path) as archive:
+#       if FILE_UUID in archive.names:
+#           data = archive.read(FILE_UUID)
+#       for name, read_entry in archive.entries():
+#           ...
+#
+# archive_type caches detected TYPE_* for this archive.
+class StoryArchive:
+    def __init__(self, path, backend):
+        self.path = path
+        self.backend = backend
+        self.is_7z = isinstance(backend, py7zr.SevenZipFile)
+        self.archive_type = TYPE_UNK
+
+        if self.is_7z:
+            entries = [(f.filename, f.is_directory, f.uncompressed) for f in backend.list()]
+        else:
+            entries = [(i.filename, i.is_dir(), i.file_size) for i in backend.infolist()]
+
+        # all names in archive order, and uncompressed size of files (no directories)
+        self.names = [name for name, _, _ in entries]
+        self.sizes = {name: size or 0 for name, is_dir, size in entries if not is_dir}
+
+    @classmethod
+    def open(cls, path):
+        if str(path).lower().endswith(EXT_7z):
+            return cls(path, py7zr.SevenZipFile(path, mode='r'))
+        return cls(path, zipfile.ZipFile(file=path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.backend.close()
+
+    @property
+    def files(self):
+        return [name for name in self.names if name in self.sizes]
+
+    @property
+    def total_size(self):
+        return sum(self.sizes.values())
+
+    def read(self, name):
+        if self.is_7z:
+            # archive may have been read before
+            self.backend.reset()
+            return self.backend.read([name])[name].read()
+        return self.backend.read(name)
+
+    # first bytes of an entry, without inflating the rest of it (zip)
+    def head(self, name, size):
+        if self.is_7z:
+            return self.read(name)[:size]
+        with self.backend.open(name) as fp:
+            return fp.read(size)
+
+    # 7z entries decompressed one by one, in archive order (see SevenZipStream)
+    def stream(self, names=None):
+        return SevenZipStream(self.backend, names)
+
+    # (name, read_entry) for each file, data being read only when read_entry() is called
+    def entries(self):
+        if self.is_7z:
+            # solid archive, decompressed as a whole
+            return ((name, lambda data=data: data) for name, data in self.stream())
+        return ((name, lambda name=name: self.backend.read(name)) for name in self.files)
@@ -0,0 +1,204 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+from pkg.api.constants import FILE_STORY_DB
+
+SOURCE_OFFICIAL = 0
+SOURCE_THIRD_PARTY = 1
+
+# to be increased on any schema or row content change, forcing a full rebuild
+STORY_DB_VERSION = 2
+
+# "XXXXXXXX-XXXX-XXXX-XXXX-XXXXXXXXXXXX" and its last digits (device directories)
+UUID_STR_LEN = 36
+SHORT_UUID_LEN = 8
+
+OFFICIAL_IMAGE_URL = "https://storage.googleapis.com/lunii-data-prod"
+
+STORY_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source   INTEGER PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size     INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stories (
+    uuid        TEXT NOT NULL,
+    source      INTEGER NOT NULL,
+    title       TEXT,
+    description TEXT,
+    image_url   TEXT,
+    meta        TEXT,
+    PRIMARY KEY (uuid, source)
+) WITHOUT ROWID;
+-- device directories are named after UUID last 8 digits
+CREATE INDEX IF NOT EXISTS stories_short_uuid ON stories (substr(uuid, -8), source);
+"""
+
+
+def _strip_html(desc):
+    # removing html parts
+    while desc and desc.lstrip().startswith("<"):
+        pos = desc.find(">")
+        desc = desc[pos+1:].lstrip()
+    return desc
+
+
+# one row per pack, primary locale resolved once for all
+def official_row(entry):
+    title = entry.get("title")
+    desc = entry.get("description")
+    image_url = None
+
+    if entry.get("locales_available") and entry.get("localized_infos"):
+        locale = next(iter(entry["locales_available"]))
+        infos = entry["localized_infos"].get(locale, {})
+        title = infos.get("title")
+        desc = _strip_html(infos.get("description"))
+        image = infos.get("image")
+        if image and image.get("image_url"):
+            image_url = OFFICIAL_IMAGE_URL + image.get("image_url")
+
+    return entry["uuid"].upper(), SOURCE_OFFICIAL, title, desc, image_url, None
+
+
+def third_party_row(entry):
+    return entry["uuid"].upper(), SOURCE_THIRD_PARTY, entry.get("title"), entry.get("description"), None, json.dumps(entry)
+
+
+# Indexed story metadata, shared by all tools using CFG_DIR.
+# JSON DBs are imported only when their size or modification time changed,
+# any other start only opens the SQLite file. Lookups are one query on primary key,
+# official entries first.
+class StoryDB:
+    def __init__(self, db_path=FILE_STORY_DB):
+        self.db_path = db_path
+        self.__conn = None
+        # connection is shared by threads (exports, GUI workers)
+        self.__lock = threading.RLock()
+
+    def __connect(self):
+        if self.__conn:
+            return self.__conn
+
+        Path(os.path.dirname(self.db_path)).mkdir(parents=True, exist_ok=True)
+        try:
+            self.__conn = self.__open()
+        except sqlite3.DatabaseError:
+            # corrupted file, rebuilding from JSON sources
+            Path(self.db_path).unlink(missing_ok=True)
+            self.__conn = self.__open()
+        return self.__conn
+
+    def __open(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            # index can be rebuilt from sources, favoring cheap commits over durability
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != STORY_DB_VERSION:
+                conn.executescript("DROP TABLE IF EXISTS sources; DROP TABLE IF EXISTS stories;")
+                conn.executescript(STORY_DB_SCHEMA)
+                conn.execute(f"PRAGMA user_version = {STORY_DB_VERSION}")
+                conn.commit()
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise
+        return conn
+
+    def close(self):
+        with self.__lock:
+            if self.__conn:
+                self.__conn.close()
+                self.__conn = None
+
+    def __query(self, sql, params=()):
+        with self.__lock:
+            return self.__connect().execute(sql, params).fetchall()
+
+    # imports a JSON DB if modified since last import (returns True if imported)
+    # raises ValueError (or OSError) if file can't be parsed, leaving previous rows untouched
+    def sync_source(self, source, json_path, make_row, force=False):
+        stat = os.stat(json_path)
+        with self.__lock:
+            conn = self.__connect()
+            stamp = conn.execute("SELECT mtime_ns, size FROM sources WHERE source = ?", (source,)).fetchone()
+            if not force and stamp == (stat.st_mtime_ns, stat.st_size):
+                return False
+
+            with open(json_path, encoding='utf-8') as fp_db:
+                db_stories = json.load(fp_db)
+            try:
+                rows = [make_row(entry) for entry in db_stories.values()]
+            except (AttributeError, KeyError, TypeError) as e:
+                raise ValueError(f"Malformed story DB {json_path} : {e}")
+
+            with conn:
+                conn.execute("DELETE FROM stories WHERE source = ?", (source,))
+                conn.executemany("INSERT OR REPLACE INTO stories VALUES (?, ?, ?, ?, ?, ?)", rows)
+                conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", (source, stat.st_mtime_ns, stat.st_size))
+            return True
+
+    def drop_source(self, source):
+        with self.__lock:
+            conn = self.__connect()
+            with conn:
+                conn.execute("DELETE FROM stories WHERE source = ?", (source,))
+                conn.execute("DELETE FROM sources WHERE source = ?", (source,))
+
+    # updates some rows (already saved elsewhere) without reimporting the whole source
+    # if json_path was rewritten with these rows, its new stamp is recorded, provided the
+    # index was up to date with previous file (json_stamp)
+    def add_stories(self, rows, json_path=None, json_stamp=None):
+        with self.__lock:
+            conn = self.__connect()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO stories VALUES (?, ?, ?, ?, ?, ?)", rows)
+                if json_path and rows:
+                    source = rows[0][1]
+                    stamp = conn.execute("SELECT mtime_ns, size FROM sources WHERE source = ?", (source,)).fetchone()
+                    if stamp == json_stamp:
+                        stat = os.stat(json_path)
+                        conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?)", (source, stat.st_mtime_ns, stat.st_size))
+
+    def title(self, str_uuid):
+        rows = self.__query("SELECT title FROM stories WHERE uuid = ? AND title != '' ORDER BY source LIMIT 1", (str_uuid,))
+        return rows[0][0] if rows else None
+
+    def description(self, str_uuid):
+        rows = self.__query("SELECT description FROM stories WHERE uuid = ? AND description != '' ORDER BY source LIMIT 1", (str_uuid,))
+        return rows[0][0] if rows else None
+
+    def image_url(self, str_uuid):
+        rows = self.__query("SELECT image_url FROM stories WHERE uuid = ? AND source = ?", (str_uuid, SOURCE_OFFICIAL))
+        return rows[0][0] if rows else None
+
+    def meta(self, str_uuid):
+        rows = self.__query("SELECT meta FROM stories WHERE uuid = ? AND source = ?", (str_uuid, SOURCE_THIRD_PARTY))
+        return rows[0][0] if rows else None
+
+    def is_official(self, str_uuid):
+        return bool(self.__query("SELECT 1 FROM stories WHERE uuid = ? AND source = ?", (str_uuid, SOURCE_OFFICIAL)))
+
+    # first full UUID (upper case, with dashes) containing key_part, official entries first
+    # full UUIDs and short ones (8 last digits, as device directories) are resolved by index,
+    # other 8 digits parts by scan
+    def find_uuid(self, key_part):
+        key_part = key_part.upper()
+        if len(key_part) == UUID_STR_LEN:
+            rows = self.__query("SELECT uuid FROM stories WHERE uuid = ? ORDER BY source LIMIT 1", (key_part,))
+            return rows[0][0] if rows else None
+
+        if len(key_part) == SHORT_UUID_LEN and "-" not in key_part:
+            rows = self.__query("SELECT uuid FROM stories WHERE substr(uuid, -8) = ? ORDER BY source LIMIT 1", (key_part,))
+            if rows:
+                return rows[0][0]
+
+        rows = self.__query("SELECT uuid FROM stories WHERE instr(uuid, ?) > 0 ORDER BY source LIMIT 1", (key_part,))
+        return rows[0][0] if rows else None
+
+    def count(self, source):
+        return self.__query("SELECT COUNT(*) FROM stories WHERE source = ?", (source,))[0][0]
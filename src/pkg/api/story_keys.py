@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+
+from Crypto.Cipher import AES
+
+# distinct story keys with a ready AES key schedule, device key + stories of one device in practice
+AES_CONTEXTS_MAX = 256
+AES_BLOCK = 16
+
+
+# crypto cost of bulk operations (only file headers are processed)
+class CipherStats:
+    def __init__(self):
+        self.ciphered = 0
+        self.deciphered = 0
+        self.bytes = 0
+        self.time = 0.0
+        self.contexts = 0
+        # exports may run from several threads
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return (f"Ciphering : {self.ciphered} headers ciphered / {self.deciphered} deciphered, "
+                f"{self.bytes//1024} KB in {self.time*1000:.0f} ms, {self.contexts} AES contexts")
+
+    def count(self, ciphering, length, start):
+        duration = time.perf_counter() - start
+        with self.__lock:
+            if ciphering:
+                self.ciphered += 1
+            else:
+                self.deciphered += 1
+            self.bytes += length
+            self.time += duration
+
+    def count_context(self):
+        with self.__lock:
+            self.contexts += 1
+
+
+# Story keys of one device, deciphered from each story bt file.
+# Entries are stamped with bt (mtime, size), a replaced bt is deciphered again. As FAT mtime
+# resolution is 2s, bt files written by the application must also be invalidated explicitly.
+#
+# AES key schedules are kept per key (ECB contexts are stateless) : CBC deciphering is one ECB
+# pass XORed with previous blocks. CBC ciphering chains blocks one by one, a CBC context per file
+# is cheaper than chaining them here.
+class StoryKeyCache:
+    def __init__(self):
+        self.stats = CipherStats()
+        self.hits = 0
+        self.misses = 0
+
+        self.__entries = {}
+        self.__contexts = {}
+        # scan and export threads
+        self.__lock = threading.Lock()
+
+    def __repr__(self):
+        return f"Story keys : {self.hits} hits / {self.misses} misses - {self.stats}"
+
+    @staticmethod
+    def __stamp(bt_path):
+        try:
+            stat = os.stat(bt_path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, bt_path, load):
+        bt_path = os.fspath(bt_path)
+        stamp = self.__stamp(bt_path)
+
+        with self.__lock:
+            entry = self.__entries.get(bt_path)
+            if stamp and entry and entry[0] == stamp:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # bt read out of the lock, a concurrent load of the same file gives the same keys
+        keys = load(bt_path)
+        with self.__lock:
+            if stamp:
+                self.__entries[bt_path] = (stamp, keys)
+            else:
+                self.__entries.pop(bt_path, None)
+        return keys
+
+    def invalidate(self, bt_path=None):
+        with self.__lock:
+            if bt_path is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(os.fspath(bt_path), None)
+
+    def __ecb(self, key):
+        key = bytes(key)
+        with self.__lock:
+            context = self.__contexts.get(key)
+            if context:
+                return context
+            if len(self.__contexts) >= AES_CONTEXTS_MAX:
+                self.__contexts.clear()
+            context = self.__contexts[key] = AES.new(key, AES.MODE_ECB)
+        self.stats.count_context()
+        return context
+
+    # AES-CBC of a whole number of blocks, in place
+    def decrypt_into(self, key, iv, view):
+        if len(view) % AES_BLOCK:
+            raise ValueError("Data must be padded to 16 byte boundary in CBC mode")
+        if not view:
+            return
+        plain = self.__ecb(key).decrypt(view)
+        chain = bytes(iv) + bytes(view[:len(view) - AES_BLOCK])
+        view[:] = (int.from_bytes(plain, "big") ^ int.from_bytes(chain, "big")).to_bytes(len(view), "big")
+
+    def encrypt_into(self, key, iv, view):
+        self.stats.count_context()
+        AES.new(key, AES.MODE_CBC, iv).encrypt(view, output=view)
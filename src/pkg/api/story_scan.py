@@ -0,0 +1,112 @@
+import os
+import time
+
+from tqdm import tqdm
+
+from pkg.api.constants import SCAN_WORKERS, TQDM_BAR_FORMAT
+from pkg.api.pipeline import ordered_map
+
+
+# Files and dirs of a story directory, gathered in one pass with scandir (stat data comes
+# from directory entries). Paths are relative, lower case and "/" separated, as on FAT device.
+class StoryInventory:
+    def __init__(self, story_path):
+        self.story_path = story_path
+        self.files = set()
+        self.dirs = set()
+        self.size = 0
+
+        pending = [("", story_path)]
+        while pending:
+            rel_dir, abs_dir = pending.pop()
+            with os.scandir(abs_dir) as it:
+                for entry in it:
+                    # hidden entries are ignored (like glob)
+                    if entry.name.startswith("."):
+                        continue
+                    rel_path = rel_dir + entry.name.lower()
+                    if entry.is_dir(follow_symlinks=False):
+                        self.dirs.add(rel_path)
+                        pending.append((rel_path + "/", entry.path))
+                    else:
+                        self.files.add(rel_path)
+                        self.size += entry.stat(follow_symlinks=False).st_size
+
+    def has_file(self, rel_path):
+        return rel_path.replace("\\", "/").lower() in self.files
+
+    def any_endswith(self, suffix):
+        return any(entry.endswith(suffix) for entry in self.files | self.dirs)
+
+
+# scan result for one directory of device stories
+class StoryScan:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.uuid = None
+        self.str_uuid = None
+        self.listed = False
+        self.inventory = None
+        self.valid = False
+        # why the story is not valid, or what was found
+        self.issues = []
+        # authorization file to be written (computed by scan, applied by caller)
+        self.bt_fix = None
+        self.duration = 0.0
+
+
+class ScanReport:
+    def __init__(self):
+        self.stories = []
+        self.elapsed = 0.0
+
+    @property
+    def valid(self):
+        return [scan for scan in self.stories if scan.valid and scan.listed]
+
+    @property
+    def lost(self):
+        return [scan for scan in self.stories if scan.valid and not scan.listed]
+
+    @property
+    def broken(self):
+        return [scan for scan in self.stories if scan.str_uuid and not scan.valid]
+
+    def __repr__(self):
+        files = sum(len(scan.inventory.files) for scan in self.stories if scan.inventory)
+        busy = sum(scan.duration for scan in self.stories)
+        return (f"Scan : {len(self.stories)} dirs, {files} files in {self.elapsed:.2f}s "
+                f"({busy:.2f}s of checks) - {len(self.valid)} valid, {len(self.lost)} lost, {len(self.broken)} broken")
+
+
+# check function only gathering the directory inventory
+def inventory_story(scan: StoryScan):
+    scan.inventory = StoryInventory(scan.path)
+
+
+# Runs check(StoryScan) on each story directory of content_dir, from a thread pool.
+# Report keeps directories sorted by name, whatever the completion order.
+def scan_stories(content_dir, check, workers=SCAN_WORKERS):
+    report = ScanReport()
+    start = time.perf_counter()
+
+    try:
+        with os.scandir(content_dir) as it:
+            dirs = sorted((entry.name, entry.path) for entry in it if entry.is_dir())
+    except FileNotFoundError:
+        return report
+
+    def run(item):
+        scan = StoryScan(*item)
+        check_start = time.perf_counter()
+        check(scan)
+        scan.duration = time.perf_counter() - check_start
+        return scan
+
+    pbar = tqdm(iterable=ordered_map(run, dirs, workers), total=len(dirs), bar_format=TQDM_BAR_FORMAT)
+    for scan in pbar:
+        pbar.set_description(f"Processing {scan.name}")
+        report.stories.append(scan)
+    report.elapsed = time.perf_counter() - start
+    return report
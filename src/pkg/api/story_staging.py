@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from uuid import UUID
+
+from pkg.api.constants import LUNII_LOGGER
+
+STAGING_JOURNAL = "journal.json"
+
+
+# Stories are imported in a staging directory on the device, then renamed into
+# content directory once complete (bt is always written last).
+# Journal lists stories staged since last .pi commit, on next device opening an
+# interrupted import is either rolled back (no bt) or finished.
+class StoryStaging:
+    def __init__(self, staging_dir, content_dir):
+        self.staging_dir = Path(staging_dir)
+        self.content_dir = Path(content_dir)
+        self.journal_path = self.staging_dir.joinpath(STAGING_JOURNAL)
+        self.journal = []
+
+        # Get logger
+        self.logger = logging.getLogger(LUNII_LOGGER)
+
+    def story_dir(self, story_uuid: UUID):
+        return self.staging_dir.joinpath(str(story_uuid).upper()[28:])
+
+    def __save(self):
+        if not self.journal:
+            self.journal_path.unlink(missing_ok=True)
+            return
+
+        # written aside then renamed to never leave a truncated journal
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        journal_tmp = self.journal_path.with_name(STAGING_JOURNAL + ".tmp")
+        with open(journal_tmp, "w", encoding="utf-8") as fp_journal:
+            json.dump([str(story_uuid) for story_uuid in self.journal], fp_journal)
+        os.replace(journal_tmp, self.journal_path)
+
+    # journaling story, then providing its empty staging directory
+    def begin(self, story_uuid: UUID):
+        if story_uuid not in self.journal:
+            self.journal.append(story_uuid)
+            self.__save()
+
+        stage_path = self.story_dir(story_uuid)
+        if stage_path.exists():
+            shutil.rmtree(stage_path)
+        stage_path.mkdir(parents=True)
+        return stage_path
+
+    # moving complete story in place, journal entry is kept until .pi commit
+    # an existing directory is left untouched (lost story, other story with same short UUID),
+    # staged story is then dropped and None returned
+    def commit(self, story_uuid: UUID):
+        stage_path = self.story_dir(story_uuid)
+        story_path = self.content_dir.joinpath(stage_path.name)
+        if story_path.exists():
+            self.logger.log(logging.ERROR, f"Directory {story_path} already exists on device (lost story ?), story not imported")
+            shutil.rmtree(stage_path)
+            if story_uuid in self.journal:
+                self.journal.remove(story_uuid)
+                self.__save()
+            return None
+
+        self.content_dir.mkdir(parents=True, exist_ok=True)
+        os.rename(stage_path, story_path)
+        return story_path
+
+    # dropping one story (or all not committed ones) from staging
+    def rollback(self, story_uuid: UUID = None):
+        for one_uuid in [story_uuid] if story_uuid else list(self.journal):
+            stage_path = self.story_dir(one_uuid)
+            if not stage_path.exists():
+                # already committed
+                continue
+
+            shutil.rmtree(stage_path)
+            if one_uuid in self.journal:
+                self.journal.remove(one_uuid)
+                self.__save()
+
+        # nothing pending, no staging left on device
+        if not self.journal:
+            self.done()
+
+    # to be called once .pi lists all committed stories
+    def done(self):
+        if self.journal:
+            self.journal.clear()
+            self.__save()
+        if self.staging_dir.is_dir() and not any(self.staging_dir.iterdir()):
+            self.staging_dir.rmdir()
+
+    # processing journal left by an interrupted import, returns stories to be added in .pi
+    def recover(self):
+        if not self.staging_dir.is_dir():
+            return []
+
+        try:
+            with open(self.journal_path, encoding="utf-8") as fp_journal:
+                self.journal = [UUID(str_uuid) for str_uuid in json.load(fp_journal)]
+        except FileNotFoundError:
+            self.journal = []
+        except (OSError, ValueError, TypeError) as e:
+            self.logger.log(logging.WARNING, f"Unreadable staging journal, rolling back all stories ({e})")
+            self.journal = []
+
+        committed = []
+        for story_uuid in list(self.journal):
+            stage_path = self.story_dir(story_uuid)
+            if stage_path.joinpath("bt").is_file():
+                self.logger.log(logging.INFO, f"Finishing interrupted import - {story_uuid}")
+                if not self.commit(story_uuid):
+                    continue
+            elif stage_path.exists():
+                self.logger.log(logging.WARNING, f"Rolling back interrupted import - {story_uuid}")
+                shutil.rmtree(stage_path)
+                continue
+
+            if self.content_dir.joinpath(stage_path.name).is_dir():
+                committed.append(story_uuid)
+
+        # anything else is an unjournaled leftover (as an empty or unreadable journal)
+        for entry in self.staging_dir.iterdir():
+            if entry.is_dir():
+                shutil.rmtree(entry)
+            elif entry != self.journal_path or not self.journal:
+                entry.unlink()
+        return committed
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import tempfile
+
+from pkg.api.constants import TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_SIZE
+
+EXT_TMP = ".tmp"
+# once over size, oldest entries are evicted down to this ratio of max size (not scanning again
+# on next insertions)
+EVICT_RATIO = 0.9
+
+
+# content addressed cache of converted assets, shared by all processes on host
+# entries are named after sha256(parameters + source), mtime is used as LRU timestamp
+class TranscodeCache:
+    def __init__(self, cache_dir=TRANSCODE_CACHE_DIR, max_size=TRANSCODE_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+        # counters for current process
+        self.hits = 0
+        self.misses = 0
+        # cache size scanned by last eviction, plus entries added since by this process
+        # (other processes entries are seen by next scan)
+        self.__size = None
+
+    def __repr__(self):
+        total = self.hits + self.misses
+        ratio = 100 * self.hits / total if total else 0
+        return f"Transcode cache : {self.hits} hits / {self.misses} misses ({ratio:.0f}%)"
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def key(data, params: str):
+        digest = hashlib.sha256(params.encode('utf-8'))
+        digest.update(b"\x00")
+        digest.update(data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+
+        entry = os.path.join(self.cache_dir, key)
+        try:
+            with open(entry, "rb") as fp:
+                data = fp.read()
+            # refreshing entry for LRU
+            os.utime(entry)
+        except OSError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        if not self.enabled or len(data) > self.max_size:
+            return
+
+        entry = os.path.join(self.cache_dir, key)
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            # writing aside then renaming, other processes may read the same entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=EXT_TMP)
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            try:
+                replaced = os.path.getsize(entry)
+            except OSError:
+                replaced = 0
+            os.replace(tmp_path, entry)
+        except OSError:
+            # cache is an optimization, never a failure (nor a leftover)
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+
+        # directory scanned only when it may be over size
+        added = len(data) - replaced
+        if self.__size is None or self.__size + added > self.max_size:
+            self.evict()
+        else:
+            self.__size += added
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.name.endswith(EXT_TMP) or not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total_size += stat.st_size
+        except OSError:
+            return
+
+        self.__size = total_size
+        if total_size <= self.max_size:
+            return
+
+        # oldest entries first
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            self.__size = total_size
+            if total_size <= self.max_size * EVICT_RATIO:
+                break
+
+
+TRANSCODE_CACHE = TranscodeCache()
@@ -0,0 +1,114 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import util
+
+from pkg.api.constants import STORY_TRANSCODING_SUPPORTED, TRANSCODING_WORKERS
+from pkg.api.convert_audio import FFMPEG_POOL, TRANSCODE_ABORT, audio_to_mp3, audio_probe, tags_removal_required, \
+    mp3_tag_cleanup
+from pkg.api.convert_image import image_to_bitmap_rle4
+from pkg.api.transcode_cache import TRANSCODE_CACHE
+
+ASSET_IMAGE = 0
+ASSET_AUDIO = 1
+
+
+class TranscodedAsset:
+    def __init__(self, data, source_size=0):
+        self.data = data
+        self.source_size = source_size
+        self.transcoded = False
+        self.tags_removed = False
+        # audio requires ffmpeg but it is missing on host
+        self.unsupported = False
+        # transcode cache counters of the worker for this asset
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+
+# worker process setup : abort event of the parent (a spawned process has its own otherwise),
+# and warm ffmpeg spares killed on exit (atexit handlers are not run in pool workers)
+def _init_worker(abort):
+    FFMPEG_POOL.abort = abort
+    util.Finalize(None, FFMPEG_POOL.shutdown, exitpriority=0)
+
+
+# runs in worker processes : no logger here, the caller reports through TranscodedAsset flags
+def transcode_asset(kind, filename, data, cleanup_tags=True):
+    hits, misses = TRANSCODE_CACHE.hits, TRANSCODE_CACHE.misses
+    asset = _transcode_asset(kind, filename, data, cleanup_tags)
+    asset.cache_hits = TRANSCODE_CACHE.hits - hits
+    asset.cache_misses = TRANSCODE_CACHE.misses - misses
+    return asset
+
+
+def _transcode_asset(kind, filename, data, cleanup_tags):
+    asset = TranscodedAsset(data, len(data))
+
+    if kind == ASSET_IMAGE:
+        asset.data = image_to_bitmap_rle4(data)
+        return asset
+
+    # transcode audio if necessary
+    transcode, has_tags = audio_probe(filename, data)
+    if transcode:
+        if not STORY_TRANSCODING_SUPPORTED:
+            asset.unsupported = True
+            return asset
+        asset.data = audio_to_mp3(data)
+        asset.transcoded = True
+        has_tags = tags_removal_required(asset.data)
+
+    # removing tags if necessary
+    if cleanup_tags and has_tags:
+        asset.data = mp3_tag_cleanup(asset.data)
+        asset.tags_removed = True
+
+    return asset
+
+
+# jobs is an iterable of (tag, kind, filename, data), consumed lazily
+# yields (tag, TranscodedAsset) in the same order than jobs
+def transcode_assets(jobs, workers=TRANSCODING_WORKERS, cleanup_tags=True):
+    try:
+        yield from _transcode_assets(jobs, workers, cleanup_tags)
+    finally:
+        # entries added by all workers, cache size checked once per batch
+        if TRANSCODE_CACHE.enabled:
+            TRANSCODE_CACHE.evict()
+
+
+def _transcode_assets(jobs, workers, cleanup_tags):
+    # no pool required, processing in current process
+    if workers <= 1:
+        for tag, kind, filename, data in jobs:
+            yield tag, transcode_asset(kind, filename, data, cleanup_tags)
+        return
+
+    # limiting jobs in flight to keep memory bounded
+    max_pending = 2 * workers
+    pending = deque()
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(TRANSCODE_ABORT,))
+    try:
+        for tag, kind, filename, data in jobs:
+            pending.append((tag, pool.submit(transcode_asset, kind, filename, data, cleanup_tags)))
+
+            # queue full, waiting for the oldest job
+            if len(pending) >= max_pending:
+                yield _collect(*pending.popleft())
+
+        # draining remaining jobs
+        while pending:
+            yield _collect(*pending.popleft())
+    finally:
+        # early exit (abort, error) : dropping jobs not started yet
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _collect(tag, future):
+    asset = future.result()
+
+    # reporting worker cache usage in this process
+    TRANSCODE_CACHE.hits += asset.cache_hits
+    TRANSCODE_CACHE.misses += asset.cache_misses
+    return tag, asset
@@ -0,0 +1,119 @@
+import struct
+import unittest
+from io import BytesIO
+
+from mutagen.mp3 import MP3, BitrateMode, MONO
+
+from pkg.api.convert_audio import audio_probe, mp3_audio_span, mp3_tag_cleanup
+
+# MPEG1 layer III, 128kbps, 44.1kHz : 417 bytes frames
+MONO_FRAME = b"\xff\xfb\x90\xc0" + bytes(413)
+STEREO_FRAME = b"\xff\xfb\x90\x00" + bytes(413)
+AUDIO = MONO_FRAME * 20
+
+ID3V1 = b"TAG" + b"title".ljust(125, b"\0")
+ID3V1_EXT = b"TAG+" + b"long title".ljust(223, b"\0")
+
+
+def syncsafe(size):
+    return bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+
+
+def id3v2(title, footer=False):
+    text = b"\x03" + title.encode()
+    body = b"TIT2" + syncsafe(len(text)) + b"\0\0" + text
+    flags = 0x10 if footer else 0
+    tag = b"ID3" + bytes([4, 0, flags]) + syncsafe(len(body)) + body
+    if footer:
+        tag += b"3DI" + bytes([4, 0, flags]) + syncsafe(len(body))
+    return tag
+
+
+def ape(header=False):
+    items = struct.pack("<II", 5, 0) + b"Title\0" + b"title"
+    flags = 0x80000000 if header else 0
+    footer = b"APETAGEX" + struct.pack("<IIII", 2000, len(items) + 32, 1, flags) + bytes(8)
+    if header:
+        return footer[:20] + struct.pack("<I", flags | 0x20000000) + bytes(8) + items + footer
+    return items + footer
+
+
+# previous behavior : tags deleted by mutagen
+def mutagen_stripped(audio_data):
+    fp = BytesIO(audio_data)
+    MP3(fp).delete(fp)
+    return fp.getvalue()
+
+
+class testConvertAudio(unittest.TestCase):
+
+    def check(self, audio_data, expected=None):
+        cleaned = mp3_tag_cleanup(audio_data)
+        assert cleaned == (mutagen_stripped(audio_data) if expected is None else expected)
+        assert cleaned == AUDIO
+        assert audio_probe("story.mp3", audio_data) == (False, audio_data != AUDIO)
+
+    def test_1_untagged(self):
+        self.check(AUDIO)
+        assert mp3_audio_span(AUDIO) == (0, len(AUDIO))
+        assert mp3_tag_cleanup(AUDIO) is AUDIO
+
+    def test_2_id3v2(self):
+        self.check(id3v2("title") + AUDIO)
+        self.check(id3v2("title") + AUDIO + ID3V1)
+
+    def test_3_id3v2_footer(self):
+        # mutagen leaves the 10 bytes footer in front of audio
+        tagged = id3v2("title", footer=True) + AUDIO
+        self.check(tagged, mutagen_stripped(tagged)[10:])
+
+    def test_4_id3v2_stacked(self):
+        # mutagen removes one tag at a time
+        tagged = id3v2("first") + id3v2("second") + AUDIO
+        self.check(tagged, mutagen_stripped(mutagen_stripped(tagged)))
+
+    def test_5_id3v1(self):
+        self.check(AUDIO + ID3V1)
+
+        # mutagen leaves extended tag in place
+        tagged = AUDIO + ID3V1_EXT + ID3V1
+        assert mutagen_stripped(tagged) == AUDIO + ID3V1_EXT
+        self.check(tagged, AUDIO)
+        self.check(id3v2("title") + tagged, AUDIO)
+
+    def test_6_ape(self):
+        # APE tags were kept by mutagen, they are now removed
+        for header in [False, True]:
+            tagged = AUDIO + ape(header) + ID3V1
+            assert mutagen_stripped(tagged) == AUDIO + ape(header)
+            self.check(tagged, AUDIO)
+            self.check(AUDIO + ape(header), AUDIO)
+
+    def test_7_id3v2_appended(self):
+        # found through its footer, mutagen keeps it
+        tagged = AUDIO + id3v2("title", footer=True)
+        assert mutagen_stripped(tagged) == tagged
+        self.check(tagged, AUDIO)
+        self.check(AUDIO + id3v2("title", footer=True) + ID3V1, AUDIO)
+
+    def test_8_truncated(self):
+        # incomplete or inconsistent tags are left as they are, mutagen fails on most of them
+        for audio_data in [b"ID3\x04\x00",
+                           id3v2("title")[:15],
+                           b"ID3\x04\x00\x00" + syncsafe(100000) + AUDIO,
+                           b"ID3\x04\x00\x00\x80\x00\x00\x00" + AUDIO,
+                           AUDIO[:50] + b"TAG",
+                           AUDIO + b"3DI\x04\x00",
+                           AUDIO + b"APETAGEX" + struct.pack("<IIII", 2000, 10**6, 1, 0) + bytes(8),
+                           AUDIO + id3v2("title", footer=True)[-10:]]:
+            assert mp3_audio_span(audio_data) == (0, len(audio_data))
+            assert mp3_tag_cleanup(audio_data) == audio_data
+
+    def test_9_probe(self):
+        # same decision as mutagen stream info
+        for audio_data in [AUDIO, STEREO_FRAME * 20, id3v2("title") + STEREO_FRAME * 20 + ID3V1]:
+            info = MP3(BytesIO(audio_data)).info
+            expected = info.bitrate_mode not in [BitrateMode.UNKNOWN, BitrateMode.VBR, BitrateMode.CBR] or info.mode != MONO
+            assert audio_probe("story.mp3", audio_data)[0] == expected
+        assert audio_probe("story.mp3", STEREO_FRAME * 20) == (True, False)
+        assert audio_probe("story.ogg", AUDIO) == (True, False)
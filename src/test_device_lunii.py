@@ -0,0 +1,100 @@
+import os
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+
+import xxtea
+from Crypto.Cipher import AES
+
+from pkg.api.constants import FAH_V2_V3_USB_VID_PID, LUNII_V2, LUNII_V3, lunii_generic_key, lunii_tea_rounds
+from pkg.api.device_lunii import LuniiDevice
+
+# header only, shorter than a header, not a multiple of an AES block, several headers
+V2_LENGTHS = [8, 100, 508, 512, 516, 4000]
+V3_LENGTHS = [1, 15, 16, 100, 500, 512, 513, 1000, 4099]
+
+
+# v2 metadata : version 3, firmware 2.4, SNU, VID/PID, ciphered device key
+def lunii_md():
+    md = bytearray(0x200)
+    md[0:2] = (3).to_bytes(2, "little")
+    md[6:10] = struct.pack("<HH", 2, 4)
+    md[10:18] = bytes.fromhex("0023456789abcdef")
+    md[18:22] = struct.pack("<HH", *FAH_V2_V3_USB_VID_PID)
+    md[0x100:0x200] = bytes(range(256))
+    return bytes(md)
+
+
+# previous ciphering, returning a new bytes object
+def reference_cipher(version, buffer, key, iv=None, encrypt=True, length=512):
+    length = min(length, len(buffer))
+    if version == LUNII_V3:
+        if encrypt and length % 16 != 0:
+            padlen = 16 - len(buffer) % 16
+            buffer += b"\x00" * padlen
+            length += padlen
+        aes = AES.new(key, AES.MODE_CBC, iv)
+        header = aes.encrypt(buffer[:length]) if encrypt else aes.decrypt(buffer[:length])
+    else:
+        transform = xxtea.encrypt if encrypt else xxtea.decrypt
+        header = transform(buffer[:length], key, padding=False, rounds=lunii_tea_rounds(buffer[:length]))
+    return bytes(header) + bytes(buffer[length:])
+
+
+class testLuniiCipher(unittest.TestCase):
+
+    def setUp(self):
+        root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        root.joinpath(".md").write_bytes(lunii_md())
+        self.device = LuniiDevice(str(root))
+        assert self.device.device_version == LUNII_V2
+
+        self.key = os.urandom(16)
+        self.iv = os.urandom(16)
+
+    def check_round_trip(self, version, length, key, iv=None):
+        device = self.device
+        plain = os.urandom(length)
+        ciphered = reference_cipher(version, plain, key, iv)
+
+        assert device.cipher(plain, key, iv) == ciphered
+        assert b"".join(device.cipher_chunks(plain, key, iv)) == ciphered
+        assert device.cipher_into(bytearray(plain), key, iv) == ciphered
+
+        deciphered = reference_cipher(version, ciphered, key, iv, encrypt=False)
+        assert device.decipher(ciphered, key, iv) == deciphered
+        assert device.decipher_into(bytearray(ciphered), key, iv) == deciphered
+        # padding added by v3 ciphering stays
+        assert deciphered[:length] == plain
+
+        # in place, through a view on a larger buffer
+        if len(ciphered) == length:
+            buffer = bytearray(b"-" + plain + b"-")
+            with memoryview(buffer) as view:
+                assert device.cipher_into(view[1:-1], key, iv) == ciphered
+            assert buffer == b"-" + ciphered + b"-"
+
+    def test_1_v2(self):
+        for length in V2_LENGTHS:
+            self.check_round_trip(LUNII_V2, length, lunii_generic_key)
+
+    def test_2_v3(self):
+        self.device.device_version = LUNII_V3
+        for length in V3_LENGTHS:
+            self.check_round_trip(LUNII_V3, length, self.key, self.iv)
+
+    def test_3_v2_to_v3(self):
+        device = self.device
+        device.device_version = LUNII_V3
+        device.story_key, device.story_iv = self.key, self.iv
+        transcipher = device._LuniiDevice__get_transciphered_chunks
+
+        for length in [512, 516, 4000]:
+            plain = os.urandom(length)
+            data_v2 = reference_cipher(LUNII_V2, plain, lunii_generic_key)
+            for file in ["ri", "si", "li", "rf/000/0000000A", "sf/000/0000000B"]:
+                header, payload = transcipher(file, data_v2)
+                assert bytes(header) + bytes(payload) == reference_cipher(LUNII_V3, plain, self.key, self.iv)
+            # index is never ciphered
+            assert b"".join(transcipher("ni", data_v2)) == data_v2
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from pkg.api import device_writer
+from pkg.api.device_writer import DeviceWriter
+
+BLOCK = 16
+
+
+class testDeviceWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.writer = DeviceWriter(block_size=BLOCK, coalesce_size=1024, preallocate=False)
+
+    def blocks(self, chunks):
+        return [bytes(block) for block in self.writer._DeviceWriter__blocks(chunks)]
+
+    def test_1_blocks_alignment(self):
+        for chunks in [[b"a" * 40],
+                       [b"a" * 5, b"b" * 7, b"c" * 30],
+                       [b"a" * 3, b"b" * 13, b"c" * 16, b"d"],
+                       [b"a" * 16, b"", b"b" * 32],
+                       [bytearray(b"a" * 20), memoryview(b"b" * 20)]]:
+            blocks = self.blocks(chunks)
+            data = b"".join(bytes(chunk) for chunk in chunks)
+
+            assert b"".join(blocks) == data
+            # every block but the last one is full, starting on a multiple of block size
+            assert all(len(block) == BLOCK for block in blocks[:-1])
+            assert 0 < len(blocks[-1]) <= BLOCK
+
+    def test_2_big_chunks_not_copied(self):
+        payload = b"p" * (4 * BLOCK)
+        blocks = list(self.writer._DeviceWriter__blocks([b"h" * BLOCK, payload]))
+
+        assert len(blocks) == 5
+        assert all(isinstance(block, memoryview) and block.obj is payload for block in blocks[1:])
+
+    def test_3_empty(self):
+        assert self.blocks([]) == []
+        assert self.blocks([b""]) == []
+
+        self.writer.write(self.root.joinpath("empty"), b"")
+        self.writer.flush()
+        assert self.root.joinpath("empty").read_bytes() == b""
+
+    def test_4_aligned_writes(self):
+        sizes = []
+        real_write = os.write
+
+        def write_spy(fd, data):
+            sizes.append(len(data))
+            return real_write(fd, data)
+
+        with mock.patch("os.write", write_spy):
+            self.writer.write(self.root.joinpath("a", "file"), [b"h" * 5, b"p" * 40])
+            self.writer.flush()
+
+        assert self.root.joinpath("a", "file").read_bytes() == b"h" * 5 + b"p" * 40
+        assert sizes == [BLOCK, BLOCK, 13]
+        assert self.writer.stats.writes == 3
+
+    def test_5_coalesced(self):
+        target = self.root.joinpath("b", "file")
+        self.writer.write(target, b"x" * 100)
+        # pending until coalesce size is reached
+        assert not target.exists()
+
+        self.writer.write(self.root.joinpath("c", "file"), b"y" * 1000)
+        assert target.read_bytes() == b"x" * 100
+        assert self.root.joinpath("c", "file").read_bytes() == b"y" * 1000
+        assert self.writer.stats.files == 2
+        assert self.writer.stats.dirs == 2
+
+    def test_6_discard(self):
+        target = self.root.joinpath("d", "file")
+        self.writer.write(target, b"x" * 10)
+        self.writer.discard()
+        self.writer.flush()
+        assert not target.exists()
+
+        # written then removed : not synced
+        self.writer.write(target, b"x" * 10)
+        self.writer.flush()
+        self.writer.discard()
+        self.writer.sync()
+        assert self.writer.stats.syncs == 0
+
+    def test_7_callable(self):
+        target = self.root.joinpath("ni")
+        self.writer.write(target, lambda fp: fp.write(b"n" * 40))
+        self.writer.flush()
+
+        assert target.read_bytes() == b"n" * 40
+        assert self.writer.stats.bytes == 40
+        assert self.writer.stats.writes == 3
+
+    def test_8_sync(self):
+        kept = self.root.joinpath("e", "kept")
+        removed = self.root.joinpath("e", "removed")
+        self.writer.write(kept, b"x" * 10)
+        self.writer.write(removed, b"x" * 10)
+        self.writer.flush()
+        removed.unlink()
+
+        # files of a removed story are skipped, without syncfs too
+        with mock.patch.object(device_writer, "_syncfs", None):
+            self.writer.sync()
+        assert self.writer.stats.syncs == 1
+
+        self.writer.write(kept, b"y" * 10)
+        self.writer.flush()
+        self.writer.sync()
+        assert self.writer.stats.syncs == 2
+
+        # nothing written since
+        self.writer.sync()
+        assert self.writer.stats.syncs == 2
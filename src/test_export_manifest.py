@@ -0,0 +1,174 @@
+import os
+import struct
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+from uuid import UUID
+
+from pkg.api import stories
+from pkg.api.constants import EXPORT_COMPRESSION_DEFLATE, EXPORT_COMPRESSION_STORE
+from pkg.api.device_flam import FlamDevice
+from pkg.api.device_lunii import LuniiDevice
+from pkg.api.export_manifest import ExportManifest
+from pkg.api.story_db import StoryDB, SOURCE_OFFICIAL
+from test_device_lunii import lunii_md
+
+STORY_UUID = UUID("9D9521E5-84AC-4CC8-9B09-8D0AFFB5D68A")
+
+
+def touch(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+# later mtime than any previous write (FAT resolution is not involved here)
+def bump_mtime(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10**9))
+
+
+class testExportManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.story_path = self.root.joinpath("story")
+        for name in ["ni", "ri", "rf/000/00000000", "sf/000/00000000"]:
+            touch(self.story_path.joinpath(name), name.encode() * 100)
+        self.files = [str(path) for path in self.story_path.rglob("*") if path.is_file()]
+        self.zip_path = self.root.joinpath("story.zip")
+
+    def exported(self, settings=None):
+        manifest = ExportManifest.scan(self.story_path, self.files, settings or {"compression": "auto"})
+        self.zip_path.write_bytes(b"archive")
+        manifest.save(self.zip_path)
+        return manifest
+
+    def rescan(self, settings=None):
+        return ExportManifest.scan(self.story_path, self.files, settings or {"compression": "auto"})
+
+    def test_1_unchanged(self):
+        manifest = self.exported()
+        assert sorted(manifest.files) == ["ni", "rf/000/00000000", "ri", "sf/000/00000000"]
+        assert self.rescan().unchanged(self.zip_path)
+
+        loaded = ExportManifest.load(self.zip_path)
+        assert loaded.files == manifest.files and loaded.archive_size == len(b"archive")
+
+    def test_2_file_changed(self):
+        self.exported()
+        bump_mtime(self.story_path.joinpath("sf/000/00000000"))
+        assert not self.rescan().unchanged(self.zip_path)
+
+        self.exported()
+        touch(self.story_path.joinpath("rf/000/00000000"), b"x")
+        assert not self.rescan().unchanged(self.zip_path)
+
+    def test_3_index_header_changed(self):
+        self.exported()
+        # same size and mtime, only root files headers are compared
+        path = self.story_path.joinpath("ri")
+        stat = os.stat(path)
+        touch(path, b"X" + path.read_bytes()[1:])
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert not self.rescan().unchanged(self.zip_path)
+
+    def test_4_settings_changed(self):
+        self.exported()
+        assert not self.rescan({"compression": "none"}).unchanged(self.zip_path)
+
+    def test_5_archive_changed(self):
+        self.exported()
+        self.zip_path.write_bytes(b"other archive")
+        assert not self.rescan().unchanged(self.zip_path)
+
+        self.exported()
+        self.zip_path.unlink()
+        assert not self.rescan().unchanged(self.zip_path)
+
+    def test_6_discard(self):
+        self.exported()
+        ExportManifest.discard(self.zip_path)
+        assert ExportManifest.load(self.zip_path) is None
+        assert not self.rescan().unchanged(self.zip_path)
+        # nothing to discard
+        ExportManifest.discard(self.zip_path)
+
+
+# incremental branch of device exports, on a device in a temp dir
+class testIncrementalExport(unittest.TestCase):
+
+    def setUp(self):
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.out_path = self.root.joinpath("out")
+        self.out_path.mkdir()
+
+        # official story, no thumbnail nor metadata to fetch
+        db = StoryDB(str(self.root.joinpath("stories.sqlite")))
+        db.add_stories([(str(STORY_UUID), SOURCE_OFFICIAL, "Story", "", None, None)])
+        self.addCleanup(db.close)
+        self.enterContext(mock.patch.object(stories, "DB", db))
+
+    def lunii_device(self):
+        mount_point = self.root.joinpath("lunii")
+        touch(mount_point.joinpath(".md"), lunii_md())
+        touch(mount_point.joinpath(".pi"), STORY_UUID.bytes)
+
+        story_path = mount_point.joinpath(".content", "FFB5D68A")
+        for name in ["ni", "li", "ri", "si", "bt", "rf/000/00000000", "sf/000/00000000"]:
+            touch(story_path.joinpath(name), bytes(range(256)) * 4)
+        return LuniiDevice(str(mount_point)), story_path
+
+    def flam_device(self):
+        mount_point = self.root.joinpath("flam")
+        mdf = struct.pack("<H", 1) + b"main: 1.2.3-x\ncomm: 2.0.0-y".ljust(48, b"\0")
+        mdf += b"0123456789abcdef".ljust(24, b"\0") + struct.pack("<HH", 0x1234, 0x5678)
+        touch(mount_point.joinpath(".mdf"), mdf)
+        touch(mount_point.joinpath("etc", "library", "list"), str(STORY_UUID).lower().encode() + b"\n")
+
+        story_path = mount_point.joinpath("str", str(STORY_UUID).lower())
+        for name in ["info", "main.lsf", "audio/0000.mp3"]:
+            touch(story_path.joinpath(name), bytes(range(256)) * 4)
+        return FlamDevice(str(mount_point)), story_path
+
+    def check_incremental(self, device, story_path, changed_file):
+        device.export_incremental = True
+        zip_path = device.export_story("FFB5D68A", str(self.out_path))
+        assert zip_path and ExportManifest.load(zip_path)
+
+        # unchanged : archive left as it is
+        zip_path.write_bytes(zip_path.read_bytes())
+        bump_mtime(zip_path)
+        stamp = os.stat(zip_path).st_mtime_ns
+        with self.assertLogs(device.logger, "INFO") as logs:
+            assert device.export_story("FFB5D68A", str(self.out_path)) == zip_path
+        assert any("Unchanged" in line for line in logs.output)
+        assert os.stat(zip_path).st_mtime_ns == stamp
+
+        # one device file changed
+        bump_mtime(story_path.joinpath(changed_file))
+        device.export_story("FFB5D68A", str(self.out_path))
+        assert os.stat(zip_path).st_mtime_ns != stamp
+
+        # other compression policy
+        assert device.export_compression == EXPORT_COMPRESSION_DEFLATE
+        device.export_compression = EXPORT_COMPRESSION_STORE
+        bump_mtime(zip_path)
+        stamp = os.stat(zip_path).st_mtime_ns
+        device.export_story("FFB5D68A", str(self.out_path))
+        assert os.stat(zip_path).st_mtime_ns != stamp
+        assert ExportManifest.load(zip_path).settings["compression"] == device.export_compression
+
+        # failed rewrite : previous manifest no longer describes the archive
+        bump_mtime(story_path.joinpath(changed_file))
+        with mock.patch("zipfile.ZipFile", side_effect=PermissionError("read-only")):
+            assert device.export_story("FFB5D68A", str(self.out_path)) is None
+        assert ExportManifest.load(zip_path) is None
+
+    def test_1_lunii(self):
+        device, story_path = self.lunii_device()
+        self.check_incremental(device, story_path, "sf/000/00000000")
+
+    def test_2_flam(self):
+        device, story_path = self.flam_device()
+        self.check_incremental(device, story_path, "audio/0000.mp3")
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from uuid import UUID
+
+from pkg.api.import_manifest import ImportManifest, FINGERPRINT_SIZE, STATUS_IMPORTED, STATUS_FAILED
+
+UUID_A = UUID("9D9521E5-84AC-4CC8-9B09-8D0AFFB5D68A")
+
+
+class testImportManifest(unittest.TestCase):
+
+    def setUp(self):
+        root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.archive = root.joinpath("story.zip")
+        # head and tail fingerprinted, middle is not
+        self.archive.write_bytes(b"A" * FINGERPRINT_SIZE + b"B" * FINGERPRINT_SIZE + b"C" * FINGERPRINT_SIZE)
+        self.manifest_path = str(root.joinpath("cfg", "import.json"))
+
+    def recorded(self, status=STATUS_IMPORTED):
+        manifest = ImportManifest(self.manifest_path)
+        manifest.record(self.archive, UUID_A, status)
+        return manifest
+
+    def test_1_unchanged(self):
+        manifest = self.recorded()
+        assert manifest.story_uuid(self.archive) == UUID_A
+        assert manifest.story_uuid(str(self.archive)) == UUID_A
+        assert manifest.story_uuid(self.archive.with_name("other.zip")) is None
+
+    def test_2_save_load(self):
+        self.recorded().save()
+        manifest = ImportManifest(self.manifest_path).load()
+        assert manifest.story_uuid(self.archive) == UUID_A
+
+        # other version or broken file : starting over
+        Path(self.manifest_path).write_text("{\"version\": 0, \"archives\": {}}", encoding="utf-8")
+        assert ImportManifest(self.manifest_path).load().entries == {}
+        Path(self.manifest_path).write_text("[", encoding="utf-8")
+        assert ImportManifest(self.manifest_path).load().entries == {}
+
+    def test_3_size_changed(self):
+        manifest = self.recorded()
+        with open(self.archive, "ab") as fp:
+            fp.write(b"D")
+        assert manifest.story_uuid(self.archive) is None
+
+    def test_4_touched_same_contents(self):
+        manifest = self.recorded()
+        stat = os.stat(self.archive)
+        os.utime(self.archive, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        assert manifest.story_uuid(self.archive) == UUID_A
+        # new mtime recorded, no fingerprint next time
+        assert manifest.entries[os.path.abspath(self.archive)]["mtime_ns"] == stat.st_mtime_ns + 10**9
+
+    def test_5_rewritten_same_size(self):
+        manifest = self.recorded()
+        stat = os.stat(self.archive)
+        # same size, different tail
+        with open(self.archive, "r+b") as fp:
+            fp.seek(-1, os.SEEK_END)
+            fp.write(b"X")
+        os.utime(self.archive, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        assert manifest.story_uuid(self.archive) is None
+
+    def test_6_removed(self):
+        manifest = self.recorded()
+        self.archive.unlink()
+        assert manifest.story_uuid(self.archive) is None
+        # nothing recorded for a missing archive
+        missing = self.archive.with_name("missing.zip")
+        manifest.record(missing, UUID_A, STATUS_IMPORTED)
+        assert os.path.abspath(missing) not in manifest.entries
+
+    def test_7_no_uuid(self):
+        manifest = ImportManifest(self.manifest_path)
+        manifest.record(self.archive, None, STATUS_FAILED)
+        assert manifest.entries[os.path.abspath(self.archive)]["status"] == STATUS_FAILED
+        assert manifest.story_uuid(self.archive) is None
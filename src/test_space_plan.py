@@ -0,0 +1,143 @@
+import io
+import unittest
+import wave
+
+from pkg.api.constants import TYPE_PLAIN, TYPE_STUDIO_ZIP, TYPE_STUDIO_7Z, TYPE_FLAM_ZIP
+from pkg.api.space_plan import story_files, story_footprint, studio_image_size, allocated, mp3_frames_bitrate, \
+    AUDIO_PROBE_SIZE, STUDIO_IMAGE_PIXELS, STUDIO_IMAGE_MAX_SIZE, TRANSCODED_AUDIO_BITRATE, MIN_SOURCE_BITRATE, BT_SIZE
+
+CLUSTER = 4096
+
+
+# 16 bits mono PCM
+def wav_data(seconds, rate=8000):
+    fp = io.BytesIO()
+    with wave.open(fp, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\x01\x00" * rate * seconds)
+    return fp.getvalue()
+
+
+# MPEG1 layer 3 frames, 64 kbps, 44.1kHz, mono or stereo (208 bytes each)
+def mp3_data(frames, mode=b"\xc0"):
+    return (b"\xff\xfb\x50" + mode + b"\x00" * 204) * frames
+
+
+# 16 bits mono PCM at 8kHz
+WAV_BITRATE = 8000 * 16
+
+
+# headers and contents, as StoryArchive provides them
+class FakeArchive:
+    def __init__(self, archive_type, entries):
+        self.archive_type = archive_type
+        self.is_7z = archive_type == TYPE_STUDIO_7Z
+        self.entries = entries
+        self.sizes = {name: len(data) if isinstance(data, bytes) else data for name, data in entries.items()}
+        self.reads = []
+        self.heads = []
+
+    def read(self, name):
+        self.reads.append(name)
+        return self.entries[name]
+
+    def head(self, name, size):
+        self.heads.append(name)
+        return self.entries[name][:size]
+
+    def stream(self, names):
+        return ((name, self.read(name)) for name in names)
+
+
+class testSpacePlan(unittest.TestCase):
+
+    def test_1_allocated(self):
+        assert allocated(0, CLUSTER) == 0
+        assert allocated(1, CLUSTER) == CLUSTER
+        assert allocated(CLUSTER, CLUSTER) == CLUSTER
+        assert allocated(CLUSTER + 1, CLUSTER) == 2 * CLUSTER
+
+    def test_2_studio_image(self):
+        assert studio_image_size(100) == STUDIO_IMAGE_PIXELS
+        assert studio_image_size(100000) == 100000
+        assert studio_image_size(10**7) == STUDIO_IMAGE_MAX_SIZE
+
+    def test_3_studio_files(self):
+        for archive_type in [TYPE_STUDIO_ZIP, TYPE_STUDIO_7Z]:
+            mp3 = mp3_data(2000)
+            wav = wav_data(5)
+            archive = FakeArchive(archive_type, {
+                "story.json": 5000,
+                "thumbnail.png": 20000,
+                "assets/a.png": 100000,
+                "assets/b.wav": wav,
+                "assets/c.mp3": mp3,
+            })
+            files = story_files(archive)
+
+            assert files == {
+                "ri": 5000, "si": 5000, "li": 5000, "ni": 5000,
+                "rf/000/a.png": 100000,
+                # transcoded, from its duration
+                "sf/000/b.wav": int(len(wav) * 8 / WAV_BITRATE * TRANSCODED_AUDIO_BITRATE / 8),
+                # kept as it is
+                "sf/000/c.mp3": len(mp3),
+                "bt": BT_SIZE,
+            }
+            # only audio read : zip entries from their first bytes, solid 7z once
+            if archive_type == TYPE_STUDIO_ZIP:
+                assert archive.heads == ["assets/b.wav", "assets/c.mp3"]
+                assert archive.reads == []
+            else:
+                assert archive.reads == ["assets/b.wav", "assets/c.mp3"]
+
+    def test_4_plain_files(self):
+        archive = FakeArchive(TYPE_PLAIN, {
+            "uuid.bin": 16, "_metadata.json": 100, "_thumbnail.png": 1000,
+            "ni": 512, "li": 64, "ri": 64, "si": 64, "bt": 0x20,
+            "rf/000/00000000": 5000, "sf/000/00000000": 9000,
+        })
+        files = story_files(archive)
+
+        assert files == {"ni": 512, "li": 64, "ri": 64, "si": 64,
+                         "rf/000/00000000": 5000, "sf/000/00000000": 9000, "bt": BT_SIZE}
+        assert archive.reads == []
+
+    def test_5_flam_files(self):
+        archive = FakeArchive(TYPE_FLAM_ZIP, {"bt": 0x20, "main.lsf": 3000, "script/a.lsf": 100})
+        assert story_files(archive) == {"bt": 0x20, "main.lsf": 3000, "script/a.lsf": 100}
+
+    def test_6_footprint(self):
+        archive = FakeArchive(TYPE_PLAIN, {
+            "ni": 512, "li": 64, "ri": 64, "si": 64,
+            "rf/000/00000000": 5000, "rf/000/00000001": 0, "sf/000/00000000": 9000,
+        })
+        # ni li ri si bt : one cluster each, 5000 : two, 9000 : three, empty file : none
+        # story dir, rf, rf/000, sf, sf/000 : one cluster each
+        assert story_footprint(archive, CLUSTER) == (5 + 2 + 3 + 5) * CLUSTER
+
+    def test_7_studio_audio_unknown_duration(self):
+        archive = FakeArchive(TYPE_STUDIO_ZIP, {"story.json": 5000, "assets/b.ogg": b"\x00" * 1000})
+        files = story_files(archive)
+
+        # source assumed to be at the lowest bitrate
+        assert files["sf/000/b.ogg"] == 1000 * 8 // MIN_SOURCE_BITRATE * TRANSCODED_AUDIO_BITRATE // 8
+
+    def test_8_studio_audio_from_first_bytes(self):
+        # stereo MP3 without VBR header, sized from the frames probed
+        mp3 = mp3_data(2000, mode=b"\x00")
+        assert len(mp3) > AUDIO_PROBE_SIZE
+        assert mp3_frames_bitrate(mp3[:AUDIO_PROBE_SIZE]) == 64000
+        assert mp3_frames_bitrate(b"\x00" * 1000) == 0
+
+        # streamed WAV, header sizes left empty
+        wav = bytearray(wav_data(10))
+        wav[4:8] = wav[40:44] = b"\xff\xff\xff\xff"
+        archive = FakeArchive(TYPE_STUDIO_ZIP, {"story.json": 5000, "assets/a.mp3": mp3, "assets/b.wav": bytes(wav)})
+        files = story_files(archive)
+
+        assert files["sf/000/a.mp3"] == int(len(mp3) * 8 / 64000 * TRANSCODED_AUDIO_BITRATE / 8)
+        assert files["sf/000/b.wav"] == int(len(wav) * 8 / WAV_BITRATE * TRANSCODED_AUDIO_BITRATE / 8)
+        assert archive.reads == []
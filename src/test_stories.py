@@ -0,0 +1,183 @@
+import unittest
+from io import BytesIO
+from uuid import UUID, uuid4
+
+from pkg.api.stories import NI_CHUNK_NODES, NI_HEADER_SIZE, NODE_SIZE, Story, StoryList, StudioStory
+
+UUID_A = UUID("9D9521E5-84AC-4CC8-9B09-8D0AFFB5D68A")
+UUID_B = UUID("22137B29-8646-4335-8069-4A4C9A2D7E89")
+# same 8 last digits as UUID_A
+UUID_C = UUID("9C836C24-34C4-4CC1-B9E6-D864FFB5D68A")
+UUID_D = UUID("0B7C4C21-1F3A-4B6E-8E4D-6F2C0A1B2C3D")
+
+
+class testStoryList(unittest.TestCase):
+
+    def setUp(self):
+        self.slist = StoryList([Story(UUID_A), Story(UUID_B), Story(UUID_C)])
+
+    def uuids(self, key_part):
+        return [one_story.uuid for one_story in self.slist.matching_stories(key_part)]
+
+    def test_1_lookups(self):
+        # full UUID, any case, with or without dashes
+        for key in [str(UUID_B), str(UUID_B).lower(), UUID_B.hex, UUID_B.hex.upper()]:
+            assert key in self.slist
+            assert self.slist.get_story(key).uuid == UUID_B
+        assert self.uuids(str(UUID_A)) == [UUID_A]
+
+        # partial UUIDs
+        assert self.slist.get_story("9a2d7e89").uuid == UUID_B
+        assert self.slist.get_story("8646-4335").uuid == UUID_B
+        assert self.slist.get_story("22137B29").uuid == UUID_B
+        assert self.uuids("FFB5D68A") == [UUID_A, UUID_C]
+        assert self.slist.get_story("ffb5d68a").uuid == UUID_A
+
+        # a partial key never spans two stories
+        assert UUID_A.hex[-4:] + UUID_B.hex[:4] not in self.slist
+        assert str(UUID_D) not in self.slist
+        assert "6F2C0A1B" not in self.slist
+        assert self.slist.get_story("6F2C0A1B") is None
+        assert self.uuids("6F2C0A1B") == []
+
+    def test_2_duplicates(self):
+        self.slist.append(Story(UUID_B))
+        assert self.uuids(str(UUID_B)) == [UUID_B, UUID_B]
+        assert self.uuids("9A2D7E89") == [UUID_B, UUID_B]
+
+    def test_3_mutators(self):
+        # each change after a lookup (indexes built) is seen by next one
+        def check(*uuids):
+            assert [one_story.uuid for one_story in self.slist] == list(uuids)
+            for one_uuid in [UUID_A, UUID_B, UUID_C, UUID_D]:
+                assert (str(one_uuid) in self.slist) == (one_uuid in uuids)
+                assert (one_uuid.hex[8:16] in self.slist) == (one_uuid in uuids)
+
+        check(UUID_A, UUID_B, UUID_C)
+        self.slist.append(Story(UUID_D))
+        check(UUID_A, UUID_B, UUID_C, UUID_D)
+        self.slist.remove(UUID_B)
+        check(UUID_A, UUID_C, UUID_D)
+        self.slist.insert(0, Story(UUID_B))
+        check(UUID_B, UUID_A, UUID_C, UUID_D)
+        self.slist.pop()
+        check(UUID_B, UUID_A, UUID_C)
+        self.slist.reverse()
+        check(UUID_C, UUID_A, UUID_B)
+        self.slist.sort(key=lambda one_story: one_story.str_uuid)
+        check(UUID_B, UUID_C, UUID_A)
+        self.slist[0] = Story(UUID_D)
+        check(UUID_D, UUID_C, UUID_A)
+        del self.slist[1]
+        check(UUID_D, UUID_A)
+        self.slist.extend([Story(UUID_B)])
+        check(UUID_D, UUID_A, UUID_B)
+        self.slist += [Story(UUID_C)]
+        check(UUID_D, UUID_A, UUID_B, UUID_C)
+        self.slist *= 1
+        check(UUID_D, UUID_A, UUID_B, UUID_C)
+        self.slist.clear()
+        check()
+
+    def test_4_empty_key(self):
+        assert self.slist.get_story("").uuid == UUID_A
+        assert self.uuids("-") == [UUID_A, UUID_B, UUID_C]
+        assert "\n" not in self.slist
+
+
+# previous ni / li packing, one field at a time
+def reference_ni(story):
+    def transition(trans_node):
+        if not trans_node:
+            return b"\xFF\xFF\xFF\xFF" * 3
+        anode = next(one_node for one_node in story.js_anodes if one_node.get('id') == trans_node.get("actionNode"))
+        return (anode.get("global_index").to_bytes(4, byteorder='little', signed=True)
+                + len(anode.get('options')).to_bytes(4, byteorder='little', signed=True)
+                + trans_node.get('optionIndex').to_bytes(4, byteorder='little', signed=True))
+
+    ni_buffer = int(story.format_version[1:]).to_bytes(2, byteorder='little')
+    ni_buffer += int(story.pack_version).to_bytes(2, byteorder='little')
+    for value in [NI_HEADER_SIZE, NODE_SIZE, len(story.js_snodes), len(story.ri), len(story.si)]:
+        ni_buffer += value.to_bytes(4, byteorder='little')
+    ni_buffer += b"\x01"
+    ni_buffer += b"\x00" * (NI_HEADER_SIZE - len(ni_buffer))
+
+    for snode in story.js_snodes:
+        ri_index = story.ri[snode['image']][1] if snode.get('image') in story.ri else -1
+        si_index = story.si[snode['audio']][1] if snode.get('audio') in story.si else -1
+        node = ri_index.to_bytes(4, byteorder='little', signed=True) + si_index.to_bytes(4, byteorder='little', signed=True)
+        node += transition(snode.get("okTransition")) + transition(snode.get("homeTransition"))
+        controls = snode.get("controlSettings")
+        if controls:
+            for name in ["wheel", "ok", "home", "pause", "autoplay"]:
+                node += controls.get(name).to_bytes(2, byteorder="little")
+            node += b"\x00\x00"
+        ni_buffer += node + b"\xAA" * (NODE_SIZE - len(node))
+    return ni_buffer
+
+
+def reference_li(story):
+    li_buffer = b"".join(index.to_bytes(4, byteorder='little', signed=True) for index in story.li)
+    return li_buffer.ljust(8, b"\x00")
+
+
+def story_json(node_count, options_per_action=2):
+    snodes = []
+    anodes = []
+    for index in range(node_count):
+        snode = {"uuid": str(uuid4()),
+                 "image": f"assets/{index % 7:08X}.png" if index % 3 else None,
+                 "audio": f"assets/{index % 5:08X}.mp3" if index % 4 else None}
+        # missing, int and bool controls
+        if index % 3 == 1:
+            snode["controlSettings"] = {"wheel": 1, "ok": 1, "home": 0, "pause": 1, "autoplay": 0}
+        elif index % 3 == 2:
+            snode["controlSettings"] = {"wheel": True, "ok": False, "home": True, "pause": False, "autoplay": True}
+        snodes.append(snode)
+
+    for index in range(0, node_count, options_per_action):
+        options = [snode["uuid"] for snode in snodes[index:index + options_per_action]]
+        # option not found among stage nodes
+        if index % 4 == 0:
+            options.append(str(uuid4()))
+        anodes.append({"id": f"action-{index}", "options": options})
+
+    for index, snode in enumerate(snodes):
+        if anodes and index % 2 == 0:
+            anode = anodes[index // 2 % len(anodes)]
+            snode["okTransition"] = {"actionNode": anode["id"], "optionIndex": index % len(anode["options"])}
+        if anodes and index % 5 == 0:
+            snode["homeTransition"] = {"actionNode": anodes[0]["id"], "optionIndex": 0}
+    return {"format": "v1", "version": 3, "title": "Story", "description": "", "stageNodes": snodes, "actionNodes": anodes}
+
+
+class testStudioStory(unittest.TestCase):
+
+    def check(self, story):
+        ni = story.get_ni_data()
+        assert ni == reference_ni(story)
+        assert story.get_li_data() == reference_li(story)
+
+        fp = BytesIO()
+        story.write_ni(fp)
+        assert fp.getvalue() == ni
+
+    def test_1_sample(self):
+        story = StudioStory(story_json(30))
+        assert story.compatible
+        assert -1 in story.li
+        self.check(story)
+
+    def test_2_chunks(self):
+        # several write_ni() chunks, last one partial
+        self.check(StudioStory(story_json(2 * NI_CHUNK_NODES + 3, options_per_action=5)))
+
+    def test_3_small_stories(self):
+        # li shorter than padding : no option, a single one
+        for option_count in [0, 1]:
+            js_story = story_json(1)
+            js_story["actionNodes"][0]["options"] = js_story["actionNodes"][0]["options"][:option_count]
+            story = StudioStory(js_story)
+            assert len(story.li) == option_count
+            self.check(story)
+            assert len(story.get_li_data()) == 8
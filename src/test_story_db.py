@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from pkg.api.story_db import StoryDB, official_row, third_party_row, SOURCE_OFFICIAL, SOURCE_THIRD_PARTY
+
+UUID_A = "9D9521E5-84AC-4CC8-9B09-8D0AFFB5D68A"
+UUID_B = "22137B29-8646-4335-8069-4A4C9A2D7E89"
+# same 8 last digits as UUID_A
+UUID_C = "9C836C24-34C4-4CC1-B9E6-D864FFB5D68A"
+
+
+class testStoryDB(unittest.TestCase):
+
+    def setUp(self):
+        self.root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.db = StoryDB(str(self.root.joinpath("cfg", "stories.sqlite")))
+        self.addCleanup(self.db.close)
+
+    def json_db(self, name, entries):
+        json_path = self.root.joinpath(name)
+        with open(json_path, "w", encoding="utf-8") as fp:
+            json.dump({entry["uuid"]: entry for entry in entries}, fp)
+        return json_path
+
+    def load(self):
+        official = self.json_db("official.json", [{"uuid": UUID_A.lower(), "title": "Official A"}])
+        third_party = self.json_db("thirdparty.json", [{"uuid": UUID_A, "title": "Third party A"},
+                                                       {"uuid": UUID_B, "title": "Third party B"},
+                                                       {"uuid": UUID_C, "title": "Third party C"}])
+        assert self.db.sync_source(SOURCE_OFFICIAL, official, official_row)
+        assert self.db.sync_source(SOURCE_THIRD_PARTY, third_party, third_party_row)
+        return official, third_party
+
+    def test_1_find_uuid(self):
+        self.load()
+
+        # full, short (device directory) and partial UUIDs, any case
+        assert self.db.find_uuid(UUID_B) == UUID_B
+        assert self.db.find_uuid(UUID_B.lower()) == UUID_B
+        assert self.db.find_uuid("9A2D7E89") == UUID_B
+        assert self.db.find_uuid("9a2d7e89") == UUID_B
+        assert self.db.find_uuid("4A4C9A2D") == UUID_B
+        assert self.db.find_uuid("8646-4335") == UUID_B
+        assert self.db.find_uuid("22137B29") == UUID_B
+
+        assert self.db.find_uuid("00000000-0000-0000-0000-000000000000") is None
+        assert self.db.find_uuid("00000000") is None
+        assert self.db.find_uuid("0000-0000") is None
+
+    def test_2_find_uuid_official_first(self):
+        self.load()
+
+        assert self.db.find_uuid(UUID_A) == UUID_A
+        assert self.db.title(UUID_A) == "Official A"
+        assert self.db.is_official(UUID_A)
+        assert not self.db.is_official(UUID_C)
+
+        # shared short UUID, official one first
+        assert self.db.find_uuid("FFB5D68A") == UUID_A
+        self.db.drop_source(SOURCE_OFFICIAL)
+        assert self.db.find_uuid(UUID_C) == UUID_C
+        assert self.db.title(UUID_A) == "Third party A"
+
+    def test_3_sync_source(self):
+        official, third_party = self.load()
+
+        # unchanged sources are not reimported
+        assert not self.db.sync_source(SOURCE_OFFICIAL, official, official_row)
+        assert not self.db.sync_source(SOURCE_THIRD_PARTY, third_party, third_party_row)
+
+        self.json_db("thirdparty.json", [{"uuid": UUID_B, "title": "Third party B, again"}])
+        assert self.db.sync_source(SOURCE_THIRD_PARTY, third_party, third_party_row)
+        assert self.db.find_uuid(UUID_C) is None
+        assert self.db.title(UUID_B) == "Third party B, again"
+        assert self.db.count(SOURCE_THIRD_PARTY) == 1
+
+    def test_4_malformed_source(self):
+        self.load()
+
+        broken = self.root.joinpath("broken.json")
+        with open(broken, "w", encoding="utf-8") as fp:
+            json.dump({UUID_B: {"title": "no uuid"}}, fp)
+        with self.assertRaises(ValueError):
+            self.db.sync_source(SOURCE_THIRD_PARTY, broken, third_party_row)
+        # previous rows kept
+        assert self.db.find_uuid("9A2D7E89") == UUID_B
+
+    def test_5_corrupted_file(self):
+        self.load()
+        self.db.close()
+        with open(self.db.db_path, "wb") as fp:
+            fp.write(b"not a database" * 100)
+        for suffix in ["-wal", "-shm"]:
+            Path(self.db.db_path + suffix).unlink(missing_ok=True)
+
+        # rebuilt, empty until sources are imported again
+        assert self.db.find_uuid(UUID_B) is None
+        assert self.db.count(SOURCE_THIRD_PARTY) == 0
+        assert os.path.getsize(self.db.db_path)
@@ -0,0 +1,91 @@
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from Crypto.Cipher import AES
+
+from pkg.api.story_keys import StoryKeyCache
+
+
+class testStoryKeyCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = StoryKeyCache()
+        self.bt_path = Path(self.enterContext(tempfile.TemporaryDirectory())).joinpath("bt")
+        self.bt_path.write_bytes(b"bt v1")
+        self.loads = []
+
+    def load(self, bt_path):
+        self.loads.append(bt_path)
+        with open(bt_path, "rb") as fp:
+            return fp.read()
+
+    def test_1_cbc(self):
+        key = os.urandom(16)
+        iv = os.urandom(16)
+        for length in [0, 16, 48, 512, 1024]:
+            plain = os.urandom(length)
+            ciphered = AES.new(key, AES.MODE_CBC, iv).encrypt(plain)
+
+            buffer = bytearray(plain)
+            self.cache.encrypt_into(key, iv, buffer)
+            assert buffer == ciphered
+            self.cache.decrypt_into(key, iv, buffer)
+            assert buffer == plain
+
+            # header of a larger buffer
+            buffer = bytearray(ciphered + b"payload")
+            with memoryview(buffer) as view:
+                self.cache.decrypt_into(key, iv, view[:length])
+            assert buffer == plain + b"payload"
+
+        with self.assertRaises(ValueError):
+            self.cache.decrypt_into(key, iv, bytearray(100))
+
+    def test_2_key_schedules(self):
+        keys = [os.urandom(16) for _ in range(3)]
+        for _ in range(10):
+            for key in keys:
+                self.cache.decrypt_into(key, bytes(16), bytearray(512))
+        # one per key, reused for each header
+        assert self.cache.stats.contexts == len(keys)
+
+    def test_3_entries(self):
+        assert self.cache.get(self.bt_path, self.load) == b"bt v1"
+        assert self.cache.get(str(self.bt_path), self.load) == b"bt v1"
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+        # replaced bt
+        self.bt_path.write_bytes(b"bt v2 !")
+        assert self.cache.get(self.bt_path, self.load) == b"bt v2 !"
+
+        # same size and mtime (FAT resolution)
+        self.cache.invalidate(self.bt_path)
+        assert self.cache.get(self.bt_path, self.load) == b"bt v2 !"
+        assert len(self.loads) == 3
+
+        # missing bt never cached
+        missing = self.bt_path.with_name("missing")
+        load_missing = lambda bt_path: b"md keys"
+        assert self.cache.get(missing, load_missing) == b"md keys"
+        assert self.cache.get(missing, load_missing) == b"md keys"
+        assert (self.cache.hits, self.cache.misses) == (1, 5)
+
+    def test_4_threads(self):
+        calls = 200
+        barrier = threading.Barrier(8)
+
+        def scan():
+            barrier.wait()
+            for _ in range(calls):
+                assert self.cache.get(self.bt_path, self.load) == b"bt v1"
+
+        threads = [threading.Thread(target=scan) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert self.cache.hits + self.cache.misses == 8 * calls
+        assert self.cache.misses == len(self.loads)
@@ -0,0 +1,168 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from uuid import UUID
+
+from pkg.api.story_staging import StoryStaging, STAGING_JOURNAL
+
+UUID_A = UUID("9D9521E5-84AC-4CC8-9B09-8D0AFFB5D68A")
+UUID_B = UUID("22137B29-8646-4335-8069-4A4C9A2D7E89")
+
+
+class testStoryStaging(unittest.TestCase):
+
+    def setUp(self):
+        root = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.staging_dir = root.joinpath(".staging")
+        self.content_dir = root.joinpath(".content")
+        self.staging = StoryStaging(self.staging_dir, self.content_dir)
+
+    # staged story, interrupted before (no bt) or after its last file
+    def stage(self, staging, story_uuid, complete):
+        stage_path = staging.begin(story_uuid)
+        stage_path.joinpath("ni").write_bytes(b"ni")
+        if complete:
+            stage_path.joinpath("bt").write_bytes(b"bt")
+        return stage_path
+
+    def journal(self):
+        with open(self.staging_dir.joinpath(STAGING_JOURNAL), encoding="utf-8") as fp:
+            return json.load(fp)
+
+    def test_1_begin_commit(self):
+        stage_path = self.stage(self.staging, UUID_A, True)
+        assert stage_path == self.staging_dir.joinpath("FFB5D68A")
+        assert self.journal() == [str(UUID_A)]
+
+        story_path = self.staging.commit(UUID_A)
+        assert story_path == self.content_dir.joinpath("FFB5D68A")
+        assert story_path.joinpath("bt").is_file()
+        assert not stage_path.exists()
+        # kept until .pi is written
+        assert self.journal() == [str(UUID_A)]
+
+        self.staging.done()
+        assert not self.staging_dir.exists()
+
+    def test_2_recover_bt_present(self):
+        self.stage(self.staging, UUID_A, True)
+
+        # next device opening
+        staging = StoryStaging(self.staging_dir, self.content_dir)
+        assert staging.recover() == [UUID_A]
+        assert self.content_dir.joinpath("FFB5D68A", "bt").is_file()
+        assert not staging.story_dir(UUID_A).exists()
+
+        # journal dropped once .pi is updated
+        staging.done()
+        assert not self.staging_dir.exists()
+
+    def test_3_recover_bt_absent(self):
+        self.stage(self.staging, UUID_A, False)
+
+        staging = StoryStaging(self.staging_dir, self.content_dir)
+        assert staging.recover() == []
+        assert not staging.story_dir(UUID_A).exists()
+        assert not self.content_dir.joinpath("FFB5D68A").exists()
+
+        staging.done()
+        assert not self.staging_dir.exists()
+
+    def test_4_recover_committed_before_crash(self):
+        # renamed into content dir, .pi not written
+        self.stage(self.staging, UUID_A, True)
+        self.staging.commit(UUID_A)
+        self.stage(self.staging, UUID_B, False)
+
+        staging = StoryStaging(self.staging_dir, self.content_dir)
+        assert staging.recover() == [UUID_A]
+        assert self.content_dir.joinpath("FFB5D68A", "bt").is_file()
+        assert not self.content_dir.joinpath("9A2D7E89").exists()
+        assert not staging.story_dir(UUID_B).exists()
+
+    def test_5_recover_unjournaled_leftovers(self):
+        self.stage(self.staging, UUID_A, True)
+        stray_dir = self.staging_dir.joinpath("12345678")
+        stray_dir.mkdir()
+        stray_dir.joinpath("bt").write_bytes(b"bt")
+        self.staging_dir.joinpath(STAGING_JOURNAL + ".tmp").write_text("[]", encoding="utf-8")
+
+        staging = StoryStaging(self.staging_dir, self.content_dir)
+        assert staging.recover() == [UUID_A]
+        assert not stray_dir.exists()
+        assert not self.content_dir.joinpath("12345678").exists()
+        assert [entry.name for entry in self.staging_dir.iterdir()] == [STAGING_JOURNAL]
+
+    def test_6_recover_without_staging(self):
+        assert self.staging.recover() == []
+        assert not self.staging_dir.exists()
+
+    def test_7_rollback_one(self):
+        self.stage(self.staging, UUID_A, True)
+        self.staging.commit(UUID_A)
+        self.stage(self.staging, UUID_B, True)
+
+        # committed story is left in place
+        self.staging.rollback(UUID_A)
+        assert self.content_dir.joinpath("FFB5D68A", "bt").is_file()
+        assert self.journal() == [str(UUID_A), str(UUID_B)]
+
+        self.staging.rollback(UUID_B)
+        assert not self.staging.story_dir(UUID_B).exists()
+        assert self.journal() == [str(UUID_A)]
+
+    def test_8_rollback_all(self):
+        self.stage(self.staging, UUID_A, True)
+        self.staging.commit(UUID_A)
+        self.stage(self.staging, UUID_B, False)
+
+        self.staging.rollback()
+        assert not self.staging.story_dir(UUID_B).exists()
+        assert self.content_dir.joinpath("FFB5D68A", "bt").is_file()
+        assert self.staging.journal == [UUID_A]
+        assert self.journal() == [str(UUID_A)]
+
+        self.staging.done()
+        assert not self.staging_dir.exists()
+
+    def test_9_rollback_uncommitted_only(self):
+        self.stage(self.staging, UUID_A, False)
+        self.stage(self.staging, UUID_B, True)
+
+        self.staging.rollback()
+        assert self.staging.journal == []
+        assert not self.staging_dir.exists()
+        assert not self.content_dir.exists()
+
+    def test_10_recover_unreadable_journal(self):
+        self.stage(self.staging, UUID_A, True)
+        self.staging_dir.joinpath(STAGING_JOURNAL).write_text("[\"9D9521E5", encoding="utf-8")
+
+        staging = StoryStaging(self.staging_dir, self.content_dir)
+        with self.assertLogs(staging.logger, "WARNING"):
+            assert staging.recover() == []
+        assert staging.journal == []
+        # nothing journaled, staged story is dropped
+        assert not staging.story_dir(UUID_A).exists()
+        assert not self.content_dir.exists()
+
+        staging.done()
+        assert not self.staging_dir.exists()
+
+    def test_11_commit_keeps_existing_dir(self):
+        # lost story, or another one with the same short UUID
+        existing = self.content_dir.joinpath("FFB5D68A")
+        existing.mkdir(parents=True)
+        existing.joinpath("bt").write_bytes(b"other bt")
+
+        stage_path = self.stage(self.staging, UUID_A, True)
+        with self.assertLogs(self.staging.logger, "ERROR"):
+            assert self.staging.commit(UUID_A) is None
+        assert existing.joinpath("bt").read_bytes() == b"other bt"
+        assert [entry.name for entry in existing.iterdir()] == ["bt"]
+        # staged story rolled back
+        assert not stage_path.exists()
+        assert self.staging.journal == []
+        self.staging.done()
+        assert not self.staging_dir.exists()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from pkg.api.transcode_cache import TranscodeCache
+
+
+class testTranscodeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.cache = TranscodeCache(str(self.cache_dir), max_size=1000)
+
+    def entries(self):
+        return sorted(entry.name for entry in self.cache_dir.iterdir())
+
+    def test_1_get_put(self):
+        key = TranscodeCache.key(b"source", "-ac 1")
+        assert key != TranscodeCache.key(b"source", "-ac 2")
+        assert self.cache.get(key) is None
+
+        self.cache.put(key, b"converted")
+        assert self.cache.get(key) == b"converted"
+        assert (self.cache.hits, self.cache.misses) == (1, 1)
+
+        # too large to be cached
+        self.cache.put("large", bytes(1001))
+        assert self.entries() == [key]
+
+    def test_2_replaced_entry(self):
+        self.cache.put("a", bytes(400))
+        # same key written again, its previous size is not counted twice
+        with mock.patch.object(self.cache, "evict", wraps=self.cache.evict) as evict:
+            for _ in range(5):
+                self.cache.put("a", bytes(400))
+            self.cache.put("b", bytes(400))
+            evict.assert_not_called()
+        assert self.entries() == ["a", "b"]
+
+        self.cache.put("c", bytes(400))
+        assert len(self.entries()) == 2
+
+    def test_3_eviction(self):
+        for name in ["a", "b", "c"]:
+            self.cache.put(name, bytes(300))
+            os.utime(self.cache_dir.joinpath(name), (0, 0))
+        # LRU : a read refreshes an entry
+        assert self.cache.get("a")
+
+        self.cache.put("d", bytes(300))
+        assert self.entries() == ["a", "c", "d"]
+
+    def test_4_failed_write(self):
+        with mock.patch("os.fdopen", side_effect=OSError("disk full")):
+            self.cache.put("a", b"converted")
+        with mock.patch("os.replace", side_effect=OSError("access denied")):
+            self.cache.put("b", b"converted")
+        # no leftover
+        assert self.entries() == []
+        assert self.cache.get("a") is None and self.cache.get("b") is None
+
+    def test_5_disabled(self):
+        cache = TranscodeCache(str(self.cache_dir.joinpath("disabled")), max_size=0)
+        cache.put("a", b"converted")
+        assert cache.get("a") is None
+        assert not self.cache_dir.joinpath("disabled").exists()